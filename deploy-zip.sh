@@ -19,15 +19,37 @@ if [ ! -d "$PROJECT_PATH" ]; then
 fi
 
 echo "Pakowanie projektu..."
-FILE_CONTENT=$(tar czf - -C $(dirname "$PROJECT_PATH") $(basename "$PROJECT_PATH") | base64 -w 0)
+ARCHIVE=$(mktemp --suffix=.tar.gz)
+trap 'rm -f "$ARCHIVE"' EXIT
+# Deterministyczne archiwum: ta sama zawartość daje ten sam hash
+tar --sort=name -cf - -C $(dirname "$PROJECT_PATH") $(basename "$PROJECT_PATH") | gzip -n > "$ARCHIVE"
+SHA256=$(sha256sum "$ARCHIVE" | cut -d' ' -f1)
+
+STATUS=$(curl -s -o /dev/null -w "%{http_code}" -I "$DEPLOY_URL/blobs/$SHA256")
+if [ "$STATUS" = "200" ]; then
+    echo "Serwer ma już archiwum $SHA256, pomijam wysyłanie"
+else
+    echo "Wysyłanie archiwum do serwera deploymentu..."
+    RESPONSE=$(mktemp)
+    trap 'rm -f "$ARCHIVE" "$RESPONSE"' EXIT
+    # Jak curl -f, ale z treścią błędu serwera (--fail-with-body wymaga curl 7.76)
+    STATUS=$(curl -sS -o "$RESPONSE" -w "%{http_code}" -X PUT "$DEPLOY_URL/blobs/$SHA256" \
+      -H "Content-Type: application/gzip" \
+      -T "$ARCHIVE") || STATUS=000
+    if [ "$STATUS" -lt 200 ] || [ "$STATUS" -ge 300 ]; then
+        echo "Błąd: wysyłanie archiwum nie powiodło się (HTTP $STATUS)" >&2
+        cat "$RESPONSE" >&2
+        echo >&2
+        exit 1
+    fi
+fi
 
-echo "Wysyłanie do serwera deploymentu..."
 curl -X POST "$DEPLOY_URL" \
   -H "Content-Type: application/json" \
   -d "{
     \"domain\": \"$DOMAIN\",
     \"cf_token\": \"$CF_TOKEN\",
-    \"source\": \"data:application/tar+gz;base64,$FILE_CONTENT\"
+    \"blob\": \"$SHA256\"
   }"
 
 echo -e "\nDeployment rozpoczęty!"
\ No newline at end of file
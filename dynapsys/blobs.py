@@ -0,0 +1,184 @@
+"""Content-addressed blob storage for DynaPsys uploads"""
+import os
+import re
+import hashlib
+import logging
+import shutil
+import tempfile
+import time
+from typing import BinaryIO, List, Optional
+
+from .uploads import DEFAULT_CHUNK_SIZE, UploadError
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_valid_digest(digest: str) -> bool:
+    """
+    Check that a string is a lowercase hex SHA-256 digest.
+
+    Args:
+        digest: Digest to validate
+
+    Returns:
+        bool: True if valid, False otherwise
+    """
+    return bool(digest) and bool(SHA256_PATTERN.match(digest))
+
+
+class BlobStore:
+    """
+    Store of uploaded files addressed by the SHA-256 of their content.
+
+    Looking a blob up refreshes its modification time, so collect() only
+    removes blobs no client asked for in a while.
+    """
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: Directory holding the blobs
+        """
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        """Path of a blob, sharded by the first two hex digits"""
+        if not is_valid_digest(digest):
+            raise ValueError(f"Invalid blob digest: {digest}")
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest: str) -> bool:
+        """Whether a blob is present"""
+        return self.size(digest) is not None
+
+    def size(self, digest: str) -> Optional[int]:
+        """Size of a blob in bytes, None if missing"""
+        try:
+            path = self.path(digest)
+            size = os.path.getsize(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return size
+
+    def collect(self, max_age: float, dry_run: bool = False) -> List[str]:
+        """
+        Remove blobs unused for a while and leftovers of interrupted uploads.
+
+        Args:
+            max_age: Seconds since a blob was last stored or looked up
+            dry_run: Only report what would be removed
+
+        Returns:
+            List[str]: Paths removed, or that would be removed
+        """
+        removed = []
+        if not os.path.isdir(self.root):
+            return removed
+        cutoff = time.time() - max_age
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.path.getmtime(path) >= cutoff:
+                        continue
+                    if not dry_run:
+                        os.unlink(path)
+                except OSError as e:
+                    logging.warning(f"Could not remove blob {path}: {str(e)}")
+                    continue
+                removed.append(path)
+        if removed and not dry_run:
+            logging.info(f"Removed {len(removed)} unused blobs")
+        return removed
+
+    def put_stream(
+        self,
+        source: BinaryIO,
+        length: int,
+        expected_digest: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> str:
+        """
+        Stream data into the store, hashing it on the way.
+
+        Args:
+            source: Readable stream
+            length: Number of bytes to read
+            expected_digest: Digest the content must match
+            chunk_size: Read size used while streaming
+
+        Returns:
+            str: SHA-256 digest of the stored content
+
+        Raises:
+            UploadError: If the upload is truncated or the digest does not match
+        """
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='blob-', dir=tmp_dir)
+        sha = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = source.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise UploadError(
+                            f"Upload truncated: {length - remaining} of {length} bytes received"
+                        )
+                    sha.update(chunk)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+
+            digest = sha.hexdigest()
+            if expected_digest and digest != expected_digest:
+                raise UploadError(f"Digest mismatch: expected {expected_digest}, got {digest}")
+
+            target = self.path(digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Atomic, and harmless if the same content was stored meanwhile
+            os.replace(tmp_path, target)
+            logging.info(f"Stored blob {digest} ({length} bytes)")
+            return digest
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def add_file(self, path: str, expected_digest: str) -> str:
+        """
+        Move an already written file into the store after verifying it.
+
+        Args:
+            path: File to move; it is consumed on success
+            expected_digest: Digest the content must match
+
+        Returns:
+            str: SHA-256 digest of the stored content
+
+        Raises:
+            UploadError: If the content does not match the digest
+        """
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        if digest != expected_digest:
+            raise UploadError(f"Digest mismatch: expected {expected_digest}, got {digest}")
+
+        target = self.path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        # Stage inside the store so the final rename is atomic
+        fd, tmp_path = tempfile.mkstemp(prefix='blob-', dir=tmp_dir)
+        os.close(fd)
+        try:
+            shutil.move(path, tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        logging.info(f"Stored blob {digest} from {path}")
+        return digest
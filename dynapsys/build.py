@@ -0,0 +1,682 @@
+"""Dependency caching for React builds"""
+import os
+import re
+import sys
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .config import config
+from .utils import stream_command
+
+# Dependency lockfiles, in order of preference
+LOCKFILES = ('package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock', 'pnpm-lock.yaml')
+
+# Lockfiles `npm ci` installs from
+NPM_LOCKFILES = ('package-lock.json', 'npm-shrinkwrap.json')
+
+# Lockfiles each supported package manager installs from
+PACKAGE_MANAGER_LOCKFILES = {
+    'npm': NPM_LOCKFILES,
+    'yarn': ('yarn.lock',),
+    'pnpm': ('pnpm-lock.yaml',),
+}
+
+# Registry requests logged by `--loglevel http`, e.g.
+# "npm http fetch GET 200 https://registry.npmjs.org/react 12ms (cache hit)"
+NPM_FETCH_PATTERN = re.compile(r'\bhttp fetch \w+ \d{3} \S+(?: .*?)?(?:\(cache (?P<cache>\w+)\))?\s*$')
+
+# Directories `npm run build` writes to, depending on the toolchain
+BUILD_OUTPUT_DIRS = ('build', 'dist', 'out', '.next')
+
+# How a built site is put online: served from its build output by the web
+# server, or run as a Node.js process under PM2
+ACTIVATION_MODES = ('auto', 'static', 'pm2')
+
+# Dependencies marking an app that renders on the server and needs Node.js
+SSR_PACKAGES = ('next', 'nuxt', '@remix-run/serve', '@remix-run/node',
+                '@sveltejs/adapter-node', '@angular/ssr')
+
+# Never part of the build inputs, at any depth
+SOURCE_EXCLUDES = ('.git', 'node_modules', '.cache')
+
+# Environment variables bundlers inline into the build output
+BUILD_ENV_PREFIXES = ('NODE_', 'BABEL_ENV', 'PUBLIC_URL', 'GENERATE_SOURCEMAP',
+                      'REACT_APP_', 'VITE_', 'NEXT_PUBLIC_')
+
+# Written into node_modules after an install, holding the dependency cache key
+DEPS_MARKER = '.dynapsys-deps'
+
+# Build tools write their caches here; they must not be shared through hardlinks
+NODE_MODULES_EXCLUDES = ('.cache',)
+
+
+def find_lockfile(project_dir: str, names: Sequence[str] = LOCKFILES) -> Optional[str]:
+    """
+    Find the dependency lockfile of a project.
+
+    Args:
+        project_dir: Project directory
+        names: Lockfile names to look for, in order of preference
+
+    Returns:
+        Optional[str]: Path of the lockfile, None if there is none
+    """
+    for name in names:
+        path = os.path.join(project_dir, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def detect_package_manager(project_dir: str) -> Tuple[str, Optional[str]]:
+    """
+    Find the package manager a project is meant to be installed with.
+
+    The `packageManager` field of package.json (as used by corepack) wins,
+    then the lockfile; projects with neither use npm.
+
+    Args:
+        project_dir: Project directory
+
+    Returns:
+        Tuple[str, Optional[str]]: Package manager name and version if pinned
+    """
+    try:
+        with open(os.path.join(project_dir, 'package.json'), 'r') as f:
+            field = json.load(f).get('packageManager')
+    except (OSError, ValueError, AttributeError):
+        field = None
+    if isinstance(field, str):
+        name, _, version = field.partition('@')
+        if name in PACKAGE_MANAGER_LOCKFILES:
+            return name, version.split('+')[0] or None
+        logging.warning(f"Unsupported packageManager {field}, detecting from lockfile")
+
+    lockfile = find_lockfile(project_dir)
+    if lockfile is not None:
+        for name, lockfiles in PACKAGE_MANAGER_LOCKFILES.items():
+            if os.path.basename(lockfile) in lockfiles:
+                return name, None
+    return 'npm', None
+
+
+def detect_activation(project_dir: str, mode: str = 'auto') -> Tuple[str, Optional[str]]:
+    """
+    Decide how a built project is put online.
+
+    Static exports (`out/`) and plain single-page apps (`build/`, `dist/`)
+    are served as files; server-rendered frameworks need PM2.
+
+    Args:
+        project_dir: Built project directory
+        mode: 'auto' to detect, or 'static' / 'pm2' to force a mode
+
+    Returns:
+        Tuple[str, Optional[str]]: 'static' and the output directory (None if
+        static was forced but nothing was built), or 'pm2' and None
+    """
+    def output_dir(names):
+        for name in names:
+            path = os.path.join(project_dir, name)
+            if os.path.isfile(os.path.join(path, 'index.html')):
+                return path
+        return None
+
+    if mode == 'pm2':
+        return 'pm2', None
+    static_dir = output_dir(('out',))
+    if static_dir is None and mode == 'auto':
+        try:
+            with open(os.path.join(project_dir, 'package.json'), 'r') as f:
+                package = json.load(f)
+            dependencies = dict(package.get('dependencies') or {})
+        except (OSError, ValueError, AttributeError):
+            dependencies = {}
+        ssr = [name for name in SSR_PACKAGES if name in dependencies]
+        if ssr:
+            logging.info(f"Server-rendered app ({', '.join(ssr)}), activating with PM2")
+            return 'pm2', None
+    if static_dir is None:
+        static_dir = output_dir(('build', 'dist'))
+    if static_dir is None and mode == 'auto':
+        return 'pm2', None
+    return 'static', static_dir
+
+
+def node_version() -> str:
+    """Version of the installed Node.js, 'unknown' if it cannot be run"""
+    try:
+        return subprocess.check_output(
+            ['node', '--version'], stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return 'unknown'
+
+
+def platform_tag() -> str:
+    """Operating system and architecture native modules are built for"""
+    return f"{sys.platform}-{platform.machine()}"
+
+
+def _reflink_tree(source: str, target: str) -> bool:
+    """Copy a tree with copy-on-write clones, False if the filesystem cannot"""
+    result = subprocess.run(
+        ['cp', '-a', '--reflink=always', source, target],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    if result.returncode != 0 and os.path.lexists(target):
+        shutil.rmtree(target)
+    return result.returncode == 0
+
+
+def link_tree(source: str, target: str, excludes: Sequence[str] = (),
+              hardlink: bool = True) -> str:
+    """
+    Recreate a directory tree sharing file contents with the source.
+
+    Reflinks are used where the filesystem supports them, hardlinks
+    otherwise; files on another filesystem are copied. Symlinks are
+    recreated as they are.
+
+    Args:
+        source: Existing tree
+        target: Path of the new tree, must not exist
+        excludes: Directory names skipped at any depth
+        hardlink: False to copy files the filesystem cannot reflink
+
+    Returns:
+        str: 'reflink', 'hardlink' or 'copy'
+    """
+    if not excludes and _reflink_tree(source, target):
+        return 'reflink'
+
+    os.makedirs(target)
+    for dirpath, dirnames, filenames in os.walk(source):
+        rel_path = os.path.relpath(dirpath, source)
+        target_dir = target if rel_path == '.' else os.path.join(target, rel_path)
+        descend = []
+        for name in dirnames:
+            if name in excludes:
+                continue
+            src, dst = os.path.join(dirpath, name), os.path.join(target_dir, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            else:
+                os.mkdir(dst)
+                shutil.copystat(src, dst)
+                descend.append(name)
+        dirnames[:] = descend
+        for name in filenames:
+            src, dst = os.path.join(dirpath, name), os.path.join(target_dir, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                continue
+            if not hardlink:
+                shutil.copy2(src, dst)
+                continue
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+    return 'hardlink' if hardlink else 'copy'
+
+
+def tree_size(path: str) -> int:
+    """Total size in bytes of the files below a directory"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+class CacheStore:
+    """
+    Directory of cache entries with a size budget.
+
+    Each entry is a directory named by its key whose meta.json records its
+    size. Entries are evicted least recently used first once the store
+    exceeds its budget; restores touch an entry and hold a shared lock so
+    eviction never removes an entry while it is being copied out.
+    """
+
+    # Used in log messages
+    label = 'cache'
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        """
+        Args:
+            root: Directory holding one entry per key
+            max_bytes: Size budget of all entries together, 0 for none
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> str:
+        """Directory of a cache entry"""
+        return os.path.join(self.root, key)
+
+    def _lock(self, mode: int):
+        os.makedirs(self.root, exist_ok=True)
+        lock = open(os.path.join(self.root, '.lock'), 'w')
+        fcntl.flock(lock, mode)
+        return lock
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits its budget"""
+        if not self.max_bytes:
+            return
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                with open(os.path.join(path, 'meta.json'), 'r') as f:
+                    size = json.load(f)['size']
+            except (OSError, ValueError, KeyError):
+                size = tree_size(path)
+            entries.append((os.path.getmtime(path), size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logging.info(f"Evicting {self.label} entry {os.path.basename(path)} ({size} bytes)")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+class DependencyCache(CacheStore):
+    """
+    Shared store of installed node_modules trees.
+
+    Entries are keyed by the lockfile, Node.js version and platform, so a
+    tree is only reused where the same install would produce it.
+    """
+
+    label = 'dependency cache'
+
+    def key(self, project_dir: str) -> Optional[str]:
+        """
+        Cache key of a project's dependencies.
+
+        Returns:
+            Optional[str]: Hex digest, None without a lockfile
+        """
+        manager, version = detect_package_manager(project_dir)
+        lockfile = find_lockfile(project_dir, PACKAGE_MANAGER_LOCKFILES[manager])
+        if lockfile is None:
+            return None
+        sha = hashlib.sha256()
+        sha.update(f"{manager}@{version or ''}\0".encode('utf-8'))
+        sha.update(os.path.basename(lockfile).encode('utf-8') + b'\0')
+        with open(lockfile, 'rb') as f:
+            sha.update(hashlib.sha256(f.read()).digest())
+        sha.update(f"\0{node_version()}\0{platform_tag()}".encode('utf-8'))
+        return sha.hexdigest()
+
+    def restore(self, key: str, project_dir: str) -> bool:
+        """
+        Materialize cached node_modules into a project.
+
+        Returns:
+            bool: True on a cache hit
+        """
+        entry = os.path.join(self.path(key), 'node_modules')
+        if not os.path.isdir(entry):
+            return False
+        node_modules = os.path.join(project_dir, 'node_modules')
+        with self._lock(fcntl.LOCK_SH):
+            try:
+                if os.path.lexists(node_modules):
+                    shutil.rmtree(node_modules)
+                method = link_tree(entry, node_modules)
+                # Recently used entries are the last ones to be evicted
+                now = time.time()
+                os.utime(self.path(key), (now, now))
+            except OSError as e:
+                logging.warning(f"Could not restore cached dependencies {key}: {str(e)}")
+                shutil.rmtree(node_modules, ignore_errors=True)
+                return False
+        logging.info(f"Restored node_modules from dependency cache {key[:12]} ({method})")
+        return True
+
+    def store(self, key: str, project_dir: str) -> bool:
+        """
+        Add a project's freshly installed node_modules to the cache and
+        evict entries over budget.
+
+        The entry is assembled in a temporary directory and renamed into
+        place, so concurrent builds never see a partial entry.
+
+        Returns:
+            bool: True if the entry was added
+        """
+        node_modules = os.path.join(project_dir, 'node_modules')
+        if not os.path.isdir(node_modules) or os.path.isdir(self.path(key)):
+            return False
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            link_tree(node_modules, os.path.join(staging, 'node_modules'), NODE_MODULES_EXCLUDES)
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump({'size': tree_size(staging), 'created_at': time.time()}, f)
+            with self._lock(fcntl.LOCK_EX):
+                os.rename(staging, self.path(key))
+                self._evict()
+        except OSError as e:
+            # Another build may have stored the same key meanwhile
+            logging.warning(f"Could not cache dependencies {key}: {str(e)}")
+            return False
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging)
+        logging.info(f"Stored node_modules in dependency cache {key[:12]}")
+        return True
+
+
+def in_cone(rel_dir: str, cone: Optional[Sequence[str]]) -> bool:
+    """
+    Whether a directory of a checkout is part of a sparse-checkout cone.
+
+    Like git's cone mode this covers the root, the files of every parent
+    of a cone path and everything below one.
+
+    Args:
+        rel_dir: Directory relative to the checkout root, '' for the root
+        cone: Cone paths, None for the whole checkout
+    """
+    if cone is None or not rel_dir:
+        return True
+    return any(rel_dir == path or rel_dir.startswith(path + '/') or path.startswith(rel_dir + '/')
+               for path in cone)
+
+
+class BuildCache(CacheStore):
+    """
+    Store of build outputs keyed by a hash of everything the build reads.
+
+    The key covers the source tree, lockfile, build environment and Node.js
+    version; a hit means `npm run build` would produce the same output.
+    Apps in a monorepo are keyed by the checkout they live in, since they
+    build against the root package.json, lockfile and shared packages.
+    Entries are evicted least recently used first once the store exceeds
+    its size budget.
+    """
+
+    label = 'build cache'
+
+    def key(self, project_dir: str, env: Optional[Dict[str, str]] = None,
+            root: Optional[str] = None, cone: Optional[Sequence[str]] = None) -> Optional[str]:
+        """
+        Hash of the build inputs of a project.
+
+        Without a lockfile the installed dependencies, and so the build,
+        can differ between identical trees, so such projects get no key.
+
+        Args:
+            project_dir: Directory the build runs in
+            env: Environment the build runs with, defaults to os.environ
+            root: Checkout containing project_dir, defaults to project_dir
+            cone: Sparse-checkout paths of root, None for all of it
+
+        Returns:
+            Optional[str]: Hex digest, None if neither the project nor root has a lockfile
+        """
+        env = os.environ if env is None else env
+        root = project_dir if root is None else root
+        if find_lockfile(project_dir) is None and find_lockfile(root) is None:
+            return None
+        sha = hashlib.sha256()
+        sha.update(f"node\0{node_version()}\0{platform_tag()}\0".encode('utf-8'))
+        for name in sorted(env):
+            if name.startswith(BUILD_ENV_PREFIXES):
+                sha.update(f"env\0{name}\0{env[name]}\0".encode('utf-8'))
+        if root != project_dir:
+            # Apps of one checkout share their inputs but not their outputs
+            app = os.path.relpath(project_dir, root).replace(os.sep, '/')
+            sha.update(f"app\0{app}\0".encode('utf-8'))
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root).replace(os.sep, '/')
+            rel_dir = '' if rel_dir == '.' else rel_dir
+            top = dirpath == project_dir
+            dirnames[:] = sorted(
+                name for name in dirnames
+                if name not in SOURCE_EXCLUDES and not (top and name in BUILD_OUTPUT_DIRS)
+                and in_cone(f'{rel_dir}/{name}' if rel_dir else name, cone)
+            )
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+                if os.path.islink(path):
+                    sha.update(f"link\0{rel_path}\0{os.readlink(path)}\0".encode('utf-8'))
+                    continue
+                file_sha = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        file_sha.update(chunk)
+                executable = os.access(path, os.X_OK)
+                sha.update(f"file\0{rel_path}\0{int(executable)}\0".encode('utf-8'))
+                sha.update(file_sha.digest())
+        return sha.hexdigest()
+
+    def restore(self, key: str, project_dir: str) -> bool:
+        """
+        Put cached build outputs into a project.
+
+        Returns:
+            bool: True on a cache hit
+        """
+        if not os.path.isdir(self.path(key)):
+            return False
+        with self._lock(fcntl.LOCK_SH):
+            try:
+                with open(os.path.join(self.path(key), 'meta.json'), 'r') as f:
+                    outputs = json.load(f)['outputs']
+                for name in BUILD_OUTPUT_DIRS:
+                    target = os.path.join(project_dir, name)
+                    if os.path.lexists(target):
+                        shutil.rmtree(target)
+                for name in outputs:
+                    link_tree(os.path.join(self.path(key), name),
+                              os.path.join(project_dir, name), hardlink=False)
+                now = time.time()
+                os.utime(self.path(key), (now, now))
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Could not restore cached build {key}: {str(e)}")
+                return False
+        logging.info(f"Restored {', '.join(outputs)} from build cache {key[:12]}")
+        return True
+
+    def store(self, key: str, project_dir: str) -> bool:
+        """
+        Add the build outputs of a project and evict entries over budget.
+
+        Returns:
+            bool: True if the entry was added
+        """
+        outputs = [name for name in BUILD_OUTPUT_DIRS
+                   if os.path.isdir(os.path.join(project_dir, name))]
+        if not outputs or os.path.isdir(self.path(key)):
+            return False
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            for name in outputs:
+                # Copies, since some bundlers rewrite output files in place
+                link_tree(os.path.join(project_dir, name), os.path.join(staging, name),
+                          NODE_MODULES_EXCLUDES, hardlink=False)
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump({'outputs': outputs, 'size': tree_size(staging),
+                           'created_at': time.time()}, f)
+            with self._lock(fcntl.LOCK_EX):
+                os.rename(staging, self.path(key))
+                self._evict()
+        except OSError as e:
+            logging.warning(f"Could not cache build {key}: {str(e)}")
+            return False
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging)
+        logging.info(f"Stored {', '.join(outputs)} in build cache {key[:12]}")
+        return True
+
+def read_deps_marker(project_dir: str) -> Optional[str]:
+    """Dependency cache key node_modules was installed for, None if unknown"""
+    try:
+        with open(os.path.join(project_dir, 'node_modules', DEPS_MARKER), 'r') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_deps_marker(project_dir: str, key: str) -> None:
+    """Record the dependency cache key node_modules was installed for"""
+    with open(os.path.join(project_dir, 'node_modules', DEPS_MARKER), 'w') as f:
+        f.write(key)
+
+
+class NpmCacheStats:
+    """Counts how npm served registry requests from its cache"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def feed(self, line: str) -> None:
+        """Parse one line of npm output, ignoring anything but fetch logs"""
+        match = NPM_FETCH_PATTERN.search(line)
+        if match:
+            # Requests without an annotation went to the registry
+            outcome = match.group('cache') or 'miss'
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Counts per outcome plus the share of requests served locally"""
+        requests = sum(self.counts.values())
+        local = self.counts.get('hit', 0) + self.counts.get('revalidated', 0)
+        stats: Dict[str, Any] = dict(self.counts, requests=requests)
+        stats['hit_ratio'] = round(local / requests, 3) if requests else None
+        return stats
+
+
+def install_command(project_dir: str, manager: str = 'npm',
+                    version: Optional[str] = None) -> List[str]:
+    """
+    Command installing a project's dependencies with its package manager.
+
+    Installs never update the lockfile when there is one. pnpm shares one
+    content-addressable store across all sites, so identical package
+    files exist once on disk and are hardlinked into each node_modules.
+
+    Args:
+        project_dir: Project directory
+        manager: 'npm', 'yarn' or 'pnpm'
+        version: Pinned package manager version, if known
+
+    Returns:
+        List[str]: Command as list of strings
+    """
+    if manager == 'npm':
+        return npm_install_command(project_dir)
+    locked = find_lockfile(project_dir, PACKAGE_MANAGER_LOCKFILES[manager]) is not None
+    if manager == 'pnpm':
+        command = ['pnpm', 'install', '--store-dir', config.pnpm_store_dir]
+        command.append('--frozen-lockfile' if locked else '--no-frozen-lockfile')
+        if config.npm_prefer_offline:
+            command.append('--prefer-offline')
+        return command
+    if version and not version.startswith('1.'):
+        # Yarn 2+ keeps its cache and flags in .yarnrc.yml
+        return ['yarn', 'install', '--immutable'] if locked else ['yarn', 'install']
+    command = ['yarn', 'install', '--non-interactive', '--cache-folder', config.yarn_cache_dir]
+    if locked:
+        command.append('--frozen-lockfile')
+    if config.npm_prefer_offline:
+        command.append('--prefer-offline')
+    return command
+
+
+def npm_install_command(project_dir: str) -> List[str]:
+    """
+    Command installing a project's dependencies with npm.
+
+    `npm ci` is used when an npm lockfile exists, so the lockfile is never
+    rewritten and versions are never re-resolved. All sites share one cache.
+
+    Args:
+        project_dir: Project directory
+
+    Returns:
+        list: Command as list of strings
+    """
+    locked = any(os.path.isfile(os.path.join(project_dir, name)) for name in NPM_LOCKFILES)
+    command = ['npm', 'ci' if locked else 'install', '--no-audit', '--no-fund',
+               '--loglevel', 'http', '--cache', config.npm_cache_dir]
+    if config.npm_prefer_offline:
+        command.append('--prefer-offline')
+    return command
+
+
+def install_dependencies(project_dir: str, cache: Optional[DependencyCache] = None,
+                         stats: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Install a project's node_modules, reusing cached trees where possible.
+
+    Args:
+        project_dir: Project directory containing package.json
+        cache: Dependency cache, None to always run the install
+        stats: Dict receiving the package manager and cache outcome
+
+    Returns:
+        bool: True if the dependencies are in place
+    """
+    stats = stats if stats is not None else {}
+    manager, version = detect_package_manager(project_dir)
+    stats['package_manager'] = manager
+    key = cache.key(project_dir) if cache else None
+    stats['dependency_cache'] = 'disabled' if key is None else 'miss'
+
+    if key is not None:
+        installed = read_deps_marker(project_dir)
+        if installed == key:
+            logging.info("node_modules already matches the lockfile, skipping install")
+            stats['dependency_cache'] = 'current'
+            return True
+        if installed is not None:
+            # Possibly hardlinked to a cache entry; never install over it
+            shutil.rmtree(os.path.join(project_dir, 'node_modules'))
+        if cache.restore(key, project_dir):
+            stats['dependency_cache'] = 'hit'
+            return True
+
+    command = install_command(project_dir, manager, version)
+    logging.info(f"Installing dependencies with {' '.join(command[:2])}...")
+    npm_cache = NpmCacheStats()
+    started = time.time()
+    returncode, tail = stream_command(command, cwd=project_dir, prefix=f'{manager}: ',
+                                      on_line=npm_cache.feed)
+    stats['install_seconds'] = round(time.time() - started, 3)
+    if manager == 'npm':
+        stats['npm_cache'] = npm_cache.to_dict()
+        logging.info(f"npm cache: {stats['npm_cache']}")
+    if returncode != 0:
+        logging.error(f"{manager} install error (exit {returncode}): {tail[-1] if tail else ''}")
+        return False
+
+    if key is not None and os.path.isdir(os.path.join(project_dir, 'node_modules')):
+        write_deps_marker(project_dir, key)
+        cache.store(key, project_dir)
+    return True
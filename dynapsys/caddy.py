@@ -0,0 +1,144 @@
+"""Caddy site configuration for statically served builds"""
+import os
+import logging
+import subprocess
+import tempfile
+from typing import Optional
+
+from .config import config
+
+STATIC_SITE_TEMPLATE = """{domain} {{
+\troot * {root}
+\tencode zstd gzip
+\ttry_files {{path}} /index.html
+\tfile_server {{
+\t\tprecompressed br gzip
+\t}}
+}}
+"""
+
+
+def site_config_path(domain: str) -> str:
+    """Path of the Caddy snippet serving a domain"""
+    return os.path.join(config.caddy_sites_dir, f'{domain}.caddy')
+
+
+def render_static_site(domain: str, root: str) -> str:
+    """
+    Caddy site block serving a build output directory.
+
+    Unknown paths fall back to index.html so client-side routing works, and
+    .br / .gz sidecars written at deploy time are sent when clients accept them.
+
+    Args:
+        domain: Domain served
+        root: Directory holding index.html and the assets
+
+    Returns:
+        str: Caddyfile snippet
+    """
+    return STATIC_SITE_TEMPLATE.format(domain=domain, root=root)
+
+
+def _run(command) -> bool:
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+    except OSError as e:
+        logging.error(f"Could not run {' '.join(command)}: {str(e)}")
+        return False
+    if result.returncode != 0:
+        logging.error(f"{' '.join(command)} failed: {result.stderr.strip()}")
+        return False
+    return True
+
+
+def ensure_import() -> bool:
+    """
+    Make the main Caddyfile import the per-site snippets.
+
+    Returns:
+        bool: True if the import is in place
+    """
+    line = f"import {os.path.join(config.caddy_sites_dir, '*.caddy')}"
+    try:
+        with open(config.caddyfile, 'r') as f:
+            if any(existing.strip() == line for existing in f):
+                return True
+        with open(config.caddyfile, 'a') as f:
+            f.write(f"\n{line}\n")
+    except OSError as e:
+        logging.error(f"Could not update {config.caddyfile}: {str(e)}")
+        return False
+    logging.info(f"Added '{line}' to {config.caddyfile}")
+    return True
+
+
+def reload_caddy() -> bool:
+    """Validate the Caddy configuration and reload it"""
+    if not _run(['caddy', 'validate', '--config', config.caddyfile, '--adapter', 'caddyfile']):
+        return False
+    return _run(['systemctl', 'reload', 'caddy'])
+
+
+def _replace_site_config(domain: str, content: Optional[str]) -> bool:
+    """
+    Install or remove the snippet of a domain, keeping the old one on failure.
+
+    Args:
+        domain: Domain to configure
+        content: New snippet, None to remove it
+
+    Returns:
+        bool: True if Caddy runs with the new configuration
+    """
+    path = site_config_path(domain)
+    try:
+        with open(path, 'r') as f:
+            previous = f.read()
+    except FileNotFoundError:
+        previous = None
+    if content == previous:
+        return True
+
+    os.makedirs(config.caddy_sites_dir, exist_ok=True)
+    if content is None:
+        os.unlink(path)
+    else:
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{domain}-', dir=config.caddy_sites_dir)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    if ensure_import() and reload_caddy():
+        return True
+
+    logging.error(f"Restoring previous Caddy configuration of {domain}")
+    if previous is None:
+        if os.path.exists(path):
+            os.unlink(path)
+    else:
+        with open(path, 'w') as f:
+            f.write(previous)
+    return False
+
+
+def setup_static_site(domain: str, root: str) -> bool:
+    """
+    Serve a build output directory for a domain through Caddy.
+
+    Args:
+        domain: Domain served
+        root: Build output directory
+
+    Returns:
+        bool: True if Caddy serves the site
+    """
+    logging.info(f"Serving {domain} from {root} through Caddy")
+    return _replace_site_config(domain, render_static_site(domain, root))
+
+
+def remove_static_site(domain: str) -> bool:
+    """Stop serving a domain from a static directory"""
+    return _replace_site_config(domain, None)
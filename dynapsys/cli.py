@@ -2,10 +2,14 @@
 import click
 import logging
 from typing import Optional
-from .deployment import run_server
+from .client import sync_project
+from .deployment import rollback_site, run_server
 from .config import config
 from .dns import update_cloudflare_dns
-from .git import clone_git_repo, is_valid_git_url
+from .git import CLONE_MODES, clone_git_repo, clone_options, is_valid_git_url
+from .releases import ReleaseStore
+from .retention import get_retention_collector, lower_io_priority
+from .utils import is_valid_domain
 
 @click.group()
 @click.option('--debug/--no-debug', default=False, help='Enable debug logging')
@@ -49,19 +53,78 @@ def dns(domain: str, token: str) -> None:
 @cli.command()
 @click.argument('url')
 @click.argument('target_dir', type=click.Path())
-def clone(url: str, target_dir: str) -> None:
+@click.option('--mode', type=click.Choice(CLONE_MODES), help='Clone strategy (default: config)')
+@click.option('--ref', help='Branch or tag to clone')
+@click.option('--depth', type=int, help='Commits fetched by shallow clones')
+def clone(url: str, target_dir: str, mode: Optional[str] = None,
+          ref: Optional[str] = None, depth: Optional[int] = None) -> None:
     """Clone a git repository"""
     if not is_valid_git_url(url):
         click.echo(f"Invalid git URL: {url}", err=True)
         exit(1)
 
+    try:
+        options = clone_options({'clone': mode, 'ref': ref, 'depth': depth})
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        exit(1)
+
     click.echo(f"Cloning {url} to {target_dir}")
-    if clone_git_repo(url, target_dir):
+    if clone_git_repo(url, target_dir, **options):
         click.echo("Repository cloned successfully")
     else:
         click.echo("Failed to clone repository", err=True)
         exit(1)
 
+@cli.command()
+@click.argument('project_dir', type=click.Path(exists=True, file_okay=False))
+@click.argument('domain')
+@click.argument('token')
+@click.option('--url', default=f'http://localhost:{config.server_port}', help='Deployment server URL')
+def push(project_dir: str, domain: str, token: str, url: str) -> None:
+    """Deploy a local project uploading only changed files"""
+    click.echo(f"Syncing {project_dir} to {url} for {domain}")
+    try:
+        response = sync_project(url, project_dir, domain, token)
+    except Exception as e:
+        click.echo(f"Failed to deploy: {str(e)}", err=True)
+        exit(1)
+    click.echo(f"Deployment queued: {response.get('job_id')}")
+
+@cli.command()
+@click.argument('domain')
+@click.option('--release', help='Release to activate (default: the one before the live release)')
+def rollback(domain: str, release: Optional[str] = None) -> None:
+    """Switch a site back to an earlier release"""
+    if not is_valid_domain(domain):
+        click.echo(f"Invalid domain: {domain}", err=True)
+        exit(1)
+    # Excludes deployments of the server, which run in another process
+    lock = ReleaseStore(config.sites_dir).lock(domain, blocking=False)
+    if lock is None:
+        click.echo(f"A deployment of {domain} is in progress", err=True)
+        exit(1)
+    try:
+        with lock:
+            result = rollback_site(domain, release)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        exit(1)
+    if result is None:
+        click.echo(f"Failed to roll back {domain}", err=True)
+        exit(1)
+    click.echo(f"Release {result['release']} is live on {domain} (was {result['previous']})")
+
+@cli.command()
+@click.option('--dry-run', is_flag=True, help='Only list what would be deleted')
+def gc(dry_run: bool) -> None:
+    """Delete releases and backups outside the retention policy"""
+    lower_io_priority()
+    removed = get_retention_collector().collect(dry_run=dry_run)
+    for path in removed:
+        click.echo(f"{'Would remove' if dry_run else 'Removed'} {path}")
+    click.echo(f"{len(removed)} releases and backups {'to remove' if dry_run else 'removed'}")
+
 @cli.command()
 def config_info() -> None:
     """Display current configuration"""
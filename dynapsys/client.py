@@ -0,0 +1,58 @@
+"""Client side of the deployment server's delta upload protocol"""
+import os
+import json
+import logging
+import urllib.request
+from typing import Any, Dict, Optional
+
+from .manifest import build_manifest
+
+
+def _request(method: str, url: str, data: Any = None,
+             headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Send a request and decode the JSON response"""
+    request = urllib.request.Request(url, data=data, method=method, headers=headers or {})
+    with urllib.request.urlopen(request) as response:
+        body = response.read()
+    return json.loads(body) if body else {}
+
+
+def _post_json(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return _request('POST', url, json.dumps(payload).encode('utf-8'),
+                    {'Content-Type': 'application/json'})
+
+
+def sync_project(server_url: str, project_dir: str, domain: str, cf_token: str) -> Dict[str, Any]:
+    """
+    Deploy a local project uploading only the files the server lacks.
+
+    Args:
+        server_url: Base URL of the deployment server
+        project_dir: Local project directory
+        domain: Domain to deploy
+        cf_token: Cloudflare API token
+
+    Returns:
+        Dict[str, Any]: Server response for the queued deployment
+    """
+    server_url = server_url.rstrip('/')
+    files = build_manifest(project_dir)
+    logging.info(f"Manifest of {project_dir}: {len(files)} files")
+
+    diff = _post_json(f"{server_url}/deployments/{domain}/manifest", {'files': files})
+    by_path = {entry['path']: entry for entry in files}
+    for path in diff.get('missing', []):
+        entry = by_path[path]
+        with open(os.path.join(project_dir, *path.split('/')), 'rb') as f:
+            # File objects are streamed by urllib when the length is known
+            _request('PUT', f"{server_url}/blobs/{entry['sha256']}", f, {
+                'Content-Type': 'application/octet-stream',
+                'Content-Length': str(entry['size'])
+            })
+    logging.info(f"Uploaded {len(diff.get('missing', []))} of {len(files)} files")
+
+    return _post_json(server_url + '/', {
+        'domain': domain,
+        'cf_token': cf_token,
+        'manifest': files
+    })
@@ -0,0 +1,159 @@
+"""Precompressed sidecar files for statically served builds"""
+import os
+import gzip
+import logging
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# Text-like assets worth compressing; images and fonts like woff2 already are
+COMPRESSIBLE_EXTENSIONS = (
+    '.html', '.htm', '.css', '.js', '.mjs', '.cjs', '.json', '.map', '.svg',
+    '.txt', '.xml', '.wasm', '.ico', '.webmanifest', '.ttf', '.otf', '.eot'
+)
+
+# Sidecar suffix per encoding, in the order Caddy prefers them
+SIDECARS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def available_encodings() -> List[str]:
+    """Encodings sidecars can be written for; brotli needs the 'brotli' package"""
+    return [encoding for encoding, _ in SIDECARS if encoding != 'br' or brotli is not None]
+
+
+def _encode(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_file(path: str, encodings: Sequence[str]) -> Dict[str, int]:
+    """
+    Write the sidecars of one file, skipping those that would not be smaller.
+
+    Runs in worker processes, so it must not log.
+
+    Args:
+        path: File to compress
+        encodings: Encodings to write
+
+    Returns:
+        Dict[str, int]: Size of each sidecar written
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    stat = os.stat(path)
+    written = {}
+    for encoding, suffix in SIDECARS:
+        if encoding not in encodings:
+            continue
+        target = path + suffix
+        compressed = _encode(data, encoding)
+        if len(compressed) >= len(data):
+            # A stale sidecar would be served instead of the new file
+            if os.path.exists(target):
+                os.unlink(target)
+            continue
+        fd, tmp_path = tempfile.mkstemp(prefix='.precompress-', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(compressed)
+            os.chmod(tmp_path, stat.st_mode & 0o777)
+            # Same mtime as the original, so up to date sidecars are recognized
+            os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        written[encoding] = len(compressed)
+    return written
+
+
+def _sidecars_current(path: str, encodings: Sequence[str]) -> Optional[Dict[str, int]]:
+    """Sizes of existing sidecars matching the file, None if any is missing or stale"""
+    mtime = os.stat(path).st_mtime_ns
+    sizes = {}
+    for encoding, suffix in SIDECARS:
+        if encoding not in encodings:
+            continue
+        try:
+            stat = os.stat(path + suffix)
+        except FileNotFoundError:
+            return None
+        if stat.st_mtime_ns != mtime:
+            return None
+        sizes[encoding] = stat.st_size
+    return sizes
+
+
+def precompress_tree(root: str, min_size: int = 1024, workers: Optional[int] = None,
+                     encodings: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Write .br and .gz sidecars next to the compressible files of a directory.
+
+    Files are compressed in parallel worker processes at maximum compression
+    levels, since the cost is paid once per deploy rather than per request.
+
+    Args:
+        root: Build output directory
+        min_size: Files smaller than this many bytes are left alone
+        workers: Worker processes, defaults to the number of CPUs
+        encodings: Encodings to write, defaults to all available
+
+    Returns:
+        Dict[str, Any]: Files compressed and skipped, original bytes and the
+        size and savings of each encoding
+    """
+    encodings = list(encodings or available_encodings())
+    stats: Dict[str, Any] = {'files': 0, 'skipped': 0, 'up_to_date': 0, 'bytes': 0}
+    for encoding in encodings:
+        stats[encoding] = {'files': 0, 'bytes': 0, 'saved': 0}
+
+    pending: List[Tuple[str, int]] = []
+    results: List[Tuple[int, Dict[str, int]]] = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if not name.lower().endswith(COMPRESSIBLE_EXTENSIONS) or os.path.islink(path):
+                continue
+            size = os.path.getsize(path)
+            if size < min_size:
+                stats['skipped'] += 1
+                continue
+            current = _sidecars_current(path, encodings)
+            if current is not None:
+                stats['up_to_date'] += 1
+                results.append((size, current))
+            else:
+                pending.append((path, size))
+
+    if pending:
+        workers = workers or os.cpu_count() or 1
+        # Forking the threaded server could copy locks other threads hold;
+        # workers come from a clean forkserver process instead
+        context = multiprocessing.get_context('forkserver')
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=context) as pool:
+            written = pool.map(compress_file, [path for path, _ in pending],
+                               [encodings] * len(pending), chunksize=8)
+            results.extend(zip((size for _, size in pending), written))
+
+    for size, sizes in results:
+        stats['files'] += 1
+        stats['bytes'] += size
+        for encoding, compressed in sizes.items():
+            stats[encoding]['files'] += 1
+            stats[encoding]['bytes'] += compressed
+            stats[encoding]['saved'] += size - compressed
+
+    summary = ', '.join(
+        f"{encoding} saves {stats[encoding]['saved']} bytes" for encoding in encodings
+    )
+    logging.info(f"Precompressed {stats['files']} files ({stats['bytes']} bytes): {summary}")
+    return stats
@@ -23,6 +23,51 @@ class Config:
         'ENABLE_SSL': False,
         'SSL_CERT_FILE': '',
         'SSL_KEY_FILE': '',
+        'DEPLOY_WORKERS': 2,
+        'DEPLOY_QUEUE_SIZE': 16,
+        'JOB_HISTORY_SIZE': 200,
+        'JOB_LOG_LINES': 200,
+        'UPLOADS_DIR': '/opt/reactjs/uploads',
+        'UPLOAD_CHUNK_SIZE': 1024 * 1024,
+        'MAX_EXTRACT_BYTES': 4 * 1024 ** 3,
+        'BLOBS_DIR': '/opt/reactjs/blobs',
+        'BLOB_MAX_AGE_DAYS': 7,
+        'UPLOAD_SESSION_TTL': 86400,
+        'MAX_UPLOAD_BYTES': 2 * 1024 ** 3,
+        'JOB_LOGS_DIR': '/opt/reactjs/logs',
+        'GIT_CLONE_MODE': 'shallow',
+        'GIT_CLONE_DEPTH': 1,
+        'GIT_MIRROR_CACHE': True,
+        'GIT_MIRRORS_DIR': '/opt/reactjs/mirrors',
+        'GIT_RECURSE_SUBMODULES': False,
+        'GIT_SUBMODULE_JOBS': 4,
+        'STATE_DIR': '/opt/reactjs/state',
+        'DEPENDENCY_CACHE': True,
+        'DEPENDENCY_CACHE_DIR': '/opt/reactjs/cache/node_modules',
+        'DEPENDENCY_CACHE_MAX_BYTES': 10 * 1024 ** 3,
+        'NPM_CACHE_DIR': '/opt/reactjs/cache/npm',
+        'NPM_PREFER_OFFLINE': True,
+        'PNPM_STORE_DIR': '/opt/reactjs/cache/pnpm-store',
+        'YARN_CACHE_DIR': '/opt/reactjs/cache/yarn',
+        'BUILD_CACHE': True,
+        'BUILD_CACHE_DIR': '/opt/reactjs/cache/builds',
+        'BUILD_CACHE_MAX_BYTES': 5 * 1024 ** 3,
+        'BUILD_SCHEDULER': True,
+        'BUILD_MEMORY_ESTIMATE': 1024 ** 3,
+        'BUILD_MEMORY_RESERVE': 256 * 1024 ** 2,
+        'BUILD_MAX_LOAD': 1.5,
+        'ACTIVATION_MODE': 'auto',
+        'CADDYFILE': '/etc/caddy/Caddyfile',
+        'CADDY_SITES_DIR': '/etc/caddy/sites',
+        'PRECOMPRESS': True,
+        'PRECOMPRESS_MIN_SIZE': 1024,
+        'PRECOMPRESS_WORKERS': 0,
+        'RETENTION_KEEP': 5,
+        'RETENTION_MAX_AGE_DAYS': 30,
+        'RETENTION_MAX_BYTES': 0,
+        'RETENTION_BACKUP_DIRS': '/var/www,/etc/caddy',
+        'GC_INTERVAL': 3600,
+        'DEDUPE': True,
     }
 
     def __init__(self):
@@ -46,6 +91,12 @@ class Config:
                     except ValueError:
                         logging.warning(f"Invalid integer value for {env_key}: {env_value}")
                         self._config[key] = default
+                elif isinstance(default, float):
+                    try:
+                        self._config[key] = float(env_value)
+                    except ValueError:
+                        logging.warning(f"Invalid number value for {env_key}: {env_value}")
+                        self._config[key] = default
                 else:
                     self._config[key] = env_value
             else:
@@ -58,6 +109,16 @@ class Config:
         """Create necessary directories if they don't exist"""
         directories = [
             self.sites_dir,
+            self.uploads_dir,
+            self.blobs_dir,
+            self.job_logs_dir,
+            self.git_mirrors_dir,
+            self.state_dir,
+            self.dependency_cache_dir,
+            self.npm_cache_dir,
+            self.pnpm_store_dir,
+            self.yarn_cache_dir,
+            self.build_cache_dir,
             os.path.dirname(self.log_file)
         ]
 
@@ -114,6 +175,231 @@ class Config:
         """Get SSL key file path"""
         return self._config['SSL_KEY_FILE']
 
+    @property
+    def deploy_workers(self) -> int:
+        """Get number of concurrent deployment workers"""
+        return self._config['DEPLOY_WORKERS']
+
+    @property
+    def deploy_queue_size(self) -> int:
+        """Get maximum number of queued deployments"""
+        return self._config['DEPLOY_QUEUE_SIZE']
+
+    @property
+    def job_history_size(self) -> int:
+        """Get number of recent jobs kept in memory"""
+        return self._config['JOB_HISTORY_SIZE']
+
+    @property
+    def job_log_lines(self) -> int:
+        """Get number of log lines kept per job"""
+        return self._config['JOB_LOG_LINES']
+
+    @property
+    def uploads_dir(self) -> str:
+        """Get directory for spooled uploads"""
+        return self._config['UPLOADS_DIR']
+
+    @property
+    def upload_chunk_size(self) -> int:
+        """Get read size used when streaming uploads"""
+        return self._config['UPLOAD_CHUNK_SIZE']
+
+    @property
+    def max_extract_bytes(self) -> int:
+        """Get limit on the unpacked size of an uploaded archive"""
+        return self._config['MAX_EXTRACT_BYTES']
+
+    @property
+    def blobs_dir(self) -> str:
+        """Get content-addressed blob store directory"""
+        return self._config['BLOBS_DIR']
+
+    @property
+    def blob_max_age_days(self) -> int:
+        """Get days an unused blob is kept, 0 to keep blobs forever"""
+        return self._config['BLOB_MAX_AGE_DAYS']
+
+    @property
+    def upload_session_ttl(self) -> int:
+        """Get seconds after which unfinished upload sessions expire"""
+        return self._config['UPLOAD_SESSION_TTL']
+
+    @property
+    def max_upload_bytes(self) -> int:
+        """Get largest upload accepted by an upload session"""
+        return self._config['MAX_UPLOAD_BYTES']
+
+    @property
+    def job_logs_dir(self) -> str:
+        """Get directory holding the full log of each deployment job"""
+        return self._config['JOB_LOGS_DIR']
+
+    @property
+    def git_clone_mode(self) -> str:
+        """Get default clone strategy (full, shallow or partial)"""
+        return self._config['GIT_CLONE_MODE']
+
+    @property
+    def git_clone_depth(self) -> int:
+        """Get number of commits fetched by shallow clones"""
+        return self._config['GIT_CLONE_DEPTH']
+
+    @property
+    def git_mirror_cache(self) -> bool:
+        """Get whether git sources are cloned through local mirrors"""
+        return self._config['GIT_MIRROR_CACHE']
+
+    @property
+    def git_mirrors_dir(self) -> str:
+        """Get directory holding bare mirrors of git sources"""
+        return self._config['GIT_MIRRORS_DIR']
+
+    @property
+    def git_recurse_submodules(self) -> bool:
+        """Get whether submodules are checked out by default"""
+        return self._config['GIT_RECURSE_SUBMODULES']
+
+    @property
+    def git_submodule_jobs(self) -> int:
+        """Get number of submodules fetched in parallel"""
+        return self._config['GIT_SUBMODULE_JOBS']
+
+    @property
+    def state_dir(self) -> str:
+        """Get directory holding per-domain deployment state"""
+        return self._config['STATE_DIR']
+
+    @property
+    def dependency_cache(self) -> bool:
+        """Get whether installed node_modules are shared between builds"""
+        return self._config['DEPENDENCY_CACHE']
+
+    @property
+    def dependency_cache_dir(self) -> str:
+        """Get directory holding cached node_modules trees"""
+        return self._config['DEPENDENCY_CACHE_DIR']
+
+    @property
+    def dependency_cache_max_bytes(self) -> int:
+        """Get size budget of the dependency cache"""
+        return self._config['DEPENDENCY_CACHE_MAX_BYTES']
+
+    @property
+    def npm_cache_dir(self) -> str:
+        """Get npm cache directory shared by all sites"""
+        return self._config['NPM_CACHE_DIR']
+
+    @property
+    def npm_prefer_offline(self) -> bool:
+        """Get whether npm uses cached metadata without revalidating it"""
+        return self._config['NPM_PREFER_OFFLINE']
+
+    @property
+    def pnpm_store_dir(self) -> str:
+        """Get pnpm content-addressable store shared by all sites"""
+        return self._config['PNPM_STORE_DIR']
+
+    @property
+    def yarn_cache_dir(self) -> str:
+        """Get Yarn classic cache shared by all sites"""
+        return self._config['YARN_CACHE_DIR']
+
+    @property
+    def build_cache(self) -> bool:
+        """Get whether build outputs are reused for identical inputs"""
+        return self._config['BUILD_CACHE']
+
+    @property
+    def build_cache_dir(self) -> str:
+        """Get directory holding cached build outputs"""
+        return self._config['BUILD_CACHE_DIR']
+
+    @property
+    def build_cache_max_bytes(self) -> int:
+        """Get size budget of the build cache"""
+        return self._config['BUILD_CACHE_MAX_BYTES']
+
+    @property
+    def build_scheduler(self) -> bool:
+        """Get whether builds wait for free memory and CPU before starting"""
+        return self._config['BUILD_SCHEDULER']
+
+    @property
+    def build_memory_estimate(self) -> int:
+        """Get memory in bytes assumed for builds of domains without history"""
+        return self._config['BUILD_MEMORY_ESTIMATE']
+
+    @property
+    def build_memory_reserve(self) -> int:
+        """Get memory in bytes builds always leave to the rest of the host"""
+        return self._config['BUILD_MEMORY_RESERVE']
+
+    @property
+    def build_max_load(self) -> float:
+        """Get load average per CPU above which builds wait"""
+        return self._config['BUILD_MAX_LOAD']
+
+    @property
+    def activation_mode(self) -> str:
+        """Get default activation: auto, static or pm2"""
+        return self._config['ACTIVATION_MODE']
+
+    @property
+    def caddyfile(self) -> str:
+        """Get path of the main Caddyfile"""
+        return self._config['CADDYFILE']
+
+    @property
+    def caddy_sites_dir(self) -> str:
+        """Get directory holding the Caddy snippets of static sites"""
+        return self._config['CADDY_SITES_DIR']
+
+    @property
+    def precompress(self) -> bool:
+        """Get whether static builds get .gz and .br sidecar files"""
+        return self._config['PRECOMPRESS']
+
+    @property
+    def precompress_min_size(self) -> int:
+        """Get size in bytes below which files are not precompressed"""
+        return self._config['PRECOMPRESS_MIN_SIZE']
+
+    @property
+    def precompress_workers(self) -> int:
+        """Get number of compression processes, 0 for one per CPU"""
+        return self._config['PRECOMPRESS_WORKERS']
+
+    @property
+    def retention_keep(self) -> int:
+        """Get number of releases and backups kept per site, 0 for no limit"""
+        return self._config['RETENTION_KEEP']
+
+    @property
+    def retention_max_age_days(self) -> int:
+        """Get days after which old releases and backups are deleted, 0 for never"""
+        return self._config['RETENTION_MAX_AGE_DAYS']
+
+    @property
+    def retention_max_bytes(self) -> int:
+        """Get size budget of the releases or backups of a site, 0 for none"""
+        return self._config['RETENTION_MAX_BYTES']
+
+    @property
+    def retention_backup_dirs(self) -> str:
+        """Get comma-separated directories holding *_backup_<timestamp> backups"""
+        return self._config['RETENTION_BACKUP_DIRS']
+
+    @property
+    def gc_interval(self) -> int:
+        """Get seconds between background retention passes, 0 to disable them"""
+        return self._config['GC_INTERVAL']
+
+    @property
+    def dedupe(self) -> bool:
+        """Get whether release files are hardlinked to identical stored copies"""
+        return self._config['DEDUPE']
+
     def get(self, key: str, default: Any = None) -> Any:
         """Get configuration value by key"""
         return self._config.get(key, default)
@@ -1,19 +1,39 @@
 #!/usr/bin/python3
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 import json
 import subprocess
 import os
 import base64
+import io
 import tempfile
 import shutil
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 import logging
 import sys
 from datetime import datetime
 import traceback
+import time
 
+from .blobs import BlobStore, is_valid_digest
+from .build import ACTIVATION_MODES, BuildCache, DependencyCache, detect_activation, install_dependencies
+from .caddy import remove_static_site, setup_static_site
+from .compress import precompress_tree
+from .config import config
 from .dns import update_cloudflare_dns
-from .git import clone_git_repo, is_valid_git_url
+from .filestore import OBJECTS_DIR, FileStore
+from .git import (
+    clone_git_repo, clone_options, head_commit, is_valid_git_url, is_valid_sparse_path, resolve_commit
+)
+from .jobs import DeploymentJob, JobIndex, JobQueue
+from .manifest import assemble_tree, missing_files, validate_manifest
+from .releases import ReleaseStore
+from .retention import get_retention_collector
+from .scheduler import get_build_scheduler
+from .sites import SiteStateStore
+from .sessions import DEFAULT_SESSION_CHUNK_SIZE, SessionClosedError, UploadSessionStore
+from .uploads import ARCHIVE_CONTENT_TYPES, LimitedReader, UploadError, extract_archive, extract_stream
+from .utils import is_valid_domain, stream_command
 
 # Configure logging
 logging.basicConfig(
@@ -25,6 +45,428 @@ logging.basicConfig(
     ]
 )
 
+def build_react_project(project_dir, stats=None, domain=None, source_root=None, cone=None,
+                        activation=None):
+    """
+    Build React project, filling stats with cache and resource details.
+
+    Monorepo apps pass the checkout they live in as source_root and its
+    sparse-checkout paths as cone, so the build cache key covers them.
+    activation is the requested activation mode (DYNAPSYS_ACTIVATION_MODE
+    if None); cached builds that will be served statically skip the
+    dependency install.
+    """
+    try:
+        logging.info(f"Starting build in: {project_dir}")
+        stats = stats if stats is not None else {}
+
+        # Check if package.json exists
+        if not os.path.exists(os.path.join(project_dir, 'package.json')):
+            logging.error("No package.json in project")
+            return False
+
+        # Hash the inputs before installing can add a lockfile to the tree
+        build_cache, build_key = None, None
+        if config.build_cache:
+            build_cache = BuildCache(config.build_cache_dir, config.build_cache_max_bytes)
+            build_key = build_cache.key(project_dir, root=source_root, cone=cone)
+            if build_key is None:
+                logging.info("No lockfile, not using the build cache")
+                stats['build_cache'] = 'disabled'
+                build_cache = None
+            else:
+                stats['build_key'] = build_key
+
+        cache = None
+        if config.dependency_cache:
+            cache = DependencyCache(config.dependency_cache_dir, config.dependency_cache_max_bytes)
+
+        if build_cache is not None and build_cache.restore(build_key, project_dir):
+            stats['build_cache'] = 'hit'
+            logging.info("Build output restored from cache, skipping npm build")
+            # Static output is served as files; only `npm start` needs node_modules
+            mode, _ = detect_activation(project_dir, activation or config.activation_mode)
+            if mode == 'static':
+                logging.info("Static build, skipping dependency install")
+                stats['dependency_cache'] = 'skipped'
+                return True
+            return install_dependencies(project_dir, cache, stats)
+
+        # Install dependencies; output is logged live as it arrives
+        if not install_dependencies(project_dir, cache, stats):
+            return False
+
+        # Build project
+        manager = stats['package_manager']
+        logging.info(f"Running {manager} build...")
+        command = [manager, 'run', 'build']
+        if config.build_scheduler:
+            # Wait for memory and CPU rather than push the host into swap
+            with get_build_scheduler().admit(domain or project_dir) as slot:
+                stats['build_wait_seconds'] = slot.waited
+                started = time.time()
+                returncode, tail = stream_command(command, cwd=project_dir, prefix='build: ',
+                                                  on_start=slot.track)
+            stats['build_peak_rss'] = slot.peak_rss
+        else:
+            started = time.time()
+            returncode, tail = stream_command(command, cwd=project_dir, prefix='build: ')
+        stats['build_seconds'] = round(time.time() - started, 3)
+
+        if returncode == 0:
+            logging.info("Build completed successfully")
+            if build_cache is not None:
+                stats['build_cache'] = 'miss'
+                build_cache.store(build_key, project_dir)
+            return True
+        else:
+            logging.error(f"Build error (exit {returncode}): {tail[-1] if tail else ''}")
+            return False
+
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Build error: {str(e)}\n{traceback.format_exc()}")
+        return False
+
+def setup_pm2(domain, project_dir):
+    """Configure PM2 for the application"""
+    try:
+        logging.info(f"Configuring PM2 for domain: {domain}")
+
+        # Stop existing instance
+        logging.info("Stopping existing PM2 instance...")
+        subprocess.run(['pm2', 'delete', domain], stderr=subprocess.DEVNULL)
+
+        # Start new instance
+        logging.info("Starting new PM2 instance...")
+        returncode, tail = stream_command(
+            ['pm2', 'start', 'npm', '--name', domain, '--', 'start'],
+            cwd=project_dir,
+            prefix='pm2: '
+        )
+
+        if returncode != 0:
+            logging.error(f"PM2 start error (exit {returncode}): {tail[-1] if tail else ''}")
+            return False
+
+        # Save PM2 configuration
+        logging.info("Saving PM2 configuration...")
+        returncode, tail = stream_command(['pm2', 'save'], prefix='pm2: ')
+
+        if returncode == 0:
+            logging.info("PM2 configuration saved successfully")
+            return True
+        else:
+            logging.error(f"PM2 save error (exit {returncode}): {tail[-1] if tail else ''}")
+            return False
+
+    except (subprocess.CalledProcessError, OSError) as e:
+        logging.error(f"PM2 setup error: {str(e)}\n{traceback.format_exc()}")
+        return False
+
+def stop_pm2(domain):
+    """Remove the PM2 process of a domain, if there is one"""
+    try:
+        result = subprocess.run(['pm2', 'delete', domain], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+    except OSError:
+        return
+    if result.returncode == 0:
+        logging.info(f"Stopped PM2 process of {domain}")
+        stream_command(['pm2', 'save'], prefix='pm2: ')
+
+def replace_directory(source_dir, project_dir):
+    """Replace the project directory with an unpacked source tree"""
+    if os.path.exists(project_dir):
+        logging.info(f"Removing existing directory: {project_dir}")
+        shutil.rmtree(project_dir)
+    os.makedirs(os.path.dirname(project_dir), exist_ok=True)
+    logging.info(f"Moving {source_dir} to: {project_dir}")
+    shutil.move(source_dir, project_dir)
+
+def activate_site(domain, mode, build_dir, static_dir):
+    """
+    Point the web server at a build: Caddy for static output, PM2 otherwise.
+
+    Args:
+        domain: Domain served
+        mode: 'static' or 'pm2'
+        build_dir: Directory `npm start` runs from
+        static_dir: Build output Caddy serves in static mode
+
+    Returns:
+        Optional[str]: Error message, None if the site is served
+    """
+    if mode == 'static':
+        if static_dir is None:
+            return "No static build output found"
+        if not setup_static_site(domain, static_dir):
+            return "Caddy setup failed"
+        stop_pm2(domain)
+    else:
+        if not setup_pm2(domain, build_dir):
+            return "PM2 setup failed"
+        if not remove_static_site(domain):
+            return "Caddy setup failed"
+    return None
+
+def _live_path(releases, domain, release_dir, path):
+    """Path inside a release, reached through the current symlink"""
+    if path is None:
+        return None
+    return os.path.normpath(os.path.join(releases.current_link(domain),
+                                         os.path.relpath(path, release_dir)))
+
+def run_deployment(job):
+    """Run the full deployment pipeline for a queued job"""
+    # Rollbacks and retention passes of other processes, e.g. the CLI, wait for it
+    with ReleaseStore(config.sites_dir).lock(job.domain):
+        return _deploy(job)
+
+def _deploy(job):
+    """Deployment pipeline, run while the releases of the domain are locked"""
+    domain = job.domain
+    cf_token = job.params['cf_token']
+    source = job.params.get('source', '')
+    site_state = SiteStateStore(config.state_dir)
+
+    # Every deployment builds into a release of its own while the live one keeps serving
+    releases = ReleaseStore(config.sites_dir)
+    releases.migrate(domain)
+    live_dir = releases.current_path(domain)
+    release_id = releases.new_id()
+    project_dir = releases.path(domain, release_id)
+    job.result['project_dir'] = project_dir
+    logging.info(f"Target directory: {project_dir}")
+
+    # Handle different source types
+    job.set_stage('source')
+    if is_valid_git_url(source):
+        options = clone_options(job.params)
+        # Pin the commit first so webhook storms for a live commit cost nothing
+        commit = options.get('commit') or resolve_commit(
+            source, options.get('ref'), on_progress=job.set_progress
+        )
+        if commit and not job.params.get('force') and live_dir is not None \
+                and site_state.is_live(domain, commit):
+            logging.info(f"Commit {commit} is already live on {domain}, nothing to do")
+            job.result.update({'commit': commit, 'unchanged': True})
+            return True
+        if commit:
+            options['commit'] = commit
+
+    job.result['release'] = release_id
+    # Removed again unless the release goes live
+    job.add_temp_path(project_dir)
+    if live_dir is None:
+        # Nothing keeps serving; forget what was live until this succeeds
+        site_state.update(domain, commit=None, job_id=job.id)
+    if job.params.get('source_dir'):
+        # Uploads are unpacked while they arrive; only move them into place
+        try:
+            replace_directory(job.params['source_dir'], project_dir)
+        except Exception as e:
+            logging.error(f"Error installing upload: {str(e)}\n{traceback.format_exc()}")
+            return job.fail("Error processing source data")
+    elif job.params.get('manifest'):
+        try:
+            os.makedirs(config.uploads_dir, exist_ok=True)
+            staging_dir = tempfile.mkdtemp(prefix='upload-', dir=config.uploads_dir)
+            job.add_temp_path(staging_dir)
+            job.result['files'] = assemble_tree(
+                job.params['manifest'], live_dir, BlobStore(config.blobs_dir), staging_dir
+            )
+            replace_directory(staging_dir, project_dir)
+        except Exception as e:
+            logging.error(f"Error assembling delta upload: {str(e)}\n{traceback.format_exc()}")
+            return job.fail("Error processing source data")
+    elif job.params.get('blob'):
+        try:
+            archive_path = BlobStore(config.blobs_dir).path(job.params['blob'])
+            os.makedirs(config.uploads_dir, exist_ok=True)
+            staging_dir = tempfile.mkdtemp(prefix='upload-', dir=config.uploads_dir)
+            job.add_temp_path(staging_dir)
+            compression = extract_archive(archive_path, staging_dir, max_bytes=config.max_extract_bytes)
+            logging.info(f"Extracted {compression} blob {job.params['blob']} to: {staging_dir}")
+            replace_directory(staging_dir, project_dir)
+        except Exception as e:
+            logging.error(f"Error extracting blob: {str(e)}\n{traceback.format_exc()}")
+            return job.fail("Error processing source data")
+    elif is_valid_git_url(source):
+        if not clone_git_repo(source, project_dir, on_progress=job.set_progress, **options):
+            return job.fail("Git clone failed")
+        job.result['commit'] = head_commit(project_dir)
+    else:
+        logging.info("Processing base64 data")
+        try:
+            base64_data = source[len('data:application/tar+gz;base64,'):]
+            os.makedirs(config.uploads_dir, exist_ok=True)
+            staging_dir = tempfile.mkdtemp(prefix='upload-', dir=config.uploads_dir)
+            job.add_temp_path(staging_dir)
+            archive = io.BytesIO(base64.b64decode(base64_data))
+            del base64_data
+            compression = extract_stream(archive, staging_dir, max_bytes=config.max_extract_bytes)
+            logging.info(f"Extracted {compression} archive to: {staging_dir}")
+            replace_directory(staging_dir, project_dir)
+        except Exception as e:
+            logging.error(f"Error processing base64 data: {str(e)}\n{traceback.format_exc()}")
+            return job.fail("Error processing source data")
+
+    # Monorepo apps are built from their own directory
+    build_dir, build_scope = project_dir, {}
+    if job.params.get('subdir'):
+        build_dir = os.path.join(project_dir, *job.params['subdir'].strip('/').split('/'))
+        job.result['build_dir'] = build_dir
+        # Git sources only check out the app and its sparse paths
+        build_scope = {'source_root': project_dir,
+                       'cone': options.get('sparse_paths') if is_valid_git_url(source) else None}
+
+    # Build project
+    job.set_stage('build')
+    activation = job.params.get('activation') or config.activation_mode
+    if not build_react_project(build_dir, job.result.setdefault('build', {}), domain=domain,
+                               activation=activation, **build_scope):
+        return job.fail("Build failed")
+
+    # Static builds are served by Caddy; only server-rendered apps need PM2
+    mode, static_dir = detect_activation(build_dir, activation)
+    job.result['activation'] = mode
+    if mode == 'static' and static_dir is not None and config.precompress:
+        # Sidecars let Caddy send compressed assets without compressing per request
+        job.set_stage('compress')
+        try:
+            job.result['compression'] = precompress_tree(
+                static_dir, config.precompress_min_size, config.precompress_workers or None
+            )
+        except Exception as e:
+            logging.warning(f"Precompression failed, serving uncompressed files: {str(e)}")
+
+    # Configure DNS
+    job.set_stage('dns')
+    if not update_cloudflare_dns(domain, cf_token):
+        return job.fail("DNS update failed")
+
+    # Caddy and PM2 use paths through the current symlink, so switching it
+    # is what makes the release live
+    job.set_stage('activate')
+    # Never let cleanup delete the release the current symlink points at
+    job.keep_path(project_dir)
+    previous = releases.activate(domain, release_id)
+    try:
+        error = activate_site(domain, mode, _live_path(releases, domain, project_dir, build_dir),
+                              _live_path(releases, domain, project_dir, static_dir))
+    except Exception as e:
+        logging.error(f"Activation error: {str(e)}\n{traceback.format_exc()}")
+        error = "Activation failed"
+    if error:
+        if previous is not None:
+            logging.info(f"Switching {domain} back to release {previous}")
+            releases.activate(domain, previous)
+        else:
+            os.unlink(releases.current_link(domain))
+        job.add_temp_path(project_dir)
+        return job.fail(error)
+
+    release_info = {
+        'commit': job.result.get('commit'),
+        'job_id': job.id,
+        'deployed_at': time.time(),
+        'activation': mode,
+        'build_dir': os.path.relpath(build_dir, project_dir),
+        'static_dir': os.path.relpath(static_dir, project_dir) if static_dir else None
+    }
+    known = site_state.get(domain).get('releases', {})
+    known[release_id] = release_info
+    site_state.update(
+        domain,
+        commit=release_info['commit'],
+        job_id=job.id,
+        deployed_at=release_info['deployed_at'],
+        release=release_id,
+        releases=known
+    )
+    if config.dedupe and mode == 'static':
+        # Files identical to those of earlier releases and other sites share their
+        # inode; PM2 apps may write into their tree at runtime, so they keep copies
+        job.set_stage('dedupe')
+        try:
+            job.result['dedupe'] = FileStore(os.path.join(config.sites_dir, OBJECTS_DIR)).add_tree(project_dir)
+        except OSError as e:
+            logging.warning(f"Deduplication failed, the release keeps its own copies: {str(e)}")
+    logging.info(f"Deployment completed successfully: {domain} (release {release_id})")
+    # The new release may push old ones out of the retention policy
+    get_retention_collector().trigger()
+    return True
+
+def rollback_site(domain, release_id=None):
+    """
+    Make an earlier release of a domain live again without rebuilding it.
+
+    Args:
+        domain: Domain to roll back
+        release_id: Release to activate, defaults to the one before the live release
+
+    Returns:
+        Optional[Dict[str, Any]]: Domain, activated and replaced release, None if
+        the site could not be served from the release
+
+    Raises:
+        ValueError: If there is no such release to roll back to
+    """
+    releases = ReleaseStore(config.sites_dir)
+    current = releases.current(domain)
+    target = release_id or releases.previous(domain)
+    if not target or target not in releases.list(domain):
+        raise ValueError(f"No release {target or 'to roll back to'} for {domain}")
+    if target == current:
+        raise ValueError(f"Release {target} is already live on {domain}")
+
+    site_state = SiteStateStore(config.state_dir)
+    info = site_state.get(domain).get('releases', {}).get(target, {})
+    release_dir = releases.path(domain, target)
+    build_dir = os.path.normpath(os.path.join(release_dir, info.get('build_dir') or '.'))
+    mode = info.get('activation')
+    if mode is None:
+        # Releases migrated from a plain checkout have no recorded activation
+        mode, static_dir = detect_activation(build_dir, config.activation_mode)
+    else:
+        static_dir = os.path.join(release_dir, info['static_dir']) if info.get('static_dir') else None
+
+    logging.info(f"Rolling {domain} back from release {current} to {target}")
+    releases.activate(domain, target)
+    error = activate_site(domain, mode, _live_path(releases, domain, release_dir, build_dir),
+                          _live_path(releases, domain, release_dir, static_dir))
+    if error:
+        logging.error(f"Rollback of {domain} to {target} failed: {error}")
+        if current is not None:
+            releases.activate(domain, current)
+        return None
+
+    site_state.update(domain, commit=info.get('commit'), release=target,
+                      rolled_back_from=current, deployed_at=time.time())
+    return {'domain': domain, 'release': target, 'previous': current}
+
+class DeploymentServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in its own thread and owning the job queue"""
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, job_queue=None):
+        super().__init__(server_address, handler_class)
+        self.job_queue = job_queue or JobQueue(
+            run_deployment,
+            workers=config.deploy_workers,
+            max_queued=config.deploy_queue_size,
+            index=JobIndex(config.job_history_size),
+            log_dir=config.job_logs_dir
+        )
+        self.job_queue.start()
+        self.blob_store = BlobStore(config.blobs_dir)
+        self.site_state = SiteStateStore(config.state_dir)
+        self.upload_sessions = UploadSessionStore(
+            os.path.join(config.uploads_dir, 'sessions'),
+            ttl=config.upload_session_ttl,
+            max_bytes=config.max_upload_bytes
+        )
+
 class DeploymentHandler(BaseHTTPRequestHandler):
     def send_json_response(self, status_code, data):
         """Send JSON response"""
@@ -49,101 +491,109 @@ class DeploymentHandler(BaseHTTPRequestHandler):
 
     def build_react_project(self, project_dir):
         """Build React project"""
-        try:
-            logging.info(f"Starting build in: {project_dir}")
-
-            # Check if package.json exists
-            if not os.path.exists(os.path.join(project_dir, 'package.json')):
-                logging.error("No package.json in project")
-                return False
-
-            # Install dependencies with output display
-            logging.info("Installing npm dependencies...")
-            process = subprocess.Popen(
-                ['npm', 'install'],
-                cwd=project_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            stdout, stderr = process.communicate()
-
-            if process.returncode != 0:
-                logging.error(f"npm install error: {stderr.decode()}")
-                return False
-
-            # Build project
-            logging.info("Running npm build...")
-            process = subprocess.Popen(
-                ['npm', 'run', 'build'],
-                cwd=project_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            stdout, stderr = process.communicate()
-
-            if process.returncode == 0:
-                logging.info("Build completed successfully")
-                return True
-            else:
-                logging.error(f"Build error: {stderr.decode()}")
-                return False
-
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Build error: {str(e)}\n{traceback.format_exc()}")
-            return False
+        return build_react_project(project_dir)
 
     def setup_pm2(self, domain, project_dir):
         """Configure PM2 for the application"""
-        try:
-            logging.info(f"Configuring PM2 for domain: {domain}")
+        return setup_pm2(domain, project_dir)
 
-            # Stop existing instance
-            logging.info("Stopping existing PM2 instance...")
-            subprocess.run(['pm2', 'delete', domain], stderr=subprocess.DEVNULL)
+    def do_GET(self):
+        try:
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = [part for part in url.path.split('/') if part]
+
+            if parts == ['deployments']:
+                domain = query.get('domain', [None])[0]
+                limit = int(query.get('limit', ['50'])[0])
+                jobs = self.server.job_queue.index.find(domain=domain, limit=limit)
+                self.send_json_response(200, {
+                    "deployments": [job.to_dict() for job in jobs]
+                })
+            elif len(parts) == 3 and parts[0] == 'deployments' and parts[2] == 'log':
+                job = self.server.job_queue.index.get(parts[1])
+                if job is None:
+                    self.send_json_response(404, {"error": "Deployment not found"})
+                    return
+                self.stream_job_log(job)
+            elif len(parts) == 2 and parts[0] == 'deployments':
+                job = self.server.job_queue.index.get(parts[1])
+                if job is None:
+                    self.send_json_response(404, {"error": "Deployment not found"})
+                    return
+                lines = int(query.get('lines', [str(config.job_log_lines)])[0])
+                self.send_json_response(200, job.to_dict(log_lines=lines))
+            elif len(parts) == 2 and parts[0] == 'uploads':
+                session = self.server.upload_sessions.get(parts[1])
+                if session is None:
+                    self.send_json_response(404, {"error": "Upload session not found"})
+                    return
+                data = session.to_dict()
+                data.update(missing=session.missing, missing_count=session.missing_count)
+                self.send_json_response(200, data)
+            else:
+                self.send_json_response(404, {"error": "Not found"})
 
-            # Start new instance
-            logging.info("Starting new PM2 instance...")
-            process = subprocess.Popen(
-                ['pm2', 'start', 'npm', '--name', domain, '--', 'start'],
-                cwd=project_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            stdout, stderr = process.communicate()
-
-            if process.returncode != 0:
-                logging.error(f"PM2 start error: {stderr.decode()}")
-                return False
-
-            # Save PM2 configuration
-            logging.info("Saving PM2 configuration...")
-            save_process = subprocess.Popen(
-                ['pm2', 'save'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            save_stdout, save_stderr = save_process.communicate()
+        except ValueError as e:
+            self.send_json_response(400, {"error": f"Invalid query: {str(e)}"})
+        except Exception as e:
+            logging.error(f"Server error: {str(e)}\n{traceback.format_exc()}")
+            self.send_json_response(500, {
+                "error": "Server error",
+                "details": str(e)
+            })
 
-            if save_process.returncode == 0:
-                logging.info("PM2 configuration saved successfully")
-                return True
-            else:
-                logging.error(f"PM2 save error: {save_stderr.decode()}")
-                return False
+    def stream_job_log(self, job):
+        """Follow a job's log as Server-Sent Events until the job is over"""
+        # Reconnecting EventSource clients resume after the last line they saw
+        cursor = int(self.headers.get('Last-Event-ID') or (job.log_seq - len(job.log)))
 
-        except subprocess.CalledProcessError as e:
-            logging.error(f"PM2 setup error: {str(e)}\n{traceback.format_exc()}")
-            return False
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            while True:
+                lines, next_cursor = job.read_log(cursor, timeout=15)
+                events = []
+                for offset, line in enumerate(lines, next_cursor - len(lines) + 1):
+                    data = ''.join(f"data: {part}\n" for part in line.split('\n'))
+                    events.append(f"id: {offset}\n{data}\n")
+                if events:
+                    self.wfile.write(''.join(events).encode('utf-8'))
+                elif job.log_closed:
+                    status = json.dumps({"status": job.status, "error": job.error})
+                    self.wfile.write(f"event: end\ndata: {status}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    return
+                else:
+                    # Keeps proxies from timing out and detects gone clients
+                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+                cursor = next_cursor
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info(f"Log follower of job {job.id} disconnected")
 
     def do_POST(self):
         try:
             content_length = int(self.headers.get('Content-Length', 0))
+            parts = [part for part in urlparse(self.path).path.split('/') if part]
+            if len(parts) == 3 and parts[0] == 'deployments' and parts[2] == 'rollback':
+                # The body is optional: without one the previous release goes live
+                body = self.rfile.read(content_length).decode('utf-8') if content_length else ''
+                try:
+                    params = json.loads(body) if body.strip() else {}
+                except json.JSONDecodeError as e:
+                    self.send_json_response(400, {"error": f"Invalid JSON: {str(e)}"})
+                    return
+                self.rollback(parts[1], params)
+                return
             if content_length == 0:
                 self.send_json_response(400, {"error": "Empty request"})
                 return
 
             post_data = self.rfile.read(content_length).decode('utf-8')
-            logging.info(f"Received POST data: {post_data}")
+            logging.info(f"Received POST data: {post_data[:500]}")
 
             try:
                 params = json.loads(post_data)
@@ -152,73 +602,240 @@ class DeploymentHandler(BaseHTTPRequestHandler):
                 self.send_json_response(400, {"error": f"Invalid JSON: {str(e)}"})
                 return
 
+            if len(parts) == 3 and parts[0] == 'deployments' and parts[2] == 'manifest':
+                self.diff_manifest(parts[1], params)
+                return
+            if parts == ['uploads']:
+                self.create_upload_session(params)
+                return
+            if len(parts) == 3 and parts[0] == 'uploads' and parts[2] == 'commit':
+                self.commit_upload_session(parts[1], params)
+                return
+
+            # The domain names directories and PM2 processes; check it first
+            if 'domain' in params and not is_valid_domain(params['domain']):
+                self.send_json_response(400, {"error": "Invalid domain"})
+                return
+
             # Check required fields
-            if not all(key in params for key in ['domain', 'cf_token', 'source']):
+            if not all(key in params for key in ['domain', 'cf_token']) or \
+                    not any(key in params for key in ['source', 'blob', 'manifest']):
                 self.send_json_response(400, {"error": "Missing required fields"})
                 return
 
             domain = params['domain']
-            cf_token = params['cf_token']
-            source = params['source']
 
-            # Target directory for project
-            project_dir = f"/opt/reactjs/sites/{domain}"
-            logging.info(f"Target directory: {project_dir}")
+            if 'subdir' in params and not is_valid_sparse_path(params['subdir']):
+                self.send_json_response(400, {"error": "Invalid subdir"})
+                return
+            if params.get('activation', 'auto') not in ACTIVATION_MODES:
+                self.send_json_response(400, {"error": "Invalid activation mode"})
+                return
 
-            # Handle different source types
-            if is_valid_git_url(source):
-                if not clone_git_repo(source, project_dir):
-                    self.send_error(500, "Git clone failed")
-                    return
-            elif source.startswith('data:application/tar+gz;base64,'):
-                logging.info("Processing base64 data")
+            # Reject unknown sources before queueing
+            if 'manifest' in params:
                 try:
-                    base64_data = source.replace('data:application/tar+gz;base64,', '')
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        archive_path = os.path.join(temp_dir, 'source.tar.gz')
-                        logging.info(f"Saving archive to: {archive_path}")
-
-                        with open(archive_path, 'wb') as f:
-                            f.write(base64.b64decode(base64_data))
-
-                        if os.path.exists(project_dir):
-                            logging.info(f"Removing existing directory: {project_dir}")
-                            shutil.rmtree(project_dir)
-
-                        logging.info(f"Copying files to: {project_dir}")
-                        shutil.copytree(temp_dir, project_dir)
-                except Exception as e:
-                    logging.error(f"Error processing base64 data: {str(e)}\n{traceback.format_exc()}")
-                    self.send_error(500, "Error processing source data")
+                    validate_manifest(params['manifest'])
+                except UploadError as e:
+                    self.send_json_response(400, {"error": str(e)})
+                    return
+            elif 'blob' in params:
+                if not self.server.blob_store.exists(params['blob']):
+                    self.send_json_response(400, {"error": "Unknown blob"})
                     return
             else:
-                logging.error(f"Invalid source format: {source[:100]}...")
-                self.send_error(400, "Invalid source format")
-                return
+                source = params['source']
+                if not is_valid_git_url(source) and not source.startswith('data:application/tar+gz;base64,'):
+                    logging.error(f"Invalid source format: {source[:100]}...")
+                    self.send_json_response(400, {"error": "Invalid source format"})
+                    return
+                try:
+                    clone_options(params)
+                except ValueError as e:
+                    self.send_json_response(400, {"error": str(e)})
+                    return
 
-            # Build project
-            if not self.build_react_project(project_dir):
-                self.send_error(500, "Build failed")
+            commit = params.get('commit')
+            if commit and not params.get('force') and self.server.site_state.is_live(domain, commit):
+                logging.info(f"Commit {commit} is already live on {domain}")
+                self.send_json_response(200, {
+                    "status": "unchanged",
+                    "message": "Commit already deployed",
+                    "domain": domain,
+                    "commit": commit,
+                    "timestamp": datetime.now().isoformat()
+                })
                 return
 
-            # Configure DNS
-            if not update_cloudflare_dns(domain, cf_token):
-                self.send_error(500, "DNS update failed")
-                return
+            self.queue_deployment(DeploymentJob(domain, params, log_lines=config.job_log_lines))
+
+        except Exception as e:
+            logging.error(f"Server error: {str(e)}\n{traceback.format_exc()}")
+            self.send_json_response(500, {
+                "error": "Server error",
+                "details": str(e)
+            })
 
-            # Configure PM2
-            if not self.setup_pm2(domain, project_dir):
-                self.send_error(500, "PM2 setup failed")
+    def queue_deployment(self, job, **details):
+        """Submit a job and answer 202 Accepted, or 503 if the queue is full"""
+        if not self.server.job_queue.submit(job):
+            job.cleanup()
+            self.send_json_response(503, {"error": "Deployment queue is full"})
+            return
+
+        # Accepted, the deployment continues in the background
+        response = {
+            "status": "accepted",
+            "message": "Deployment queued",
+            "job_id": job.id,
+            "domain": job.domain,
+            "timestamp": datetime.now().isoformat()
+        }
+        response.update(details)
+        self.send_json_response(202, response)
+
+    def create_upload_session(self, params):
+        """Start a resumable chunked upload"""
+        try:
+            session = self.server.upload_sessions.create(
+                params.get('size'),
+                params.get('sha256', ''),
+                params.get('chunk_size', DEFAULT_SESSION_CHUNK_SIZE)
+            )
+        except UploadError as e:
+            self.send_json_response(400, {"error": str(e)})
+            return
+        self.send_json_response(201, session.to_dict())
+
+    def commit_upload_session(self, session_id, params):
+        """Verify a completed upload session and optionally deploy it"""
+        session = self.server.upload_sessions.get(session_id)
+        if session is None:
+            self.send_json_response(404, {"error": "Upload session not found"})
+            return
+        if 'domain' in params and not is_valid_domain(params['domain']):
+            self.send_json_response(400, {"error": "Invalid domain"})
+            return
+        if 'domain' in params and 'cf_token' not in params:
+            self.send_json_response(400, {"error": "Missing required fields"})
+            return
+
+        try:
+            digest = self.server.upload_sessions.commit(session, self.server.blob_store)
+        except SessionClosedError as e:
+            self.send_json_response(409, {"error": str(e)})
+            return
+        except UploadError as e:
+            self.send_json_response(409, {"error": str(e), "missing": session.missing,
+                                          "missing_count": session.missing_count})
+            return
+
+        if 'domain' not in params:
+            self.send_json_response(201, {"blob": digest, "size": session.size})
+            return
+        self.queue_deployment(DeploymentJob(params['domain'], {
+            'domain': params['domain'],
+            'cf_token': params['cf_token'],
+            'blob': digest
+        }, log_lines=config.job_log_lines), blob=digest)
+
+    def upload_chunk(self, session_id, index):
+        """Write one chunk of an upload session"""
+        session = self.server.upload_sessions.get(session_id)
+        if session is None:
+            self.send_json_response(404, {"error": "Upload session not found"})
+            return
+        content_length = int(self.headers.get('Content-Length', 0))
+        try:
+            self.server.upload_sessions.write_chunk(
+                session, int(index), self.rfile, content_length,
+                read_size=config.upload_chunk_size
+            )
+        except SessionClosedError as e:
+            self.send_json_response(404, {"error": str(e)})
+            return
+        except (UploadError, ValueError) as e:
+            self.send_json_response(400, {"error": str(e)})
+            return
+        self.send_json_response(200, {
+            "upload_id": session.id,
+            "chunk": int(index),
+            "missing": session.missing,
+            "missing_count": session.missing_count
+        })
+
+    def rollback(self, domain, params):
+        """Switch a domain back to an earlier release"""
+        if not is_valid_domain(domain):
+            self.send_json_response(400, {"error": "Invalid domain"})
+            return
+        # Deployments of the domain switch releases too; never race them
+        lock = self.server.job_queue.domain_lock(domain)
+        if not lock.acquire(blocking=False):
+            self.send_json_response(409, {"error": "Deployment in progress"})
+            return
+        try:
+            release_lock = ReleaseStore(config.sites_dir).lock(domain, blocking=False)
+            if release_lock is None:
+                self.send_json_response(409, {"error": "Deployment in progress"})
                 return
+            with release_lock:
+                result = rollback_site(domain, params.get('release'))
+        except ValueError as e:
+            self.send_json_response(409, {"error": str(e)})
+            return
+        finally:
+            lock.release()
+        if result is None:
+            self.send_json_response(500, {"error": "Rollback failed"})
+            return
+        result['timestamp'] = datetime.now().isoformat()
+        self.send_json_response(200, result)
+
+    def diff_manifest(self, domain, params):
+        """Tell a client which files of its manifest have to be uploaded"""
+        if not is_valid_domain(domain):
+            self.send_json_response(400, {"error": "Invalid domain"})
+            return
+        try:
+            entries = validate_manifest(params.get('files'))
+        except UploadError as e:
+            self.send_json_response(400, {"error": str(e)})
+            return
+
+        previous_root = ReleaseStore(config.sites_dir).live_dir(domain)
+        missing = missing_files(entries, previous_root, self.server.blob_store)
+        self.send_json_response(200, {
+            "domain": domain,
+            "files": len(entries),
+            "missing": missing
+        })
+
+    def do_HEAD(self):
+        try:
+            parts = [part for part in urlparse(self.path).path.split('/') if part]
+            size = None
+            if len(parts) == 2 and parts[0] == 'blobs':
+                size = self.server.blob_store.size(parts[1])
+            self.send_response(200 if size is not None else 404)
+            self.send_header('Content-Length', str(size or 0))
+            self.end_headers()
+        except Exception as e:
+            logging.error(f"Server error: {str(e)}\n{traceback.format_exc()}")
+            self.send_response(500)
+            self.end_headers()
 
-            # Success
-            self.send_json_response(200, {
-                "status": "success",
-                "message": "Deployment completed successfully",
-                "domain": domain,
-                "project_dir": project_dir,
-                "timestamp": datetime.now().isoformat()
-            })
+    def do_PUT(self):
+        try:
+            parts = [part for part in urlparse(self.path).path.split('/') if part]
+            if len(parts) == 2 and parts[0] == 'deployments':
+                self.upload_deployment(parts[1])
+            elif len(parts) == 2 and parts[0] == 'blobs':
+                self.upload_blob(parts[1])
+            elif len(parts) == 4 and parts[0] == 'uploads' and parts[2] == 'chunks':
+                self.upload_chunk(parts[1], parts[3])
+            else:
+                self.send_json_response(404, {"error": "Not found"})
 
         except Exception as e:
             logging.error(f"Server error: {str(e)}\n{traceback.format_exc()}")
@@ -227,11 +844,88 @@ class DeploymentHandler(BaseHTTPRequestHandler):
                 "details": str(e)
             })
 
+    def upload_blob(self, digest):
+        """Store a request body in the content-addressed blob store"""
+        if not is_valid_digest(digest):
+            self.send_json_response(400, {"error": "Invalid SHA-256 digest"})
+            return
+
+        if self.headers.get('Content-Length') is None:
+            self.send_json_response(411, {"error": "Content-Length required"})
+            return
+        content_length = int(self.headers['Content-Length'])
+
+        if self.server.blob_store.exists(digest):
+            # Already stored; read and discard the body to keep the connection sane
+            LimitedReader(self.rfile, content_length).drain(config.upload_chunk_size)
+            self.send_json_response(200, {"blob": digest, "size": self.server.blob_store.size(digest)})
+            return
+
+        try:
+            self.server.blob_store.put_stream(
+                self.rfile, content_length, expected_digest=digest,
+                chunk_size=config.upload_chunk_size
+            )
+        except UploadError as e:
+            self.send_json_response(400, {"error": str(e)})
+            return
+        self.send_json_response(201, {"blob": digest, "size": content_length})
+
+    def upload_deployment(self, domain):
+        """Unpack a streamed archive and queue its deployment"""
+        if not is_valid_domain(domain):
+            self.send_json_response(400, {"error": "Invalid domain"})
+            return
+
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in ARCHIVE_CONTENT_TYPES:
+            self.send_json_response(415, {"error": f"Unsupported content type: {content_type}"})
+            return
+
+        cf_token = self.headers.get('X-CF-Token')
+        if not cf_token:
+            self.send_json_response(400, {"error": "Missing X-CF-Token header"})
+            return
+
+        content_length = int(self.headers.get('Content-Length', 0))
+        if content_length <= 0:
+            self.send_json_response(411, {"error": "Content-Length required"})
+            return
+
+        # Decompress and unpack the body while it arrives
+        os.makedirs(config.uploads_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix='upload-', dir=config.uploads_dir)
+        body = LimitedReader(self.rfile, content_length)
+        try:
+            compression = extract_stream(body, staging_dir, chunk_size=config.upload_chunk_size,
+                                         max_bytes=config.max_extract_bytes)
+            body.drain(config.upload_chunk_size)
+        except UploadError as e:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self.send_json_response(400, {"error": str(e)})
+            return
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        logging.info(f"Extracted {compression} upload of {content_length} bytes for {domain}")
+
+        job = DeploymentJob(domain, {
+            'domain': domain,
+            'cf_token': cf_token,
+            'source_dir': staging_dir
+        }, log_lines=config.job_log_lines)
+        job.add_temp_path(staging_dir)
+        self.queue_deployment(job, size=content_length, compression=compression)
+
 def run_server(port=8000):
     """Run the deployment server"""
     try:
         server_address = ('', port)
-        httpd = HTTPServer(server_address, DeploymentHandler)
+        httpd = DeploymentServer(server_address, DeploymentHandler)
+        if config.gc_interval:
+            collector = get_retention_collector()
+            collector.domain_lock = httpd.job_queue.domain_lock
+            collector.start()
         logging.info(f'Starting deployment server on port {port}...')
         httpd.serve_forever()
     except Exception as e:
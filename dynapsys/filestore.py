@@ -0,0 +1,136 @@
+"""Content-addressed store deduplicating release files through hardlinks"""
+import os
+import stat
+import uuid
+import fcntl
+import logging
+from typing import Dict, Sequence
+
+from .build import SOURCE_EXCLUDES
+from .manifest import file_digest
+
+# Inside the sites directory, so release files and objects share a filesystem
+OBJECTS_DIR = '.objects'
+
+# Removed from stored objects
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+# Written in place at runtime; sharing their inodes would leak writes
+# between releases and sites
+DEDUPE_EXCLUDES = SOURCE_EXCLUDES + ('cache',)
+
+
+class FileStore:
+    """
+    Content-addressed objects hardlinked into release trees.
+
+    Identical files of different releases and sites become links to one
+    object, so disk use and page cache scale with the bytes that changed.
+    Objects are read-only so an in-place write cannot reach every tree
+    linking them, and as hardlinks share permissions they are keyed by
+    digest and read-only mode. The link count of an object is its
+    reference count: an object with a single link is only referenced by
+    the store and can be collected.
+    """
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: Directory holding the objects
+        """
+        self.root = root
+
+    def path(self, digest: str, mode: int) -> str:
+        """Path of the object holding some content with some permissions"""
+        return os.path.join(self.root, digest[:2], f'{digest}-{mode:o}')
+
+    def _lock(self, mode: int):
+        os.makedirs(self.root, exist_ok=True)
+        lock = open(os.path.join(self.root, '.lock'), 'w')
+        fcntl.flock(lock, mode)
+        return lock
+
+    def add_tree(self, tree: str, excludes: Sequence[str] = DEDUPE_EXCLUDES) -> Dict[str, int]:
+        """
+        Replace the files of a tree with links to identical objects.
+
+        Files without a matching object become new objects, and every file
+        handled loses its write permissions. Replacing a file is an atomic
+        rename, so the tree can be live while it is deduplicated.
+
+        Args:
+            tree: Release directory
+            excludes: Directory names skipped at any depth
+
+        Returns:
+            Dict[str, int]: Files seen, files linked to existing objects,
+            objects added and bytes no longer stored twice
+        """
+        stats = {'files': 0, 'linked': 0, 'stored': 0, 'bytes_saved': 0}
+        with self._lock(fcntl.LOCK_SH):
+            for dirpath, dirnames, filenames in os.walk(tree):
+                dirnames[:] = [name for name in dirnames if name not in excludes]
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    st = os.lstat(path)
+                    if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                        continue
+                    stats['files'] += 1
+                    digest = file_digest(path)
+                    mode = stat.S_IMODE(st.st_mode) & ~WRITE_BITS
+                    target = self.path(digest, mode)
+                    try:
+                        existing = os.stat(target)
+                    except FileNotFoundError:
+                        existing = None
+
+                    if existing is not None and (existing.st_dev, existing.st_ino) == (st.st_dev, st.st_ino):
+                        continue
+                    # Never trust the name alone: a changed object is replaced
+                    if existing is not None and existing.st_size == st.st_size and \
+                            stat.S_IMODE(existing.st_mode) == mode and file_digest(target) == digest:
+                        tmp_path = os.path.join(dirpath, f'.dedupe-{uuid.uuid4().hex[:8]}')
+                        os.link(target, tmp_path)
+                        os.replace(tmp_path, path)
+                        stats['linked'] += 1
+                        stats['bytes_saved'] += st.st_size
+                    else:
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        tmp_path = f'{target}.tmp-{uuid.uuid4().hex[:8]}'
+                        os.link(path, tmp_path)
+                        os.chmod(tmp_path, mode)
+                        os.replace(tmp_path, target)
+                        stats['stored'] += 1
+        logging.info(
+            f"Deduplicated {tree}: {stats['linked']} of {stats['files']} files linked, "
+            f"{stats['bytes_saved']} bytes saved"
+        )
+        return stats
+
+    def collect(self) -> Dict[str, int]:
+        """
+        Remove objects no release links to any more.
+
+        Returns:
+            Dict[str, int]: Objects removed and bytes freed
+        """
+        stats = {'objects': 0, 'bytes': 0}
+        if not os.path.isdir(self.root):
+            return stats
+        # Trees are only added under a shared lock, so nothing gains a link meanwhile
+        with self._lock(fcntl.LOCK_EX):
+            for dirpath, _, filenames in os.walk(self.root):
+                if dirpath == self.root:
+                    continue
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    st = os.lstat(path)
+                    # Temporary links are left over from interrupted adds
+                    if st.st_nlink > 1 and '.tmp-' not in name:
+                        continue
+                    os.unlink(path)
+                    stats['objects'] += 1
+                    stats['bytes'] += st.st_size
+        if stats['objects']:
+            logging.info(f"Removed {stats['objects']} unreferenced objects ({stats['bytes']} bytes)")
+        return stats
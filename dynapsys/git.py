@@ -5,6 +5,63 @@ import logging
 import sys
 import traceback
 import re
+import fcntl
+import hashlib
+import shutil
+import tempfile
+from urllib.parse import urlparse
+
+from .config import config
+from .utils import stream_command
+
+# full: complete history; shallow: last `depth` commits; partial: all commits,
+# file contents fetched on demand for the checked out tree only
+CLONE_MODES = ('full', 'shallow', 'partial')
+
+# Branch or tag names passed to --branch; no leading dash, no '..'
+REF_PATTERN = re.compile(r'^(?!-)(?!.*\.\.)[\w./-]+$')
+
+# "Receiving objects:  45% (450/1000), 1.20 MiB | 2.00 MiB/s" and the like
+PROGRESS_PATTERN = re.compile(
+    r'^(?:remote: )?(?P<phase>[A-Z][A-Za-z ]+?):\s+(?P<percent>\d+)% \((?P<done>\d+)/(?P<total>\d+)\)'
+    r'(?:, (?P<size>[\d.]+) (?P<unit>[KMGT]iB|bytes))?'
+    r'(?: \| (?P<rate>[\d.]+) (?P<rate_unit>[KMGT]iB|bytes)/s)?'
+)
+SIZE_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+# Full SHA-1 or SHA-256 object names; abbreviations cannot be fetched
+COMMIT_PATTERN = re.compile(r'^[0-9a-f]{40}(?:[0-9a-f]{24})?$')
+
+class GitProgress:
+    """Turns git --progress output into structured metrics"""
+
+    def __init__(self, callback=None):
+        """
+        Args:
+            callback: Called with a copy of the metrics after every update
+        """
+        self.callback = callback
+        self.metrics = {}
+
+    def feed(self, line):
+        """Parse one line of git output, ignoring anything but progress meters"""
+        match = PROGRESS_PATTERN.match(line.strip())
+        if not match:
+            return
+        self.metrics.update({
+            'phase': match.group('phase').lower().replace(' ', '_'),
+            'percent': int(match.group('percent')),
+            'objects': int(match.group('done')),
+            'total_objects': int(match.group('total')),
+        })
+        if match.group('size'):
+            self.metrics['bytes'] = int(float(match.group('size')) * SIZE_UNITS[match.group('unit')])
+        if match.group('rate'):
+            self.metrics['bytes_per_second'] = int(
+                float(match.group('rate')) * SIZE_UNITS[match.group('rate_unit')]
+            )
+        if self.callback is not None:
+            self.callback(dict(self.metrics))
 
 def is_valid_git_url(url):
     """Check if URL is a valid Git address"""
@@ -18,6 +75,259 @@ def is_valid_git_url(url):
     logging.info(f"Checking git URL: {url} - {'valid' if is_valid else 'invalid'}")
     return is_valid
 
+def is_valid_ref(ref):
+    """Check if a branch or tag name is safe to pass to git"""
+    return isinstance(ref, str) and bool(REF_PATTERN.match(ref))
+
+def is_valid_sparse_path(path):
+    """Check if a repository subdirectory is a safe relative path"""
+    return isinstance(path, str) and bool(path) and not path.startswith(('/', '-')) \
+        and '\\' not in path and all(part not in ('', '.', '..') for part in path.strip('/').split('/'))
+
+def is_valid_commit(commit):
+    """Check if a string is a full commit hash"""
+    return isinstance(commit, str) and bool(COMMIT_PATTERN.match(commit))
+
+def clone_options(params):
+    """
+    Extract clone_git_repo keyword arguments from deploy request parameters.
+
+    Args:
+        params: Request parameters with optional 'clone', 'ref', 'commit', 'depth',
+            'subdir', 'sparse' and 'submodules'
+
+    Returns:
+        dict: Keyword arguments for clone_git_repo
+
+    Raises:
+        ValueError: If an option is invalid
+    """
+    options = {}
+    if params.get('clone') is not None:
+        if params['clone'] not in CLONE_MODES:
+            raise ValueError(f"Invalid clone mode, expected one of: {', '.join(CLONE_MODES)}")
+        options['mode'] = params['clone']
+    if params.get('ref') is not None:
+        if not is_valid_ref(params['ref']):
+            raise ValueError("Invalid ref")
+        options['ref'] = params['ref']
+    if params.get('commit') is not None:
+        if not is_valid_commit(params['commit']):
+            raise ValueError("Commit must be a full lowercase hash")
+        options['commit'] = params['commit']
+    if params.get('depth') is not None:
+        depth = params['depth']
+        if isinstance(depth, bool) or not isinstance(depth, int) or depth < 1:
+            raise ValueError("Depth must be a positive integer")
+        options['depth'] = depth
+    if params.get('subdir') is not None:
+        # The app plus any shared packages it builds against
+        paths = [params['subdir']] + list(params.get('sparse') or [])
+        if not all(is_valid_sparse_path(path) for path in paths):
+            raise ValueError("Invalid subdir or sparse path")
+        options['sparse_paths'] = [path.strip('/') for path in paths]
+    elif params.get('sparse'):
+        raise ValueError("Sparse paths require a subdir")
+    if params.get('submodules') is not None:
+        options['submodules'] = bool(params['submodules'])
+    return options
+
+def build_clone_command(git_url, target_dir, mode='full', ref=None, depth=1, sparse=False):
+    """Assemble the git clone command line for a clone strategy"""
+    if mode not in CLONE_MODES:
+        raise ValueError(f"Unknown clone mode: {mode}")
+    command = ['git', 'clone', '--progress']
+    if mode == 'shallow':
+        # --depth implies --single-branch
+        command += ['--depth', str(depth)]
+    elif mode == 'partial':
+        command += ['--filter=blob:none']
+    if ref:
+        command += ['--single-branch', '--branch', ref]
+    if sparse:
+        # Only top-level files until the sparse-checkout cone is set
+        command += ['--sparse']
+    return command + ['--', git_url, target_dir]
+
+def normalize_git_url(url):
+    """
+    Reduce equivalent spellings of a repository URL to one cache key.
+
+    https://github.com/User/repo.git, https://github.com/User/repo/ and
+    git@github.com:User/repo all map to github.com/User/repo.
+    """
+    url = url.strip()
+    match = re.match(r'^[\w.-]+@([^:/]+):(.+)$', url)
+    if match:
+        host, path = match.groups()
+    else:
+        parsed = urlparse(url)
+        host, path = parsed.hostname or '', parsed.path
+    path = path.strip('/')
+    if path.endswith('.git'):
+        path = path[:-len('.git')]
+    return f"{host.lower()}/{path}"
+
+def mirror_path(git_url, mirrors_dir=None):
+    """Path of the bare mirror caching a repository"""
+    key = normalize_git_url(git_url)
+    name = re.sub(r'[^\w.-]+', '_', key).strip('_')[:80]
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(mirrors_dir or config.git_mirrors_dir, f"{name}-{digest}.git")
+
+def _configure_mirror(path):
+    """Let shallow, partial and commit-pinned checkouts be cut from a mirror"""
+    for key in ('uploadpack.allowFilter', 'uploadpack.allowAnySHA1InWant'):
+        subprocess.run(['git', '--git-dir', path, 'config', key, 'true'], check=True)
+
+def _has_commit(git_dir, commit):
+    """Whether a repository already contains a commit"""
+    return subprocess.run(
+        ['git', '--git-dir', git_dir, 'cat-file', '-e', f'{commit}^{{commit}}'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ).returncode == 0
+
+def update_mirror(git_url, mirrors_dir=None, want=None, on_progress=None):
+    """
+    Create or refresh the bare mirror of a repository.
+
+    The first call clones the full repository once; later calls fetch only
+    new objects. A lock file serializes concurrent updates of one mirror.
+
+    Args:
+        git_url: Repository URL
+        mirrors_dir: Cache directory, defaults to DYNAPSYS_GIT_MIRRORS_DIR
+        want: Commit needed; no fetch happens if the mirror already has it
+        on_progress: Called with transfer metrics while fetching
+
+    Returns:
+        str: Path of the up to date mirror, None if it could not be updated
+    """
+    path = mirror_path(git_url, mirrors_dir)
+    progress = GitProgress(on_progress)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isdir(path):
+            if want and _has_commit(path, want):
+                logging.info(f"Mirror {path} already has {want}")
+                return path
+            logging.info(f"Fetching into mirror {path}")
+            returncode, tail = stream_command(
+                ['git', '--git-dir', path, 'fetch', '--progress', '--prune', 'origin'],
+                prefix='git: ', on_line=progress.feed
+            )
+            if returncode != 0:
+                logging.warning(f"Mirror fetch failed (exit {returncode}): {tail[-1] if tail else ''}")
+                return None
+            _configure_mirror(path)
+            return path
+
+        logging.info(f"Creating mirror of {git_url} in {path}")
+        staging = tempfile.mkdtemp(prefix='.mirror-', dir=os.path.dirname(path))
+        try:
+            returncode, tail = stream_command(
+                ['git', 'clone', '--mirror', '--progress', '--', git_url, staging],
+                prefix='git: ', on_line=progress.feed
+            )
+            if returncode != 0:
+                logging.warning(f"Mirror clone failed (exit {returncode}): {tail[-1] if tail else ''}")
+                return None
+            _configure_mirror(staging)
+            os.rename(staging, path)
+            return path
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging)
+
+def resolve_commit(git_url, ref=None, use_mirror=None, on_progress=None):
+    """
+    Find the commit a branch or tag of a remote points at without a checkout.
+
+    Args:
+        git_url: Repository URL
+        ref: Branch or tag, default branch if None
+        use_mirror: Resolve through the refreshed mirror, defaults to DYNAPSYS_GIT_MIRROR_CACHE
+        on_progress: Called with transfer metrics while the mirror is fetched
+
+    Returns:
+        str: Commit hash, None if it could not be resolved
+    """
+    try:
+        if config.git_mirror_cache if use_mirror is None else use_mirror:
+            mirror = update_mirror(git_url, on_progress=on_progress)
+            if mirror:
+                return subprocess.check_output(
+                    ['git', '--git-dir', mirror, 'rev-parse', '--verify', '--quiet',
+                     f"{ref or 'HEAD'}^{{commit}}"],
+                    universal_newlines=True
+                ).strip() or None
+
+        output = subprocess.check_output(
+            ['git', 'ls-remote', '--', git_url, ref or 'HEAD', f"{ref or 'HEAD'}^{{}}"],
+            universal_newlines=True
+        )
+        commits = {}
+        for line in output.splitlines():
+            sha, name = line.split('\t', 1)
+            commits[name] = sha
+        if not ref:
+            return commits.get('HEAD')
+        # Annotated tags are listed twice; the peeled entry names the commit
+        for name in (f'refs/heads/{ref}', f'refs/tags/{ref}^{{}}', f'refs/tags/{ref}', ref):
+            if name in commits:
+                return commits[name]
+        return None
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logging.warning(f"Could not resolve {ref or 'HEAD'} of {git_url}: {str(e)}")
+        return None
+
+def head_commit(target_dir):
+    """Commit checked out in a directory, None if it is not a checkout"""
+    try:
+        return subprocess.check_output(
+            ['git', '-C', target_dir, 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip() or None
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def _run_git(target_dir, *args, on_line=None):
+    """Run a git command in a checkout, returning True on success"""
+    returncode, tail = stream_command(['git', '-C', target_dir] + list(args), prefix='git: ', on_line=on_line)
+    if returncode != 0:
+        logging.warning(f"git {args[0]} failed (exit {returncode}): {tail[-1] if tail else ''}")
+    return returncode == 0
+
+def _configure_checkout(target_dir, sparse_paths=None, submodules=False, on_line=None):
+    """
+    Apply the sparse-checkout cone and check out submodules.
+
+    Args:
+        target_dir: Checkout to configure
+        sparse_paths: Directories to materialize, None for the whole tree
+        submodules: Initialize and update submodules recursively
+        on_line: Receives git output, e.g. for progress parsing
+
+    Returns:
+        bool: True on success
+    """
+    if sparse_paths:
+        if not _run_git(target_dir, 'sparse-checkout', 'set', '--cone', '--', *sparse_paths):
+            return False
+    elif subprocess.run(['git', '-C', target_dir, 'config', '--bool', 'core.sparseCheckout'],
+                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                        universal_newlines=True).stdout.strip() == 'true':
+        if not _run_git(target_dir, 'sparse-checkout', 'disable'):
+            return False
+    if submodules:
+        # Relative submodule URLs resolve against origin, so it must point at the real remote
+        return _run_git(target_dir, 'submodule', 'sync', '--recursive') and _run_git(
+            target_dir, 'submodule', 'update', '--init', '--recursive', '--progress',
+            '--jobs', str(config.git_submodule_jobs), on_line=on_line
+        )
+    return True
+
 def check_git_installation():
     """Check if git is installed and available"""
     try:
@@ -31,20 +341,39 @@ def check_git_installation():
         logging.error("Git command not found")
         return False
 
-def clone_git_repo(git_url, target_dir):
-    """Clone git repository to specified directory"""
+def clone_git_repo(git_url, target_dir, mode=None, ref=None, depth=None, use_mirror=None,
+                   commit=None, on_progress=None, sparse_paths=None, submodules=None):
+    """
+    Clone git repository to specified directory
+
+    Args:
+        git_url: Repository URL
+        target_dir: Directory to clone into, replaced if it exists
+        mode: One of CLONE_MODES, defaults to DYNAPSYS_GIT_CLONE_MODE
+        ref: Branch or tag to check out; only that branch is fetched
+        depth: Commits fetched by shallow clones, defaults to DYNAPSYS_GIT_CLONE_DEPTH
+        use_mirror: Clone through the local mirror cache, defaults to DYNAPSYS_GIT_MIRROR_CACHE
+        commit: Exact commit to check out, reachable from ref
+        on_progress: Called with parsed --progress metrics (phase, percent,
+            objects, bytes, bytes_per_second) while objects are transferred
+        sparse_paths: Directories to materialize with a cone-mode sparse
+            checkout, None for the whole tree
+        submodules: Check out submodules recursively, defaults to
+            DYNAPSYS_GIT_RECURSE_SUBMODULES
+    """
     try:
+        mode = mode or config.git_clone_mode
+        depth = depth or config.git_clone_depth
+        submodules = config.git_recurse_submodules if submodules is None else submodules
+        if mode not in CLONE_MODES:
+            raise ValueError(f"Unknown clone mode: {mode}")
+
         # Check git installation
         if not check_git_installation():
             raise Exception("Git is not installed")
 
         logging.info(f"Starting git clone: {git_url} -> {target_dir}")
 
-        # Ensure target directory is empty
-        if os.path.exists(target_dir):
-            logging.info(f"Removing existing directory: {target_dir}")
-            subprocess.run(['rm', '-rf', target_dir], check=True)
-
         # Create parent directory
         os.makedirs(os.path.dirname(target_dir), exist_ok=True)
 
@@ -55,36 +384,49 @@ def clone_git_repo(git_url, target_dir):
             logging.error(f"No write permission to {parent_dir}")
             raise Exception(f"No write permission to {parent_dir}")
 
-        # Clone with full logging
-        logging.info(f"Executing git clone {git_url}")
-        process = subprocess.Popen(
-            ['git', 'clone', git_url, target_dir],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
+        # Fetch new objects into the mirror once, then check out locally
+        source = git_url
+        if config.git_mirror_cache if use_mirror is None else use_mirror:
+            mirror = update_mirror(git_url, want=commit, on_progress=on_progress)
+            if mirror:
+                # A plain path hardlinks objects; file:// honours --depth and --filter
+                source = mirror if mode == 'full' else f'file://{mirror}'
+            else:
+                logging.warning("Mirror unavailable, cloning from the remote")
+
+        # Ensure target directory is empty
+        if os.path.exists(target_dir):
+            logging.info(f"Removing existing directory: {target_dir}")
+            subprocess.run(['rm', '-rf', target_dir], check=True)
 
-        # Read output in real time
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                logging.info(f"Git output: {output.strip()}")
+        command = build_clone_command(source, target_dir, mode=mode, ref=ref, depth=depth,
+                                      sparse=bool(sparse_paths))
 
-        # Get stderr after completion
-        _, stderr = process.communicate()
-        if stderr:
-            logging.error(f"Git stderr: {stderr}")
+        # Clone with full logging; progress goes to stderr, read alongside stdout
+        logging.info(f"Executing {' '.join(command)}")
+        progress = GitProgress(on_progress)
+        returncode, tail = stream_command(command, prefix='git: ', on_line=progress.feed)
 
         # Check exit code
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(process.returncode, 'git clone')
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, 'git clone', output='\n'.join(tail))
 
         # Check if directory was created and contains files
         if not os.path.exists(target_dir) or not os.listdir(target_dir):
             raise Exception("Git clone completed but directory is empty")
 
+        if commit and head_commit(target_dir) != commit:
+            fetch = ['fetch', '--progress', '--no-tags'] + (['--depth', str(depth)] if mode == 'shallow' else [])
+            if not (_run_git(target_dir, *fetch, '--', source, commit, on_line=progress.feed)
+                    and _run_git(target_dir, 'reset', '--hard', 'FETCH_HEAD')):
+                raise Exception(f"Commit {commit} could not be checked out")
+
+        if source != git_url:
+            subprocess.run(['git', '-C', target_dir, 'remote', 'set-url', 'origin', git_url], check=True)
+
+        if not _configure_checkout(target_dir, sparse_paths, submodules, on_line=progress.feed):
+            raise Exception("Sparse checkout or submodule update failed")
+
         # Display repository contents
         logging.info(f"Repository contents: {os.listdir(target_dir)}")
 
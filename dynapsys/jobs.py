@@ -0,0 +1,436 @@
+"""Asynchronous deployment jobs for DynaPsys"""
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SUPERSEDED = 'superseded'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, SUPERSEDED)
+
+# Request fields only the pipeline reads: inline archives, manifests and the
+# Cloudflare token are dropped from finished jobs kept in the history
+TRANSIENT_PARAMS = ('source', 'cf_token', 'manifest')
+
+
+class DeploymentJob:
+    """A single deployment request and its progress"""
+
+    def __init__(self, domain: str, params: Dict[str, Any], log_lines: int = 200):
+        """
+        Create a new queued job.
+
+        Args:
+            domain: Domain being deployed
+            params: Deployment request parameters
+            log_lines: Number of log lines kept for the log tail
+        """
+        self.id = uuid.uuid4().hex
+        self.domain = domain
+        self.params = params
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Dict[str, Any] = {}
+        self.stages: List[Dict[str, Any]] = []
+        self.progress: Dict[str, Any] = {}
+        self.log: deque = deque(maxlen=log_lines)
+        # Number of lines ever appended; followers use it as a cursor
+        self.log_seq = 0
+        self.log_path: Optional[str] = None
+        self._log_file = None
+        self._log_closed = False
+        self._log_cond = threading.Condition()
+        self.superseded_by: Optional[str] = None
+        self.temp_paths: List[str] = []
+
+    def set_stage(self, stage: str) -> None:
+        """Record the pipeline stage the job has entered"""
+        now = time.time()
+        if self.stages and self.stages[-1]['finished_at'] is None:
+            self.stages[-1]['finished_at'] = now
+        self.stages.append({'name': stage, 'started_at': now, 'finished_at': None})
+        logging.info(f"[{self.id}] {self.domain}: stage {stage}")
+        self.stage = stage
+
+    def set_progress(self, metrics: Dict[str, Any]) -> None:
+        """Record transfer metrics of the current stage, e.g. git clone progress"""
+        self.progress = dict(metrics, stage=self.stage, updated_at=time.time())
+
+    def finish(self, success: bool) -> None:
+        """Close the current stage and record the final state"""
+        self.finished_at = time.time()
+        if self.stages and self.stages[-1]['finished_at'] is None:
+            self.stages[-1]['finished_at'] = self.finished_at
+        self.status = SUCCEEDED if success else FAILED
+        if success:
+            self.stage = 'done'
+        self.drop_params()
+
+    def supersede(self, job_id: str) -> None:
+        """Drop a queued job in favour of a newer one for the same domain"""
+        self.superseded_by = job_id
+        self.status = SUPERSEDED
+        self.stage = SUPERSEDED
+        self.finished_at = time.time()
+        self.drop_params()
+        self.cleanup()
+        self.close_log()
+
+    def drop_params(self) -> None:
+        """Forget request fields that are large or secret once the job is over"""
+        self.params = {key: value for key, value in self.params.items() if key not in TRANSIENT_PARAMS}
+
+    def add_temp_path(self, path: str) -> None:
+        """Register a spool file or directory removed once the job is over"""
+        self.temp_paths.append(path)
+
+    def keep_path(self, path: str) -> None:
+        """Unregister a temporary path that has to outlive the job"""
+        if path in self.temp_paths:
+            self.temp_paths.remove(path)
+
+    def cleanup(self) -> None:
+        """Remove temporary files belonging to the job"""
+        while self.temp_paths:
+            path = self.temp_paths.pop()
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.unlink(path)
+            except OSError as e:
+                logging.warning(f"Could not remove {path}: {str(e)}")
+
+    def open_log_file(self, path: str) -> None:
+        """Also write every log line to a file"""
+        self._log_file = open(path, 'a', buffering=1, encoding='utf-8', errors='replace')
+        self.log_path = path
+
+    def append_log(self, line: str) -> None:
+        """Add a line to the job log tail and wake up followers"""
+        with self._log_cond:
+            self.log.append(line)
+            self.log_seq += 1
+            if self._log_file is not None:
+                self._log_file.write(line + '\n')
+            self._log_cond.notify_all()
+
+    def close_log(self) -> None:
+        """Mark the log complete and close the log file"""
+        with self._log_cond:
+            self._log_closed = True
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+            self._log_cond.notify_all()
+
+    @property
+    def log_closed(self) -> bool:
+        """Whether no more lines will be appended"""
+        return self._log_closed
+
+    def read_log(self, after: int, timeout: Optional[float] = None) -> Tuple[List[str], int]:
+        """
+        Wait for log lines appended after a cursor.
+
+        Lines that already left the tail are skipped.
+
+        Args:
+            after: Value of log_seq already seen
+            timeout: Seconds to wait for new lines, None to wait forever
+
+        Returns:
+            Tuple[List[str], int]: New lines and the cursor to pass next time
+        """
+        with self._log_cond:
+            self._log_cond.wait_for(
+                lambda: self.log_seq > after or self._log_closed, timeout
+            )
+            first = self.log_seq - len(self.log)
+            lines = list(self.log)[max(0, after - first):]
+            return lines, self.log_seq
+
+    def fail(self, error: str) -> bool:
+        """Mark the current stage as failed and return False for convenience"""
+        self.error = error
+        return False
+
+    @property
+    def finished(self) -> bool:
+        """Whether the job has reached a final state"""
+        return self.status in FINISHED_STATES
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Seconds spent running, so far or in total"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self, log_lines: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Serialize the job for API responses.
+
+        Args:
+            log_lines: Number of log lines to include, None for no log
+
+        Returns:
+            Dict[str, Any]: Job summary
+        """
+        data = {
+            'id': self.id,
+            'domain': self.domain,
+            'status': self.status,
+            'stage': self.stage,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration': self.duration,
+            'stages': [dict(stage) for stage in self.stages],
+            'result': self.result,
+        }
+        if self.progress:
+            data['progress'] = dict(self.progress)
+        if self.superseded_by:
+            data['superseded_by'] = self.superseded_by
+        if self.log_path:
+            data['log_file'] = self.log_path
+        if log_lines is not None:
+            lines = list(self.log)
+            data['log'] = lines[-log_lines:] if log_lines > 0 else []
+        return data
+
+
+class JobIndex:
+    """In-memory index of recent jobs, bounded like a ring buffer"""
+
+    def __init__(self, max_jobs: int = 200):
+        """
+        Args:
+            max_jobs: Number of jobs remembered before the oldest are dropped
+        """
+        self.max_jobs = max(1, max_jobs)
+        self._jobs: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, job: DeploymentJob) -> None:
+        """Remember a job, evicting the oldest one when full"""
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def get(self, job_id: str) -> Optional[DeploymentJob]:
+        """Look up a job by id"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, domain: Optional[str] = None, limit: int = 50) -> List[DeploymentJob]:
+        """
+        List recent jobs, newest first.
+
+        Args:
+            domain: Only return jobs for this domain
+            limit: Maximum number of jobs returned
+
+        Returns:
+            List[DeploymentJob]: Matching jobs
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        matches = [job for job in reversed(jobs) if domain is None or job.domain == domain]
+        return matches[:max(0, limit)]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+
+class JobLogHandler(logging.Handler):
+    """Copy log records emitted by a worker thread into the job it is running"""
+
+    def __init__(self):
+        super().__init__()
+        self._jobs: Dict[int, DeploymentJob] = {}
+        self.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    def attach(self, job: DeploymentJob) -> None:
+        """Route records from the current thread to a job"""
+        self._jobs[threading.get_ident()] = job
+
+    def detach(self) -> None:
+        """Stop routing records from the current thread"""
+        self._jobs.pop(threading.get_ident(), None)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        job = self._jobs.get(record.thread)
+        if job is None:
+            return
+        try:
+            job.append_log(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class JobQueue:
+    """
+    Bounded queue of deployment jobs served by a fixed pool of worker threads.
+
+    Jobs are serialized per domain: while a domain is building, further
+    requests for it collapse into a single pending follow-up job and only
+    the latest one is kept.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[DeploymentJob], bool],
+        workers: int = 2,
+        max_queued: int = 16,
+        index: Optional[JobIndex] = None,
+        log_dir: Optional[str] = None
+    ):
+        """
+        Args:
+            runner: Callable executing a job, returning True on success
+            workers: Number of worker threads
+            max_queued: Maximum number of domains waiting for a worker
+            index: Index recording submitted jobs
+            log_dir: Directory receiving one log file per job
+        """
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.index = index if index is not None else JobIndex()
+        self.log_dir = log_dir
+        # Domains ready to run; the job itself lives in _pending
+        self._queue: queue.Queue = queue.Queue()
+        self._pending: Dict[str, DeploymentJob] = {}
+        self._running: Dict[str, DeploymentJob] = {}
+        self._domain_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._log_handler = JobLogHandler()
+
+    def start(self) -> None:
+        """Start worker threads (idempotent)"""
+        with self._lock:
+            if self._threads:
+                return
+            logging.getLogger().addHandler(self._log_handler)
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f'dynapsys-worker-{index}',
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job: DeploymentJob) -> bool:
+        """
+        Queue a job for execution.
+
+        A job still waiting for the same domain is superseded by this one.
+
+        Args:
+            job: Job to queue
+
+        Returns:
+            bool: True if queued, False if the queue is full
+        """
+        self.start()
+        domain = job.domain
+        with self._lock:
+            previous = self._pending.get(domain)
+            if previous is None:
+                if len(self._pending) >= self.max_queued:
+                    logging.warning(f"Deployment queue full, rejecting job for {domain}")
+                    return False
+                # A running domain is re-queued by its worker once it finishes
+                if domain not in self._running:
+                    self._queue.put_nowait(domain)
+            self._pending[domain] = job
+            if previous is not None:
+                previous.supersede(job.id)
+                logging.info(f"Deployment job {previous.id} for {domain} superseded by {job.id}")
+        self.index.add(job)
+        logging.info(f"Queued deployment job {job.id} for {domain}")
+        return True
+
+    def qsize(self) -> int:
+        """Number of jobs waiting for a worker"""
+        with self._lock:
+            return len(self._pending)
+
+    def domain_lock(self, domain: str) -> threading.Lock:
+        """Lock held while a domain's site directory is being modified"""
+        with self._lock:
+            return self._domain_locks[domain]
+
+    def join(self) -> None:
+        """Block until every queued job has been processed"""
+        self._queue.join()
+
+    def _worker(self) -> None:
+        """Worker loop executing queued jobs"""
+        while True:
+            domain = self._queue.get()
+            try:
+                with self._lock:
+                    job = self._pending.pop(domain, None)
+                    if job is not None:
+                        self._running[domain] = job
+                if job is None:
+                    continue
+                with self.domain_lock(domain):
+                    self._run(job)
+            finally:
+                with self._lock:
+                    self._running.pop(domain, None)
+                    # Requests that arrived meanwhile collapse into one follow-up build
+                    if domain in self._pending:
+                        self._queue.put_nowait(domain)
+                self._queue.task_done()
+
+    def _run(self, job: DeploymentJob) -> None:
+        """Run a single job and record its outcome"""
+        job.status = RUNNING
+        job.started_at = time.time()
+        if self.log_dir:
+            try:
+                os.makedirs(self.log_dir, exist_ok=True)
+                job.open_log_file(os.path.join(self.log_dir, f'{job.domain}-{job.id}.log'))
+            except OSError as e:
+                logging.warning(f"Could not open log file for job {job.id}: {str(e)}")
+        self._log_handler.attach(job)
+        try:
+            success = self.runner(job)
+        except Exception as e:
+            logging.error(f"Deployment job {job.id} crashed: {str(e)}\n{traceback.format_exc()}")
+            job.error = job.error or str(e)
+            success = False
+        finally:
+            job.cleanup()
+        job.finish(success)
+        logging.info(
+            f"Deployment job {job.id} for {job.domain} {job.status} "
+            f"in {job.duration:.1f}s"
+        )
+        self._log_handler.detach()
+        job.close_log()
@@ -0,0 +1,214 @@
+"""File manifests for delta uploads"""
+import os
+import hashlib
+import logging
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+from .blobs import BlobStore, is_valid_digest
+from .uploads import DEFAULT_CHUNK_SIZE, UploadError
+
+# Written into every assembled tree so the next sync does not rehash it
+MANIFEST_FILE = '.dynapsys-manifest.json'
+
+# Directories never included in a manifest
+DEFAULT_EXCLUDES = ('.git', 'node_modules')
+
+
+def file_digest(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """
+    Compute the SHA-256 of a file.
+
+    Args:
+        path: File to hash
+        chunk_size: Read size
+
+    Returns:
+        str: Hex digest
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def build_manifest(root: str, excludes: Sequence[str] = DEFAULT_EXCLUDES) -> List[Dict[str, Any]]:
+    """
+    Describe every regular file below a directory.
+
+    Args:
+        root: Directory to scan
+        excludes: Directory names skipped at any depth
+
+    Returns:
+        List[Dict[str, Any]]: Entries with path, size, sha256 and mode
+    """
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in excludes)
+        for name in sorted(filenames):
+            full_path = os.path.join(dirpath, name)
+            rel_path = os.path.relpath(full_path, root).replace(os.sep, '/')
+            if rel_path == MANIFEST_FILE or os.path.islink(full_path) or not os.path.isfile(full_path):
+                continue
+            stat = os.stat(full_path)
+            entries.append({
+                'path': rel_path,
+                'size': stat.st_size,
+                'sha256': file_digest(full_path),
+                'mode': stat.st_mode & 0o777,
+            })
+    return entries
+
+
+def validate_manifest(entries: Any) -> List[Dict[str, Any]]:
+    """
+    Check a manifest received from a client.
+
+    Args:
+        entries: Parsed JSON manifest
+
+    Returns:
+        List[Dict[str, Any]]: The validated entries
+
+    Raises:
+        UploadError: If the manifest is malformed or contains unsafe paths
+    """
+    if not isinstance(entries, list):
+        raise UploadError("Manifest must be a list of files")
+    seen = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise UploadError("Manifest entries must be objects")
+        path = entry.get('path')
+        if not isinstance(path, str) or not path or path.startswith('/') \
+                or '\\' in path or any(part in ('', '.', '..') for part in path.split('/')):
+            raise UploadError(f"Unsafe path in manifest: {path}")
+        if path == MANIFEST_FILE or path in seen:
+            raise UploadError(f"Invalid or duplicate path in manifest: {path}")
+        if not is_valid_digest(entry.get('sha256', '')):
+            raise UploadError(f"Invalid digest for {path}")
+        if not isinstance(entry.get('size'), int) or entry['size'] < 0:
+            raise UploadError(f"Invalid size for {path}")
+        if 'mode' in entry and not isinstance(entry['mode'], int):
+            raise UploadError(f"Invalid mode for {path}")
+        seen.add(path)
+    return entries
+
+
+def load_tree_index(root: str) -> Dict[str, str]:
+    """
+    Map content digests to files of a previously assembled tree.
+
+    The manifest written by assemble_tree is used when present; other
+    trees are hashed once.
+
+    Args:
+        root: Tree to index
+
+    Returns:
+        Dict[str, str]: sha256 -> absolute file path
+    """
+    if not os.path.isdir(root):
+        return {}
+    entries = None
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable manifest {manifest_path}: {str(e)}")
+    if entries is None:
+        entries = build_manifest(root)
+
+    index = {}
+    for entry in entries:
+        path = os.path.join(root, entry['path'])
+        # Cheap sanity check; content is verified again while copying
+        if os.path.isfile(path) and os.path.getsize(path) == entry['size']:
+            index.setdefault(entry['sha256'], path)
+    return index
+
+
+def missing_files(
+    entries: List[Dict[str, Any]],
+    previous_root: Optional[str],
+    blob_store: BlobStore
+) -> List[str]:
+    """
+    List manifest paths whose content the server does not have.
+
+    Args:
+        entries: Validated manifest
+        previous_root: Previous tree of the site, if any
+        blob_store: Store holding uploaded files
+
+    Returns:
+        List[str]: Paths the client has to upload (one per distinct digest)
+    """
+    index = load_tree_index(previous_root) if previous_root else {}
+    missing = []
+    requested = set()
+    for entry in entries:
+        digest = entry['sha256']
+        if digest in index or digest in requested or blob_store.exists(digest):
+            continue
+        requested.add(digest)
+        missing.append(entry['path'])
+    return missing
+
+
+def _copy_verified(source: str, target: str, digest: str) -> bool:
+    """Copy a file, returning False if its content does not match digest"""
+    sha = hashlib.sha256()
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        for chunk in iter(lambda: src.read(DEFAULT_CHUNK_SIZE), b''):
+            sha.update(chunk)
+            dst.write(chunk)
+    return sha.hexdigest() == digest
+
+
+def assemble_tree(
+    entries: List[Dict[str, Any]],
+    previous_root: Optional[str],
+    blob_store: BlobStore,
+    target_dir: str
+) -> Dict[str, int]:
+    """
+    Build a new tree from the previous one plus uploaded blobs.
+
+    Args:
+        entries: Validated manifest of the new tree
+        previous_root: Previous tree of the site, if any
+        blob_store: Store holding uploaded files
+        target_dir: Empty directory receiving the tree
+
+    Returns:
+        Dict[str, int]: Number of files reused and taken from uploads
+
+    Raises:
+        UploadError: If the content of a file is unavailable
+    """
+    index = load_tree_index(previous_root) if previous_root else {}
+    stats = {'reused': 0, 'uploaded': 0}
+    for entry in entries:
+        digest = entry['sha256']
+        target = os.path.join(target_dir, *entry['path'].split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        if digest in index and _copy_verified(index[digest], target, digest):
+            stats['reused'] += 1
+        elif blob_store.exists(digest) and _copy_verified(blob_store.path(digest), target, digest):
+            stats['uploaded'] += 1
+        else:
+            raise UploadError(f"Content of {entry['path']} is missing")
+
+        if 'mode' in entry:
+            os.chmod(target, int(entry['mode']) & 0o777)
+
+    with open(os.path.join(target_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(entries, f)
+    logging.info(f"Assembled {len(entries)} files: {stats['reused']} reused, {stats['uploaded']} uploaded")
+    return stats
@@ -0,0 +1,168 @@
+"""Release directories of deployed sites and the symlink selecting the live one"""
+import os
+import uuid
+import fcntl
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+RELEASES_DIR = 'releases'
+CURRENT_LINK = 'current'
+
+# Per-domain lock files, inside the sites directory rather than a site
+# directory, which migrate() moves as a whole
+LOCKS_DIR = '.locks'
+
+
+class ReleaseStore:
+    """
+    Per-site release layout under the sites directory.
+
+    Every deployment builds into sites/<domain>/releases/<id>; the live
+    release is the target of the sites/<domain>/current symlink, which is
+    swapped atomically so the site is never half updated.
+    """
+
+    def __init__(self, sites_dir: str):
+        """
+        Args:
+            sites_dir: Directory holding one directory per domain
+        """
+        self.sites_dir = sites_dir
+
+    def site_dir(self, domain: str) -> str:
+        """Directory of a domain"""
+        return os.path.join(self.sites_dir, domain)
+
+    def releases_dir(self, domain: str) -> str:
+        """Directory holding the releases of a domain"""
+        return os.path.join(self.site_dir(domain), RELEASES_DIR)
+
+    def current_link(self, domain: str) -> str:
+        """Path of the symlink to the live release; stable across deployments"""
+        return os.path.join(self.site_dir(domain), CURRENT_LINK)
+
+    def path(self, domain: str, release_id: str) -> str:
+        """Directory of a release"""
+        return os.path.join(self.releases_dir(domain), release_id)
+
+    def lock(self, domain: str, blocking: bool = True):
+        """
+        Take the exclusive lock on the releases of a domain.
+
+        It is an flock, so deployments, rollbacks and retention passes of
+        the server and of the command line exclude each other.
+
+        Args:
+            domain: Domain to lock
+            blocking: Wait for the lock instead of giving up
+
+        Returns:
+            File holding the lock until it is closed, None if not blocking
+            and another holder has it
+        """
+        locks_dir = os.path.join(self.sites_dir, LOCKS_DIR)
+        os.makedirs(locks_dir, exist_ok=True)
+        lock = open(os.path.join(locks_dir, f'{domain}.lock'), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    @staticmethod
+    def new_id() -> str:
+        """Release id sorting in creation order"""
+        return datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+
+    def list(self, domain: str) -> List[str]:
+        """Release ids of a domain, oldest first"""
+        try:
+            names = os.listdir(self.releases_dir(domain))
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names
+                      if not name.startswith('.') and os.path.isdir(self.path(domain, name)))
+
+    def current(self, domain: str) -> Optional[str]:
+        """Id of the live release, None if the domain has none"""
+        try:
+            target = os.readlink(self.current_link(domain))
+        except OSError:
+            return None
+        release_id = os.path.basename(target.rstrip('/'))
+        return release_id if os.path.isdir(self.path(domain, release_id)) else None
+
+    def current_path(self, domain: str) -> Optional[str]:
+        """Directory of the live release, None if the domain has none"""
+        release_id = self.current(domain)
+        return self.path(domain, release_id) if release_id else None
+
+    def live_dir(self, domain: str) -> Optional[str]:
+        """Directory serving a domain: the live release or a checkout not migrated yet"""
+        current = self.current_path(domain)
+        if current is not None:
+            return current
+        return self.site_dir(domain) if self._is_plain_checkout(domain) else None
+
+    def _is_plain_checkout(self, domain: str) -> bool:
+        """Whether the domain was deployed directly into its site directory"""
+        site_dir = self.site_dir(domain)
+        return os.path.isdir(site_dir) and not os.path.islink(site_dir) and \
+            not os.path.lexists(self.current_link(domain)) and \
+            not os.path.isdir(self.releases_dir(domain))
+
+    def previous(self, domain: str) -> Optional[str]:
+        """Id of the release deployed before the live one"""
+        releases = self.list(domain)
+        current = self.current(domain)
+        if current not in releases:
+            return releases[-1] if releases else None
+        index = releases.index(current)
+        return releases[index - 1] if index > 0 else None
+
+    def activate(self, domain: str, release_id: str) -> Optional[str]:
+        """
+        Make a release live by atomically repointing the current symlink.
+
+        Args:
+            domain: Domain to switch
+            release_id: Release to make live
+
+        Returns:
+            Optional[str]: Id of the release that was live before
+        """
+        if not os.path.isdir(self.path(domain, release_id)):
+            raise ValueError(f"Unknown release {release_id} of {domain}")
+        previous = self.current(domain)
+        link = self.current_link(domain)
+        tmp_link = f"{link}.tmp-{uuid.uuid4().hex[:8]}"
+        # Relative, so the site directory can be moved as a whole
+        os.symlink(os.path.join(RELEASES_DIR, release_id), tmp_link)
+        try:
+            os.replace(tmp_link, link)
+        finally:
+            if os.path.lexists(tmp_link):
+                os.unlink(tmp_link)
+        logging.info(f"Release {release_id} of {domain} is live (was {previous})")
+        return previous
+
+    def migrate(self, domain: str) -> Optional[str]:
+        """
+        Turn a site deployed directly into sites/<domain> into its first release.
+
+        Returns:
+            Optional[str]: Id of the created release, None if nothing was migrated
+        """
+        if not self._is_plain_checkout(domain):
+            return None
+        site_dir = self.site_dir(domain)
+        release_id = self.new_id()
+        staging = os.path.join(self.sites_dir, f'.{domain}-{release_id}')
+        os.rename(site_dir, staging)
+        os.makedirs(self.releases_dir(domain))
+        os.rename(staging, self.path(domain, release_id))
+        self.activate(domain, release_id)
+        logging.info(f"Moved existing checkout of {domain} into release {release_id}")
+        return release_id
@@ -0,0 +1,344 @@
+"""Retention of old releases and backups, deleted in the background"""
+import os
+import re
+import time
+import shutil
+import logging
+import subprocess
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .blobs import BlobStore
+from .build import tree_size
+from .config import config
+from .filestore import OBJECTS_DIR, FileStore
+from .releases import ReleaseStore
+from .sites import SiteStateStore
+
+# Backups left by php_deploy.py: /var/www/<domain>_backup_<stamp> and
+# /etc/caddy/Caddyfile.backup_<stamp>, grouped by what they back up
+BACKUP_PATTERN = re.compile(r'^(?P<group>.+?)[._]backup_(?P<stamp>\d{8}_\d{6})$')
+BACKUP_STAMP = '%Y%m%d_%H%M%S'
+RELEASE_STAMP = '%Y%m%d-%H%M%S'
+
+# Full job logs written by JobQueue: <domain>-<job id>.log
+JOB_LOG_PATTERN = re.compile(r'^(?P<domain>.+)-[0-9a-f]{32}\.log$')
+
+# Doomed entries are renamed to this prefix first, so they vanish from
+# listings at once and interrupted deletions are finished by the next pass
+TRASH_PREFIX = '.trash-'
+
+
+def _parse_stamp(stamp: str, fmt: str) -> Optional[float]:
+    try:
+        return time.mktime(datetime.strptime(stamp, fmt).timetuple())
+    except ValueError:
+        return None
+
+
+def _created_at(path: str, stamp: Optional[float]) -> float:
+    """Creation time from the name, falling back to the modification time"""
+    if stamp is not None:
+        return stamp
+    try:
+        return os.lstat(path).st_mtime
+    except OSError:
+        return 0.0
+
+
+def lower_io_priority() -> None:
+    """
+    Run the calling thread in the idle I/O class at the lowest CPU priority.
+
+    Both are per-thread attributes on Linux, so the rest of the server keeps
+    its priority. Unsupported platforms and a missing ionice are ignored.
+    """
+    get_native_id = getattr(threading, 'get_native_id', None)
+    tid = get_native_id() if get_native_id else 0
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except (AttributeError, OSError) as e:
+        logging.debug(f"Could not lower CPU priority: {str(e)}")
+    if tid and shutil.which('ionice'):
+        subprocess.run(['ionice', '-c', '3', '-p', str(tid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class RetentionPolicy:
+    """
+    Decides which entries of a group are deleted.
+
+    Entries are considered newest first. The newest entry and protected ones
+    (the live release) always survive but count against the limits; every
+    other entry is deleted once more than `keep` entries are kept, when it
+    is older than `max_age`, or when it would take the group past
+    `max_bytes`. A limit of 0 disables it.
+    """
+
+    def __init__(self, keep: int = 0, max_age: float = 0, max_bytes: int = 0):
+        """
+        Args:
+            keep: Number of entries kept per group
+            max_age: Seconds after which entries expire
+            max_bytes: Size budget of a group in bytes
+        """
+        self.keep = keep
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+    def select(self, entries: Iterable[Tuple[str, float]], protected: Sequence[str] = (),
+               size_of: Callable[[str], int] = tree_size) -> List[str]:
+        """
+        Args:
+            entries: Path and creation time of each entry of a group
+            protected: Paths that must not be deleted
+            size_of: Size of an entry, only called when a size budget is set
+
+        Returns:
+            List[str]: Paths to delete, newest first
+        """
+        now = time.time()
+        kept, kept_bytes, over_budget = 0, 0, False
+        doomed = []
+        ordered = sorted(entries, key=lambda entry: entry[1], reverse=True)
+        for index, (path, created) in enumerate(ordered):
+            size = size_of(path) if self.max_bytes else 0
+            if index > 0 and path not in protected:
+                over_budget = over_budget or (bool(self.max_bytes) and kept_bytes + size > self.max_bytes)
+                if (self.keep and kept >= self.keep) or over_budget or \
+                        (self.max_age and now - created > self.max_age):
+                    doomed.append(path)
+                    continue
+            kept += 1
+            kept_bytes += size
+        return doomed
+
+
+class RetentionCollector:
+    """
+    Deletes releases, backups and job logs that fell out of the retention
+    policy, and blobs unused for longer than their maximum age.
+
+    A daemon thread runs a pass every `interval` seconds and whenever
+    trigger() is called, at idle I/O priority so deletions do not slow
+    down builds. Releases of a domain are only touched while its deployment
+    lock and its release lock, shared with other processes, are free.
+    """
+
+    def __init__(self, sites_dir: str, backup_dirs: Sequence[str], policy: RetentionPolicy,
+                 interval: float = 3600, site_state: Optional[SiteStateStore] = None,
+                 domain_lock: Optional[Callable[[str], threading.Lock]] = None,
+                 file_store: Optional[FileStore] = None, job_logs_dir: Optional[str] = None,
+                 blob_store: Optional[BlobStore] = None, blob_max_age: float = 0):
+        """
+        Args:
+            sites_dir: Directory holding the releases of each domain
+            backup_dirs: Directories scanned for backups
+            policy: What to keep
+            interval: Seconds between passes of the background thread
+            site_state: State store whose release records are pruned too
+            domain_lock: Returns the lock held while a domain is deployed
+            file_store: Store whose objects no release links to are removed
+            job_logs_dir: Directory of job logs, pruned per domain by the policy
+            blob_store: Store whose unused blobs are removed
+            blob_max_age: Seconds a blob survives without being used, 0 to keep blobs
+        """
+        self.releases = ReleaseStore(sites_dir)
+        self.backup_dirs = list(backup_dirs)
+        self.policy = policy
+        self.interval = interval
+        self.site_state = site_state
+        self.domain_lock = domain_lock
+        self.file_store = file_store
+        self.job_logs_dir = job_logs_dir
+        self.blob_store = blob_store
+        self.blob_max_age = blob_max_age
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def collect(self, dry_run: bool = False) -> List[str]:
+        """
+        Run one pass over all releases, backups, job logs and blobs.
+
+        Args:
+            dry_run: Only report what would be deleted
+
+        Returns:
+            List[str]: Paths deleted, or that would be deleted
+        """
+        removed = []
+        try:
+            domains = sorted(os.listdir(self.releases.sites_dir))
+        except FileNotFoundError:
+            domains = []
+        for domain in domains:
+            if os.path.isdir(self.releases.releases_dir(domain)):
+                removed.extend(self._collect_releases(domain, dry_run))
+        for directory in self.backup_dirs:
+            if os.path.isdir(directory):
+                removed.extend(self._collect_backups(directory, dry_run))
+        if self.job_logs_dir and os.path.isdir(self.job_logs_dir):
+            removed.extend(self._collect_job_logs(dry_run))
+        if self.blob_store is not None and self.blob_max_age:
+            removed.extend(self.blob_store.collect(self.blob_max_age, dry_run))
+        if removed and not dry_run:
+            logging.info(f"Retention removed {len(removed)} old releases, backups, job logs and blobs")
+        if self.file_store is not None and not dry_run:
+            # Deleted releases dropped their links; now objects can go
+            self.file_store.collect()
+        return removed
+
+    def _collect_releases(self, domain: str, dry_run: bool) -> List[str]:
+        lock = self.domain_lock(domain) if self.domain_lock else None
+        if lock is not None and not lock.acquire(blocking=False):
+            logging.debug(f"Skipping releases of {domain} while it is deployed")
+            return []
+        # Held by deployments and rollbacks of any process, e.g. the CLI
+        release_lock = self.releases.lock(domain, blocking=False)
+        if release_lock is None:
+            if lock is not None:
+                lock.release()
+            logging.debug(f"Skipping releases of {domain} while it is deployed")
+            return []
+        try:
+            current = self.releases.current_path(domain)
+            entries = [
+                (self.releases.path(domain, release_id),
+                 _created_at(self.releases.path(domain, release_id),
+                             _parse_stamp(release_id[:15], RELEASE_STAMP)))
+                for release_id in self.releases.list(domain)
+            ]
+            doomed = self.policy.select(entries, protected=[current] if current else [])
+            if dry_run or not doomed:
+                return doomed
+            for path in doomed:
+                self._hide(path)
+            if self.site_state is not None:
+                # Forget what rollbacks can no longer return to
+                gone = {os.path.basename(path) for path in doomed}
+                known = self.site_state.get(domain).get('releases', {})
+                self.site_state.update(domain, releases={
+                    release_id: info for release_id, info in known.items() if release_id not in gone
+                })
+        finally:
+            release_lock.close()
+            if lock is not None:
+                lock.release()
+        self._empty_trash(self.releases.releases_dir(domain))
+        return doomed
+
+    def _collect_backups(self, directory: str, dry_run: bool) -> List[str]:
+        groups: Dict[str, List[Tuple[str, float]]] = {}
+        for name in os.listdir(directory):
+            match = BACKUP_PATTERN.match(name)
+            if match is None or name.startswith(TRASH_PREFIX):
+                continue
+            path = os.path.join(directory, name)
+            created = _created_at(path, _parse_stamp(match.group('stamp'), BACKUP_STAMP))
+            groups.setdefault(match.group('group'), []).append((path, created))
+
+        doomed = []
+        for group in sorted(groups):
+            doomed.extend(self.policy.select(groups[group]))
+        if not dry_run:
+            for path in doomed:
+                self._hide(path)
+            self._empty_trash(directory)
+        return doomed
+
+    def _collect_job_logs(self, dry_run: bool) -> List[str]:
+        groups: Dict[str, List[Tuple[str, float]]] = {}
+        for name in os.listdir(self.job_logs_dir):
+            match = JOB_LOG_PATTERN.match(name)
+            if match is None:
+                continue
+            path = os.path.join(self.job_logs_dir, name)
+            # The log of a running job is the newest of its domain, which always survives
+            groups.setdefault(match.group('domain'), []).append((path, _created_at(path, None)))
+
+        doomed = []
+        for domain in sorted(groups):
+            doomed.extend(self.policy.select(groups[domain], size_of=os.path.getsize))
+        if not dry_run:
+            for path in doomed:
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    logging.warning(f"Could not remove {path}: {str(e)}")
+        return doomed
+
+    @staticmethod
+    def _hide(path: str) -> None:
+        directory, name = os.path.split(path)
+        try:
+            os.rename(path, os.path.join(directory, f'{TRASH_PREFIX}{name}'))
+        except OSError as e:
+            logging.warning(f"Could not remove {path}: {str(e)}")
+
+    @staticmethod
+    def _empty_trash(directory: str) -> None:
+        for name in os.listdir(directory):
+            if not name.startswith(TRASH_PREFIX):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+            except OSError as e:
+                logging.warning(f"Could not remove {path}: {str(e)}")
+
+    def trigger(self) -> None:
+        """Ask the background thread for a pass now, e.g. after a deployment"""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        """Start the background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='dynapsys-retention', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        lower_io_priority()
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                logging.error(f"Retention pass failed: {str(e)}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+
+def retention_policy() -> RetentionPolicy:
+    """Retention policy from the configuration"""
+    return RetentionPolicy(
+        keep=config.retention_keep,
+        max_age=config.retention_max_age_days * 86400,
+        max_bytes=config.retention_max_bytes
+    )
+
+
+_collector: Optional[RetentionCollector] = None
+_collector_lock = threading.Lock()
+
+
+def get_retention_collector() -> RetentionCollector:
+    """Collector shared by all deployment workers of this process"""
+    global _collector
+    with _collector_lock:
+        if _collector is None:
+            _collector = RetentionCollector(
+                config.sites_dir,
+                [path.strip() for path in config.retention_backup_dirs.split(',') if path.strip()],
+                retention_policy(),
+                interval=config.gc_interval,
+                site_state=SiteStateStore(config.state_dir),
+                file_store=FileStore(os.path.join(config.sites_dir, OBJECTS_DIR)) if config.dedupe else None,
+                job_logs_dir=config.job_logs_dir,
+                blob_store=BlobStore(config.blobs_dir),
+                blob_max_age=config.blob_max_age_days * 86400
+            )
+        return _collector
@@ -0,0 +1,220 @@
+"""Admission control for concurrent builds based on host resources"""
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import psutil
+
+from .config import config
+
+# Learned estimates leave room for builds growing past their last peak
+MEMORY_HEADROOM = 1.25
+
+
+class BuildSlot:
+    """An admitted build, tracking the resident memory of its process tree"""
+
+    def __init__(self, domain: str, estimate: int, sample_interval: float = 0.25):
+        """
+        Args:
+            domain: Domain being built
+            estimate: Memory in bytes the build was admitted with
+            sample_interval: Seconds between RSS samples
+        """
+        self.domain = domain
+        self.estimate = estimate
+        self.sample_interval = sample_interval
+        self.rss = 0
+        self.peak_rss = 0
+        self.waited = 0.0
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def outstanding(self) -> int:
+        """Memory the build is expected to take on top of what it uses now"""
+        return max(0, self.estimate - self.rss)
+
+    def track(self, process) -> None:
+        """
+        Sample the RSS of a process and its descendants until it exits.
+
+        Args:
+            process: subprocess.Popen or pid of the process to watch
+        """
+        pid = getattr(process, 'pid', process)
+        thread = threading.Thread(target=self._sample, args=(pid,),
+                                  name=f'dynapsys-rss-{pid}', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _sample(self, pid: int) -> None:
+        try:
+            root = psutil.Process(pid)
+        except psutil.Error:
+            return
+        while not self._stop.is_set():
+            try:
+                processes = [root] + root.children(recursive=True)
+            except psutil.Error:
+                break
+            rss = 0
+            for process in processes:
+                try:
+                    rss += process.memory_info().rss
+                except psutil.Error:
+                    continue
+            self.rss = rss
+            self.peak_rss = max(self.peak_rss, rss)
+            self._stop.wait(self.sample_interval)
+        self.rss = 0
+
+    def stop(self) -> None:
+        """Stop sampling"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+
+class BuildScheduler:
+    """
+    Admits builds only while the host has memory and CPU to spare.
+
+    Each build is admitted with an estimate of the memory it needs: the peak
+    RSS of recent builds of the same domain plus headroom, or a configured
+    default for domains never built. Builds that do not fit wait until
+    running builds finish or the host frees up. A build is always admitted
+    when nothing else is building, so oversized estimates cannot deadlock.
+    """
+
+    def __init__(self, history_path: str, default_estimate: int, reserve: int,
+                 max_load: float, poll_interval: float = 2.0, history_size: int = 5):
+        """
+        Args:
+            history_path: JSON file recording peak RSS of past builds per domain
+            default_estimate: Memory in bytes assumed for domains without history
+            reserve: Memory in bytes always left to the rest of the host
+            max_load: 1-minute load average per CPU above which builds wait
+            poll_interval: Seconds between re-checks while builds wait
+            history_size: Number of past peaks remembered per domain
+        """
+        self.history_path = history_path
+        self.default_estimate = default_estimate
+        self.reserve = reserve
+        self.max_load = max_load
+        self.poll_interval = poll_interval
+        self.history_size = history_size
+        self._running: List[BuildSlot] = []
+        self._cond = threading.Condition()
+        self._history: Optional[Dict[str, List[int]]] = None
+
+    def _load_history(self) -> Dict[str, List[int]]:
+        if self._history is None:
+            try:
+                with open(self.history_path, 'r') as f:
+                    self._history = json.load(f)
+            except FileNotFoundError:
+                self._history = {}
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable build memory history: {str(e)}")
+                self._history = {}
+        return self._history
+
+    def estimate(self, domain: str) -> int:
+        """Memory in bytes a build of a domain is expected to need"""
+        with self._cond:
+            peaks = self._load_history().get(domain)
+        if not peaks:
+            return self.default_estimate
+        return int(max(peaks) * MEMORY_HEADROOM)
+
+    def record(self, domain: str, peak_rss: int) -> None:
+        """Remember the peak RSS of a finished build"""
+        if peak_rss <= 0:
+            return
+        with self._cond:
+            history = self._load_history()
+            history[domain] = (history.get(domain, []) + [peak_rss])[-self.history_size:]
+            directory = os.path.dirname(self.history_path)
+            tmp_path = None
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix='.build-memory-', dir=directory)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(history, f, indent=2)
+                os.replace(tmp_path, self.history_path)
+            except OSError as e:
+                logging.warning(f"Could not save build memory history: {str(e)}")
+            finally:
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+    def _fits(self, estimate: int) -> Tuple[bool, str]:
+        """Whether a build of the given estimate can start now, and why not"""
+        if not self._running:
+            return True, ''
+        outstanding = sum(slot.outstanding for slot in self._running)
+        available = psutil.virtual_memory().available - outstanding - self.reserve
+        if available < estimate:
+            return False, f"{available // 2 ** 20} MiB available, {estimate // 2 ** 20} MiB needed"
+        load = os.getloadavg()[0] / (psutil.cpu_count() or 1)
+        if load > self.max_load:
+            return False, f"load {load:.2f} per CPU above {self.max_load:.2f}"
+        return True, ''
+
+    @contextmanager
+    def admit(self, domain: str) -> Iterator[BuildSlot]:
+        """
+        Wait until a build of a domain fits on the host, then run it.
+
+        Args:
+            domain: Domain being built
+
+        Yields:
+            BuildSlot: The admitted build; pass its process to track()
+        """
+        slot = BuildSlot(domain, self.estimate(domain))
+        started = time.time()
+        with self._cond:
+            fits, reason = self._fits(slot.estimate)
+            if not fits:
+                logging.info(f"Build of {domain} waiting for resources: {reason}")
+            while not fits:
+                self._cond.wait(self.poll_interval)
+                fits, reason = self._fits(slot.estimate)
+            self._running.append(slot)
+        slot.waited = round(time.time() - started, 3)
+        if slot.waited >= self.poll_interval:
+            logging.info(f"Build of {domain} admitted after {slot.waited:.1f}s")
+
+        try:
+            yield slot
+        finally:
+            slot.stop()
+            with self._cond:
+                self._running.remove(slot)
+                self._cond.notify_all()
+            self.record(domain, slot.peak_rss)
+
+
+_scheduler: Optional[BuildScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_build_scheduler() -> BuildScheduler:
+    """Scheduler shared by all deployment workers of this process"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BuildScheduler(
+                os.path.join(config.state_dir, 'build-memory.json'),
+                default_estimate=config.build_memory_estimate,
+                reserve=config.build_memory_reserve,
+                max_load=config.build_max_load
+            )
+        return _scheduler
@@ -0,0 +1,277 @@
+"""Resumable chunked upload sessions"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from .blobs import BlobStore, is_valid_digest
+from .uploads import DEFAULT_CHUNK_SIZE, UploadError
+
+DEFAULT_SESSION_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Bounds the per-session bookkeeping whatever size and chunk size a client asks for
+MAX_SESSION_CHUNKS = 10000
+
+# Missing chunk numbers reported per response; the count is always exact
+MAX_REPORTED_MISSING = 100
+
+
+class SessionClosedError(UploadError):
+    """Raised for chunks and commits arriving after a session was committed or expired"""
+
+
+class UploadSession:
+    """An upload assembled from independently retried chunks"""
+
+    def __init__(self, session_id: str, size: int, sha256: str, chunk_size: int,
+                 created_at: Optional[float] = None, received: Optional[List[int]] = None):
+        self.id = session_id
+        self.size = size
+        self.sha256 = sha256
+        self.chunk_size = chunk_size
+        self.created_at = created_at or time.time()
+        self.received = set(received or [])
+        # Guarded by the store's lock
+        self.committed = False
+        self.writers = 0
+
+    @property
+    def chunks(self) -> int:
+        """Total number of chunks"""
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index: int) -> int:
+        """Expected length of a chunk; the last one may be shorter"""
+        if index == self.chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    @property
+    def missing(self) -> List[int]:
+        """First chunks not received yet, at most MAX_REPORTED_MISSING of them"""
+        missing = []
+        for index in range(self.chunks):
+            if len(missing) == MAX_REPORTED_MISSING:
+                break
+            if index not in self.received:
+                missing.append(index)
+        return missing
+
+    @property
+    def missing_count(self) -> int:
+        """Number of chunks not received yet"""
+        return self.chunks - len(self.received)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the session state"""
+        return {
+            'upload_id': self.id,
+            'size': self.size,
+            'sha256': self.sha256,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunks,
+            'created_at': self.created_at,
+            'received': sorted(self.received),
+        }
+
+
+class UploadSessionStore:
+    """Spool files and state of upload sessions, kept on disk so they survive restarts"""
+
+    def __init__(self, root: str, ttl: int = 86400, max_bytes: int = 0):
+        """
+        Args:
+            root: Directory holding spool files and session state
+            ttl: Seconds after which unfinished sessions are discarded
+            max_bytes: Largest upload accepted, 0 for no limit
+        """
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions: Dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+
+    def _state_path(self, session_id: str) -> str:
+        return os.path.join(self.root, f'{session_id}.json')
+
+    def spool_path(self, session_id: str) -> str:
+        """Path of the file chunks are written into"""
+        return os.path.join(self.root, f'{session_id}.part')
+
+    def _save(self, session: UploadSession) -> None:
+        tmp_path = self._state_path(session.id) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(session.to_dict(), f)
+        os.replace(tmp_path, self._state_path(session.id))
+
+    def create(self, size: int, sha256: str, chunk_size: int = DEFAULT_SESSION_CHUNK_SIZE) -> UploadSession:
+        """
+        Start a new session with a preallocated spool file.
+
+        Args:
+            size: Total upload size in bytes
+            sha256: Digest of the complete upload
+            chunk_size: Size of every chunk but the last
+
+        Returns:
+            UploadSession: The new session
+        """
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("Upload size must be a positive integer")
+        if not is_valid_digest(sha256):
+            raise UploadError("Invalid SHA-256 digest")
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise UploadError("Chunk size must be a positive integer")
+        if self.max_bytes and size > self.max_bytes:
+            raise UploadError(f"Upload size exceeds the limit of {self.max_bytes} bytes")
+        if -(-size // chunk_size) > MAX_SESSION_CHUNKS:
+            raise UploadError(f"Uploads are limited to {MAX_SESSION_CHUNKS} chunks")
+
+        self.expire()
+        os.makedirs(self.root, exist_ok=True)
+        session = UploadSession(uuid.uuid4().hex, size, sha256, chunk_size)
+        with open(self.spool_path(session.id), 'wb') as f:
+            f.truncate(size)
+        with self._lock:
+            self._save(session)
+            self._sessions[session.id] = session
+        logging.info(f"Created upload session {session.id}: {size} bytes in {session.chunks} chunks")
+        return session
+
+    def get(self, session_id: str) -> Optional[UploadSession]:
+        """Look up a session, loading it from disk if needed"""
+        if not session_id.isalnum():
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None and os.path.exists(self._state_path(session_id)):
+                try:
+                    with open(self._state_path(session_id), 'r') as f:
+                        state = json.load(f)
+                    session = UploadSession(
+                        state['upload_id'], state['size'], state['sha256'],
+                        state['chunk_size'], state['created_at'], state['received']
+                    )
+                    self._sessions[session_id] = session
+                except (OSError, ValueError, KeyError) as e:
+                    logging.error(f"Corrupt upload session {session_id}: {str(e)}")
+            return session
+
+    def write_chunk(self, session: UploadSession, index: int, source: BinaryIO,
+                    length: int, read_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        """
+        Write one chunk at its offset in the spool file.
+
+        Chunks may arrive in any order, concurrently, and be retried.
+
+        Args:
+            session: Target session
+            index: Chunk number, starting at 0
+            source: Request body
+            length: Content-Length of the body
+            read_size: Bytes read from the body per pwrite
+
+        Raises:
+            UploadError: If the chunk does not fit the session
+            SessionClosedError: If the session was committed or expired meanwhile
+        """
+        if index < 0 or index >= session.chunks:
+            raise UploadError(f"Chunk {index} out of range")
+        if length != session.chunk_length(index):
+            raise UploadError(f"Chunk {index} must be {session.chunk_length(index)} bytes")
+
+        with self._lock:
+            if session.committed:
+                raise SessionClosedError(f"Upload session {session.id} is already committed")
+            # commit() waits for chunks being written
+            session.writers += 1
+        written = False
+        try:
+            self._write_at(session, index, source, length, read_size)
+            written = True
+        finally:
+            with self._lock:
+                session.writers -= 1
+                if written:
+                    session.received.add(index)
+                    self._save(session)
+
+    def _write_at(self, session: UploadSession, index: int, source: BinaryIO,
+                  length: int, read_size: int) -> None:
+        offset = index * session.chunk_size
+        try:
+            fd = os.open(self.spool_path(session.id), os.O_WRONLY)
+        except FileNotFoundError:
+            raise SessionClosedError(f"Upload session {session.id} has expired")
+        try:
+            remaining = length
+            while remaining > 0:
+                data = source.read(min(read_size, remaining))
+                if not data:
+                    raise UploadError(f"Chunk {index} truncated")
+                written = 0
+                while written < len(data):
+                    written += os.pwrite(fd, data[written:], offset + written)
+                offset += len(data)
+                remaining -= len(data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def commit(self, session: UploadSession, blob_store: BlobStore) -> str:
+        """
+        Verify the assembled upload and move it into the blob store.
+
+        Returns:
+            str: Digest of the stored blob
+
+        Raises:
+            UploadError: If chunks are missing or the digest does not match
+            SessionClosedError: If the session was committed already
+        """
+        with self._lock:
+            if session.committed:
+                raise SessionClosedError(f"Upload session {session.id} is already committed")
+            if session.missing:
+                raise UploadError(f"Missing chunks: {session.missing[:20]}")
+            if session.writers:
+                raise UploadError("Chunks are still being written")
+            # From here on chunks and other commits are refused
+            session.committed = True
+        try:
+            digest = blob_store.add_file(self.spool_path(session.id), session.sha256)
+        except UploadError:
+            # A corrupt upload cannot be repaired chunk by chunk; start over
+            self.discard(session.id)
+            raise
+        self.discard(session.id)
+        return digest
+
+    def discard(self, session_id: str) -> None:
+        """Remove a session and its spool file"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        for path in (self._state_path(session_id), self.spool_path(session_id)):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def expire(self) -> None:
+        """Discard sessions older than the TTL"""
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    logging.info(f"Expiring upload session file {name}")
+                    os.unlink(path)
+            except OSError:
+                continue
+        with self._lock:
+            for session_id in list(self._sessions):
+                if not os.path.exists(self._state_path(session_id)):
+                    self._sessions.pop(session_id, None)
@@ -0,0 +1,66 @@
+"""Persistent per-domain deployment state"""
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+
+class SiteStateStore:
+    """Records what is live on each domain, one JSON file per domain"""
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: Directory holding the state files
+        """
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, domain: str) -> str:
+        return os.path.join(self.root, f'{domain}.json')
+
+    def get(self, domain: str) -> Dict[str, Any]:
+        """State of a domain, empty if it was never deployed"""
+        try:
+            with open(self._path(domain), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable state of {domain}: {str(e)}")
+            return {}
+
+    def update(self, domain: str, **fields: Any) -> Dict[str, Any]:
+        """
+        Merge fields into the state of a domain.
+
+        The file is replaced atomically so readers never see partial state.
+
+        Returns:
+            Dict[str, Any]: The new state
+        """
+        with self._lock:
+            state = self.get(domain)
+            state.update(fields)
+            state['updated_at'] = time.time()
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=f'.{domain}-', dir=self.root)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f, indent=2)
+                os.replace(tmp_path, self._path(domain))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            return state
+
+    def live_commit(self, domain: str) -> Optional[str]:
+        """Commit serving the domain, None if unknown or being replaced"""
+        return self.get(domain).get('commit')
+
+    def is_live(self, domain: str, commit: Optional[str]) -> bool:
+        """Whether a commit is what the domain currently serves"""
+        return bool(commit) and self.live_commit(domain) == commit
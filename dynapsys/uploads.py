@@ -0,0 +1,380 @@
+"""Streaming upload handling for DynaPsys"""
+import os
+import logging
+import lzma
+import tarfile
+import tempfile
+import zlib
+from typing import BinaryIO
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+# Content types accepted for raw archive uploads; the format itself is
+# detected from the magic bytes
+ARCHIVE_CONTENT_TYPES = (
+    'application/gzip',
+    'application/x-gzip',
+    'application/x-tar+gzip',
+    'application/x-xz',
+    'application/zstd',
+    'application/x-tar',
+    'application/octet-stream',
+)
+
+COMPRESSION_MAGIC = (
+    ('gzip', b'\x1f\x8b'),
+    ('xz', b'\xfd7zXZ\x00'),
+    ('zstd', b'\x28\xb5\x2f\xfd'),
+)
+
+# Enough to see the ustar signature of an uncompressed tar header
+HEAD_SIZE = 512
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+# Members are validated by _check_member; newer Pythons can enforce the
+# same rules again with the 'data' extraction filter
+EXTRACT_OPTIONS = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
+
+class UploadError(Exception):
+    """Raised when an upload body cannot be received or unpacked"""
+
+
+def copy_stream(
+    source: BinaryIO,
+    target: BinaryIO,
+    length: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> int:
+    """
+    Copy exactly `length` bytes between file objects in fixed-size chunks.
+
+    Args:
+        source: Readable file object, e.g. the request body
+        target: Writable file object
+        length: Number of bytes to copy
+        chunk_size: Maximum bytes held in memory at once
+
+    Returns:
+        int: Number of bytes copied
+
+    Raises:
+        UploadError: If the source ends before `length` bytes were read
+    """
+    remaining = length
+    while remaining > 0:
+        chunk = source.read(min(chunk_size, remaining))
+        if not chunk:
+            raise UploadError(f"Upload truncated: {length - remaining} of {length} bytes received")
+        target.write(chunk)
+        remaining -= len(chunk)
+    return length
+
+
+def receive_upload(
+    source: BinaryIO,
+    length: int,
+    uploads_dir: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    suffix: str = '.tar.gz'
+) -> str:
+    """
+    Stream an upload body to a spool file.
+
+    Args:
+        source: Request body
+        length: Content-Length of the body
+        uploads_dir: Directory holding spooled uploads
+        chunk_size: Read size used while streaming
+        suffix: Spool file suffix
+
+    Returns:
+        str: Path of the spooled file
+    """
+    os.makedirs(uploads_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='upload-', suffix=suffix, dir=uploads_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            copy_stream(source, f, length, chunk_size)
+    except Exception:
+        os.unlink(path)
+        raise
+    logging.info(f"Received upload of {length} bytes: {path}")
+    return path
+
+
+class LimitedReader:
+    """File-like view of exactly `length` bytes of a request body"""
+
+    def __init__(self, source: BinaryIO, length: int):
+        self.source = source
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.source.read(size)
+        if not data:
+            raise UploadError(f"Upload truncated: {self.remaining} bytes missing")
+        self.remaining -= len(data)
+        return data
+
+    def drain(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        """Consume whatever the extractor left unread, e.g. tar padding"""
+        while self.remaining > 0:
+            self.read(chunk_size)
+
+
+class PrefixedReader:
+    """File-like object returning some already read bytes before the rest of a stream"""
+
+    def __init__(self, source, head: bytes = b''):
+        self.source = source
+        self._pending = head
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._pending:
+            return self.source.read(size)
+        if size is None or size < 0 or size >= len(self._pending):
+            data, self._pending = self._pending, b''
+        else:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+class DecompressingReader:
+    """File-like object decompressing another stream on the fly"""
+
+    def __init__(self, source, compression: str, head: bytes = b'',
+                 chunk_size: int = DECOMPRESS_CHUNK_SIZE, max_bytes: int = 0):
+        """
+        Args:
+            source: Compressed stream
+            compression: Format returned by detect_compression()
+            head: Bytes already read from `source` (used for format detection)
+            chunk_size: Compressed bytes read, and decompressed bytes produced, per step
+            max_bytes: Limit on the decompressed size, 0 for none
+
+        Raises:
+            UploadError: If the format needs a missing package
+        """
+        self.source = PrefixedReader(source, head)
+        self.compression = compression
+        # Small steps bound the memory a highly compressed chunk can expand to
+        self.chunk_size = min(chunk_size, DECOMPRESS_CHUNK_SIZE)
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.decompressor = _decompressor(compression)
+        if compression == 'zstd':
+            self.decompressor = self.decompressor.stream_reader(self.source, read_size=self.chunk_size)
+        self._buffer = b''
+        self._offset = 0
+        self._eof = False
+
+    def _step(self) -> bytes:
+        """Decompress at most chunk_size bytes; empty at the end of the stream"""
+        decompressor = self.decompressor
+        if decompressor is None:
+            return self.source.read(self.chunk_size)
+        if self.compression == 'zstd':
+            return decompressor.read(self.chunk_size)
+        if self.compression == 'gzip':
+            while not decompressor.eof:
+                # Input held back by max_length goes first
+                data = decompressor.unconsumed_tail or self.source.read(self.chunk_size)
+                if not data:
+                    return decompressor.flush()
+                output = decompressor.decompress(data, self.chunk_size)
+                if output:
+                    return output
+            return b''
+        while not decompressor.eof:
+            # Without needs_input the decompressor still holds output
+            data = self.source.read(self.chunk_size) if decompressor.needs_input else b''
+            if decompressor.needs_input and not data:
+                return b''
+            output = decompressor.decompress(data, self.chunk_size)
+            if output:
+                return output
+        return b''
+
+    def _fill(self) -> None:
+        """
+        Decompress the next chunk into the buffer
+
+        Raises:
+            UploadError: If the stream expands beyond max_bytes
+        """
+        output = self._step()
+        if not output:
+            self._eof = True
+            return
+        self.total += len(output)
+        if self.max_bytes and self.total > self.max_bytes:
+            raise UploadError(f"Archive expands beyond {self.max_bytes} bytes")
+        self._buffer = self._buffer[self._offset:] + output
+        self._offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size is None or size < 0
+                                 or len(self._buffer) - self._offset < size):
+            self._fill()
+        if size is None or size < 0:
+            end = len(self._buffer)
+        else:
+            end = min(len(self._buffer), self._offset + size)
+        data = self._buffer[self._offset:end]
+        self._offset = end
+        return data
+
+
+def detect_compression(head: bytes) -> str:
+    """
+    Detect the compression of an archive from its magic bytes.
+
+    Args:
+        head: First bytes of the archive
+
+    Returns:
+        str: One of 'gzip', 'xz', 'zstd' or 'tar'
+
+    Raises:
+        UploadError: If the data is not a supported archive
+    """
+    for name, magic in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return name
+    if head[257:262] == b'ustar':
+        return 'tar'
+    raise UploadError("Unsupported archive format")
+
+
+def _decompressor(compression: str):
+    """Create a streaming decompressor for a detected format"""
+    if compression == 'gzip':
+        # 16 + MAX_WBITS expects a gzip header
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == 'xz':
+        return lzma.LZMADecompressor()
+    if compression == 'zstd':
+        if zstandard is None:
+            raise UploadError("zstd archives require the 'zstandard' package")
+        return zstandard.ZstdDecompressor()
+    return None
+
+
+def _within(target_dir: str, path: str) -> bool:
+    """Whether path resolves inside target_dir"""
+    root = os.path.realpath(target_dir)
+    resolved = os.path.realpath(os.path.join(root, path))
+    return resolved == root or resolved.startswith(root + os.sep)
+
+
+def _check_member(member: tarfile.TarInfo, target_dir: str) -> bool:
+    """
+    Validate an archive member before extraction.
+
+    Returns:
+        bool: False if the member should be skipped
+
+    Raises:
+        UploadError: If the member would escape the target directory
+    """
+    name = member.name.replace('\\', '/')
+    if name.startswith('/') or '..' in name.split('/') or not _within(target_dir, name):
+        raise UploadError(f"Unsafe path in archive: {member.name}")
+    if member.issym():
+        link_target = os.path.join(os.path.dirname(name), member.linkname)
+        if member.linkname.startswith('/') or not _within(target_dir, link_target):
+            raise UploadError(f"Unsafe symlink in archive: {member.name} -> {member.linkname}")
+    elif member.islnk():
+        if member.linkname.startswith('/') or not _within(target_dir, member.linkname):
+            raise UploadError(f"Unsafe hardlink in archive: {member.name} -> {member.linkname}")
+    elif not (member.isfile() or member.isdir()):
+        logging.warning(f"Skipping special file in archive: {member.name}")
+        return False
+    return True
+
+
+def hoist_single_directory(target_dir: str) -> None:
+    """
+    Move the contents of a lone top-level directory up into target_dir.
+
+    Archives made with `tar -C parent project` wrap everything in one
+    directory; the site root must contain package.json directly.
+    """
+    entries = os.listdir(target_dir)
+    if len(entries) != 1:
+        return
+    inner = os.path.join(target_dir, entries[0])
+    if not os.path.isdir(inner) or os.path.islink(inner):
+        return
+    staging = tempfile.mkdtemp(prefix='.hoist-', dir=target_dir)
+    os.rename(inner, os.path.join(staging, 'root'))
+    for name in os.listdir(os.path.join(staging, 'root')):
+        os.rename(os.path.join(staging, 'root', name), os.path.join(target_dir, name))
+    os.rmdir(os.path.join(staging, 'root'))
+    os.rmdir(staging)
+
+
+def extract_stream(source, target_dir: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   max_bytes: int = 0) -> str:
+    """
+    Decompress and unpack a tar stream in a single pass.
+
+    The compression (gzip, xz, zstd or none) is detected from the magic
+    bytes, so the data never has to be written to disk first.
+
+    Args:
+        source: Readable stream, e.g. a LimitedReader over the request body
+        target_dir: Directory to extract into
+        chunk_size: Compressed bytes read per step
+        max_bytes: Limit on the unpacked tar stream in bytes, 0 for none
+
+    Returns:
+        str: Detected compression
+
+    Raises:
+        UploadError: If the archive is invalid, unsafe or too large
+    """
+    head = source.read(HEAD_SIZE)
+    compression = detect_compression(head)
+    reader = DecompressingReader(source, compression, head, chunk_size, max_bytes)
+
+    os.makedirs(target_dir, exist_ok=True)
+    try:
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            for member in tar:
+                if _check_member(member, target_dir):
+                    tar.extract(member, target_dir, **EXTRACT_OPTIONS)
+    except (tarfile.TarError, zlib.error, lzma.LZMAError, EOFError) as e:
+        raise UploadError(f"Invalid {compression} archive: {str(e)}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise UploadError(f"Invalid zstd archive: {str(e)}")
+        raise
+    hoist_single_directory(target_dir)
+    return compression
+
+
+def extract_archive(archive_path: str, target_dir: str, max_bytes: int = 0) -> str:
+    """
+    Extract a (possibly compressed) tarball file into a directory.
+
+    Args:
+        archive_path: Path to the archive
+        target_dir: Directory to extract into
+        max_bytes: Limit on the unpacked tar stream in bytes, 0 for none
+
+    Returns:
+        str: Detected compression
+    """
+    with open(archive_path, 'rb') as f:
+        return extract_stream(f, target_dir, max_bytes=max_bytes)
@@ -3,8 +3,11 @@ import os
 import sys
 import logging
 import subprocess
-from typing import Tuple, Optional, List, Dict, Any
+import selectors
+import re
+from typing import Callable, Iterator, Tuple, Optional, List, Dict, Any
 import json
+from collections import deque
 from pathlib import Path
 
 def ensure_directory(path: str) -> bool:
@@ -63,6 +66,95 @@ def run_command(
         logging.error(f"Error running command {' '.join(command)}: {str(e)}")
         return -1, '', str(e)
 
+def iter_output(process: subprocess.Popen, chunk_size: int = 65536) -> Iterator[Tuple[str, str, bool]]:
+    """
+    Read stdout and stderr of a process concurrently, line by line.
+
+    Both pipes are polled with a selector, so a process filling one of them
+    while the other is idle cannot block. Progress meters redraw a line by
+    ending it with a carriage return; such updates are flagged as transient.
+
+    Args:
+        process: Process started with stdout and stderr pipes in binary mode
+        chunk_size: Bytes read per system call
+
+    Yields:
+        Tuple[str, str, bool]: Stream name, line without terminator, transient flag
+    """
+    buffers = {}
+    with selectors.DefaultSelector() as selector:
+        for name, pipe in (('stdout', process.stdout), ('stderr', process.stderr)):
+            if pipe is not None:
+                selector.register(pipe, selectors.EVENT_READ, name)
+                buffers[name] = b''
+        while selector.get_map():
+            for key, _ in selector.select():
+                name = key.data
+                data = os.read(key.fd, chunk_size)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    if buffers[name]:
+                        yield name, buffers[name].decode('utf-8', 'replace'), False
+                    continue
+                parts = re.split(b'(\r\n|\r|\n)', buffers[name] + data)
+                buffers[name] = parts.pop()
+                for line, terminator in zip(parts[::2], parts[1::2]):
+                    if line or terminator != b'\r':
+                        yield name, line.decode('utf-8', 'replace'), terminator == b'\r'
+
+def stream_command(
+    command: List[str],
+    cwd: Optional[str] = None,
+    env: Optional[Dict[str, str]] = None,
+    prefix: str = '',
+    tail_lines: int = 50,
+    on_line: Optional[Callable[[str], None]] = None,
+    on_start: Optional[Callable[[subprocess.Popen], None]] = None
+) -> Tuple[int, List[str]]:
+    """
+    Run a command logging its output line by line as it is produced.
+
+    stdout and stderr are read concurrently; nothing but the last few lines
+    is held in memory. Transient progress updates are passed to on_line but
+    not logged.
+
+    Args:
+        command: Command to run as list of strings
+        cwd: Working directory for command
+        env: Environment variables for command
+        prefix: Text prepended to every logged line
+        tail_lines: Number of trailing lines returned for error reports
+        on_line: Called with every line, including progress updates
+        on_start: Called with the process once it is started
+
+    Returns:
+        Tuple[int, List[str]]: Return code and the last output lines
+    """
+    tail: deque = deque(maxlen=tail_lines)
+    try:
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=env
+        )
+        if on_start is not None:
+            on_start(process)
+        for _, line, transient in iter_output(process):
+            if on_line is not None:
+                on_line(line)
+            line = line.rstrip()
+            if line and not transient:
+                tail.append(line)
+                logging.info(f"{prefix}{line}")
+        return process.wait(), list(tail)
+
+    except Exception as e:
+        logging.error(f"Error running command {' '.join(command)}: {str(e)}")
+        return -1, list(tail) + [str(e)]
+
 def load_json_file(path: str) -> Optional[Dict[str, Any]]:
     """
     Load and parse a JSON file.
@@ -177,8 +269,10 @@ def is_valid_domain(domain: str) -> bool:
         bool: True if valid, False otherwise
     """
     import re
-    pattern = r'^(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$'
-    return bool(re.match(pattern, domain))
+    if not isinstance(domain, str):
+        return False
+    pattern = r'(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}'
+    return bool(re.fullmatch(pattern, domain))
 
 def setup_logging(
     level: str = 'INFO',
@@ -34,6 +34,12 @@ setup(
         "typing-extensions>=4.7.0; python_version < '3.8'",
     ],
     extras_require={
+        'zstd': [
+            'zstandard>=0.21.0',
+        ],
+        'brotli': [
+            'brotli>=1.0.9',
+        ],
         'dev': [
             'pytest>=7.0.0',
             'pytest-cov>=4.0.0',
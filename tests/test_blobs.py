@@ -0,0 +1,67 @@
+import unittest
+import io
+import os
+import hashlib
+import tempfile
+import shutil
+from dynapsys.blobs import BlobStore, is_valid_digest
+from dynapsys.uploads import UploadError
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = BlobStore(self.temp_dir)
+        self.data = b'archive content'
+        self.digest = hashlib.sha256(self.data).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_is_valid_digest(self):
+        """Test digest validation"""
+        self.assertTrue(is_valid_digest(self.digest))
+        self.assertFalse(is_valid_digest(self.digest.upper()))
+        self.assertFalse(is_valid_digest('../etc/passwd'))
+        self.assertFalse(is_valid_digest(''))
+
+    def test_put_and_lookup(self):
+        """Test blobs are stored under their content hash"""
+        self.assertFalse(self.store.exists(self.digest))
+        digest = self.store.put_stream(io.BytesIO(self.data), len(self.data), chunk_size=4)
+        self.assertEqual(digest, self.digest)
+        self.assertTrue(self.store.exists(self.digest))
+        self.assertEqual(self.store.size(self.digest), len(self.data))
+        self.assertTrue(self.store.path(self.digest).startswith(
+            os.path.join(self.temp_dir, self.digest[:2])
+        ))
+
+    def test_digest_mismatch(self):
+        """Test content not matching the announced digest is discarded"""
+        with self.assertRaises(UploadError):
+            self.store.put_stream(io.BytesIO(self.data), len(self.data), expected_digest='0' * 64)
+        self.assertFalse(self.store.exists(self.digest))
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, 'tmp')), [])
+
+    def test_missing_blob(self):
+        """Test lookups of unknown blobs"""
+        self.assertIsNone(self.store.size(self.digest))
+        self.assertFalse(self.store.exists('not-a-digest'))
+
+    def test_collect_unused_blobs(self):
+        """Test blobs nobody looked up for a while are removed"""
+        digest = self.store.put_stream(io.BytesIO(self.data), len(self.data))
+        other = self.store.put_stream(io.BytesIO(b'other'), 5)
+        for path in (self.store.path(digest), self.store.path(other)):
+            os.utime(path, (1000, 1000))
+        # A lookup counts as a use
+        self.assertTrue(self.store.exists(other))
+
+        self.assertEqual(self.store.collect(3600, dry_run=True), [self.store.path(digest)])
+        self.assertTrue(self.store.exists(digest))
+        os.utime(self.store.path(digest), (1000, 1000))
+        self.assertEqual(self.store.collect(3600), [self.store.path(digest)])
+        self.assertFalse(self.store.exists(digest))
+        self.assertTrue(self.store.exists(other))
+
+if __name__ == '__main__':
+    unittest.main()
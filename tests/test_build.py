@@ -0,0 +1,423 @@
+import unittest
+from unittest.mock import patch
+import os
+import json
+import shutil
+import tempfile
+from dynapsys.build import (
+    DEPS_MARKER, BuildCache, DependencyCache, NpmCacheStats, detect_activation, detect_package_manager,
+    install_command, install_dependencies, link_tree, npm_install_command, read_deps_marker
+)
+from dynapsys.config import config
+
+class TestDependencyCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = DependencyCache(os.path.join(self.temp_dir, 'cache'))
+        self.node_patch = patch('dynapsys.build.node_version', return_value='v20.0.0')
+        self.node_patch.start()
+
+    def tearDown(self):
+        self.node_patch.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def make_project(self, name, lockfile='{"lockfileVersion": 3}'):
+        project = os.path.join(self.temp_dir, name)
+        os.makedirs(project)
+        with open(os.path.join(project, 'package.json'), 'w') as f:
+            json.dump({'name': name}, f)
+        if lockfile is not None:
+            with open(os.path.join(project, 'package-lock.json'), 'w') as f:
+                f.write(lockfile)
+        return project
+
+    def fake_install(self):
+        """Return a stream_command stand-in that creates node_modules"""
+        def install(command, cwd=None, **kwargs):
+            package = os.path.join(cwd, 'node_modules', 'left-pad')
+            os.makedirs(os.path.join(package, '.bin'))
+            os.makedirs(os.path.join(cwd, 'node_modules', '.cache', 'babel'))
+            with open(os.path.join(package, 'index.js'), 'w') as f:
+                f.write('module.exports = 1')
+            os.symlink('../index.js', os.path.join(package, '.bin', 'left-pad'))
+            return 0, []
+        return install
+
+    def test_key_depends_on_lockfile_and_node(self):
+        """Test cache keys follow the lockfile and Node.js version"""
+        first = self.make_project('first')
+        same = self.make_project('same')
+        other = self.make_project('other', lockfile='{"lockfileVersion": 2}')
+
+        self.assertEqual(self.cache.key(first), self.cache.key(same))
+        self.assertNotEqual(self.cache.key(first), self.cache.key(other))
+        self.assertIsNone(self.cache.key(self.make_project('none', lockfile=None)))
+        key = self.cache.key(first)
+        with patch('dynapsys.build.node_version', return_value='v22.0.0'):
+            self.assertNotEqual(self.cache.key(first), key)
+        with open(os.path.join(first, 'package.json'), 'w') as f:
+            json.dump({'name': 'first', 'packageManager': 'npm@10.5.0'}, f)
+        self.assertNotEqual(self.cache.key(first), key)
+
+    def test_link_tree_shares_files(self):
+        """Test trees are recreated with hardlinks and symlinks kept"""
+        source = self.make_project('source')
+        with patch('dynapsys.build.stream_command', side_effect=self.fake_install()):
+            install_dependencies(source)
+        target = os.path.join(self.temp_dir, 'target')
+
+        with patch('dynapsys.build._reflink_tree', return_value=False):
+            method = link_tree(os.path.join(source, 'node_modules'), target, ('.cache',))
+
+        self.assertEqual(method, 'hardlink')
+        index = os.path.join(target, 'left-pad', 'index.js')
+        self.assertTrue(os.path.samefile(index, os.path.join(source, 'node_modules', 'left-pad', 'index.js')))
+        self.assertEqual(os.readlink(os.path.join(target, 'left-pad', '.bin', 'left-pad')), '../index.js')
+        self.assertFalse(os.path.exists(os.path.join(target, '.cache')))
+
+    @patch('dynapsys.build.stream_command')
+    def test_miss_then_hit(self, mock_stream):
+        """Test a first install populates the cache and a second one reuses it"""
+        mock_stream.side_effect = self.fake_install()
+        first = self.make_project('first')
+        stats = {}
+        self.assertTrue(install_dependencies(first, self.cache, stats))
+        self.assertEqual(stats['dependency_cache'], 'miss')
+        key = self.cache.key(first)
+        self.assertTrue(os.path.isdir(os.path.join(self.cache.path(key), 'node_modules', 'left-pad')))
+        self.assertFalse(os.path.exists(os.path.join(self.cache.path(key), 'node_modules', '.cache')))
+        self.assertEqual([name for name in os.listdir(self.cache.root) if name.startswith('.tmp')], [])
+
+        second = self.make_project('second')
+        stats = {}
+        self.assertTrue(install_dependencies(second, self.cache, stats))
+        self.assertEqual(stats['dependency_cache'], 'hit')
+        self.assertEqual(mock_stream.call_count, 1)
+        self.assertEqual(read_deps_marker(second), key)
+        with open(os.path.join(second, 'node_modules', 'left-pad', 'index.js')) as f:
+            self.assertEqual(f.read(), 'module.exports = 1')
+
+    @patch('dynapsys.build.stream_command')
+    def test_current_node_modules_is_kept(self, mock_stream):
+        """Test installs are skipped when node_modules matches the lockfile"""
+        mock_stream.side_effect = self.fake_install()
+        project = self.make_project('project')
+        install_dependencies(project, self.cache)
+        stats = {}
+        self.assertTrue(install_dependencies(project, self.cache, stats))
+        self.assertEqual(stats['dependency_cache'], 'current')
+        self.assertEqual(mock_stream.call_count, 1)
+
+    @patch('dynapsys.build.stream_command')
+    def test_changed_lockfile_reinstalls(self, mock_stream):
+        """Test stale node_modules is replaced rather than installed over"""
+        mock_stream.side_effect = self.fake_install()
+        project = self.make_project('project')
+        install_dependencies(project, self.cache)
+        old_key = self.cache.key(project)
+        with open(os.path.join(project, 'package-lock.json'), 'w') as f:
+            f.write('{"lockfileVersion": 2}')
+
+        stats = {}
+        self.assertTrue(install_dependencies(project, self.cache, stats))
+        self.assertEqual(stats['dependency_cache'], 'miss')
+        self.assertEqual(mock_stream.call_count, 2)
+        self.assertEqual(len([name for name in os.listdir(self.cache.root) if not name.startswith('.')]), 2)
+        with open(os.path.join(self.cache.path(old_key), 'node_modules', DEPS_MARKER)) as f:
+            self.assertEqual(f.read(), old_key)
+
+    @patch('dynapsys.build.stream_command')
+    def test_evicts_least_recently_used(self, mock_stream):
+        """Test dependency trees over the size budget are evicted oldest first"""
+        mock_stream.side_effect = self.fake_install()
+        projects = []
+        for index in range(3):
+            projects.append(self.make_project(f'project{index}', lockfile=f'{{"lockfileVersion": {index}}}'))
+            install_dependencies(projects[-1], self.cache)
+            entry = self.cache.path(self.cache.key(projects[-1]))
+            os.utime(entry, (1000 + index, 1000 + index))
+            if index == 0:
+                with open(os.path.join(entry, 'meta.json')) as f:
+                    # Room for two entries
+                    self.cache.max_bytes = 2 * json.load(f)['size'] + 1
+
+        self.assertFalse(os.path.exists(self.cache.path(self.cache.key(projects[0]))))
+        self.assertTrue(os.path.isdir(self.cache.path(self.cache.key(projects[1]))))
+        self.assertTrue(os.path.isdir(self.cache.path(self.cache.key(projects[2]))))
+        # Projects restored from an evicted entry keep their own links
+        with open(os.path.join(projects[0], 'node_modules', 'left-pad', 'index.js')) as f:
+            self.assertEqual(f.read(), 'module.exports = 1')
+
+    @patch('dynapsys.build.stream_command', return_value=(1, ['npm ERR! failed']))
+    def test_failed_install_is_not_cached(self, mock_stream):
+        """Test failed installs leave the cache untouched"""
+        project = self.make_project('project')
+        stats = {}
+        self.assertFalse(install_dependencies(project, self.cache, stats))
+        self.assertFalse(os.path.exists(self.cache.root))
+
+    @patch('dynapsys.build.stream_command')
+    def test_without_lockfile_always_installs(self, mock_stream):
+        """Test projects without a lockfile bypass the cache"""
+        mock_stream.side_effect = self.fake_install()
+        project = self.make_project('project', lockfile=None)
+        stats = {}
+        self.assertTrue(install_dependencies(project, self.cache, stats))
+        self.assertEqual(stats['dependency_cache'], 'disabled')
+        self.assertFalse(os.path.exists(self.cache.root))
+
+class TestNpmInstall(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.config_patch = patch.dict(config._config, {
+            'NPM_CACHE_DIR': os.path.join(self.temp_dir, 'npm-cache'),
+            'NPM_PREFER_OFFLINE': True
+        })
+        self.config_patch.start()
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def test_install_command(self):
+        """Test npm ci is used with a lockfile and the shared cache always"""
+        command = npm_install_command(self.temp_dir)
+        self.assertEqual(command[:2], ['npm', 'install'])
+        self.assertIn('--prefer-offline', command)
+        self.assertEqual(command[command.index('--cache') + 1], config.npm_cache_dir)
+
+        with open(os.path.join(self.temp_dir, 'package-lock.json'), 'w') as f:
+            f.write('{}')
+        self.assertEqual(npm_install_command(self.temp_dir)[:2], ['npm', 'ci'])
+
+        with patch.dict(config._config, {'NPM_PREFER_OFFLINE': False}):
+            self.assertNotIn('--prefer-offline', npm_install_command(self.temp_dir))
+
+    def test_cache_stats(self):
+        """Test registry requests are classified from npm http logs"""
+        stats = NpmCacheStats()
+        for line in [
+            'npm http fetch GET 200 https://registry.npmjs.org/react 12ms (cache hit)',
+            'npm http fetch GET 200 https://registry.npmjs.org/react-dom 8ms (cache hit)',
+            'npm http fetch GET 304 https://registry.npmjs.org/scheduler 95ms (cache revalidated)',
+            'npm http fetch GET 200 https://registry.npmjs.org/left-pad 340ms (cache miss)',
+            'npm http fetch GET 200 https://registry.npmjs.org/is-odd 210ms',
+            'npm WARN deprecated left-pad@1.3.0',
+            'added 5 packages in 2s',
+        ]:
+            stats.feed(line)
+
+        self.assertEqual(stats.to_dict(), {
+            'hit': 2, 'revalidated': 1, 'miss': 2, 'requests': 5, 'hit_ratio': 0.6
+        })
+        self.assertIsNone(NpmCacheStats().to_dict()['hit_ratio'])
+
+    def write(self, name, content):
+        with open(os.path.join(self.temp_dir, name), 'w') as f:
+            f.write(content)
+
+    def test_detect_package_manager(self):
+        """Test the packageManager field wins over lockfiles, npm is the default"""
+        self.assertEqual(detect_package_manager(self.temp_dir), ('npm', None))
+        self.write('package.json', '{"name": "app"}')
+        self.write('yarn.lock', '')
+        self.assertEqual(detect_package_manager(self.temp_dir), ('yarn', None))
+
+        self.write('package.json', '{"packageManager": "pnpm@9.1.0+sha512.abc"}')
+        self.assertEqual(detect_package_manager(self.temp_dir), ('pnpm', '9.1.0'))
+        self.write('package.json', '{"packageManager": "bun@1.0.0"}')
+        self.assertEqual(detect_package_manager(self.temp_dir), ('yarn', None))
+
+    def test_pnpm_uses_shared_store(self):
+        """Test pnpm installs go through the host-wide store"""
+        with patch.dict(config._config, {'PNPM_STORE_DIR': '/srv/pnpm-store'}):
+            command = install_command(self.temp_dir, 'pnpm')
+            self.assertEqual(command[command.index('--store-dir') + 1], '/srv/pnpm-store')
+            self.assertIn('--no-frozen-lockfile', command)
+            self.write('pnpm-lock.yaml', 'lockfileVersion: 9.0')
+            self.assertIn('--frozen-lockfile', install_command(self.temp_dir, 'pnpm'))
+
+    def test_yarn_commands(self):
+        """Test Yarn classic and Yarn 2+ never update an existing lockfile"""
+        self.write('yarn.lock', '')
+        classic = install_command(self.temp_dir, 'yarn')
+        self.assertIn('--frozen-lockfile', classic)
+        self.assertIn('--cache-folder', classic)
+        self.assertEqual(install_command(self.temp_dir, 'yarn', '4.1.0'),
+                         ['yarn', 'install', '--immutable'])
+
+    @patch('dynapsys.build.stream_command', return_value=(0, []))
+    def test_install_uses_detected_manager(self, mock_stream):
+        """Test installs run the detected package manager"""
+        self.write('package.json', '{"packageManager": "pnpm@9.1.0"}')
+        stats = {}
+        self.assertTrue(install_dependencies(self.temp_dir, stats=stats))
+        self.assertEqual(mock_stream.call_args[0][0][:2], ['pnpm', 'install'])
+        self.assertEqual(stats['package_manager'], 'pnpm')
+        self.assertNotIn('npm_cache', stats)
+
+    @patch('dynapsys.build.stream_command')
+    def test_install_reports_cache_stats(self, mock_stream):
+        """Test install output is parsed into per-deploy cache statistics"""
+        def install(command, cwd=None, on_line=None, **kwargs):
+            on_line('npm http fetch GET 200 https://registry.npmjs.org/react 12ms (cache hit)')
+            on_line('npm http fetch GET 200 https://registry.npmjs.org/left-pad 340ms')
+            return 0, []
+        mock_stream.side_effect = install
+
+        stats = {}
+        self.assertTrue(install_dependencies(self.temp_dir, stats=stats))
+        self.assertEqual(stats['npm_cache']['hit'], 1)
+        self.assertEqual(stats['npm_cache']['miss'], 1)
+        self.assertIn('install_seconds', stats)
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = BuildCache(os.path.join(self.temp_dir, 'cache'), 1024 * 1024)
+        self.node_patch = patch('dynapsys.build.node_version', return_value='v20.0.0')
+        self.node_patch.start()
+
+    def tearDown(self):
+        self.node_patch.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, project, path, content):
+        path = os.path.join(self.temp_dir, project, *path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def make_project(self, name, app='render()'):
+        self.write(name, 'package.json', '{"name": "app"}')
+        self.write(name, 'package-lock.json', '{"lockfileVersion": 3}')
+        self.write(name, 'src/index.js', app)
+        return os.path.join(self.temp_dir, name)
+
+    def test_key_covers_build_inputs(self):
+        """Test keys follow sources and build env but not outputs or dependencies"""
+        project = self.make_project('project')
+        key = self.cache.key(project, env={})
+        self.assertEqual(self.cache.key(self.make_project('copy'), env={}), key)
+
+        self.write('project', 'node_modules/react/index.js', 'x')
+        self.write('project', 'build/index.html', '<html>')
+        self.write('project', '.git/HEAD', 'ref: refs/heads/main')
+        self.assertEqual(self.cache.key(project, env={}), key)
+
+        self.assertNotEqual(self.cache.key(project, env={'REACT_APP_API': 'https://api'}), key)
+        self.assertEqual(self.cache.key(project, env={'HOME': '/root'}), key)
+        with patch('dynapsys.build.node_version', return_value='v22.0.0'):
+            self.assertNotEqual(self.cache.key(project, env={}), key)
+
+        self.write('project', 'src/build/helper.js', 'y')
+        self.assertNotEqual(self.cache.key(project, env={}), key)
+
+    def test_no_key_without_lockfile(self):
+        """Test projects without a lockfile are not cached"""
+        project = self.make_project('project')
+        os.unlink(os.path.join(project, 'package-lock.json'))
+        self.assertIsNone(self.cache.key(project, env={}))
+
+    def test_key_covers_sparse_cone(self):
+        """Test monorepo app keys follow the root manifests and shared packages in the cone"""
+        for name in ('package.json', 'package-lock.json', 'apps/web/package.json', 'apps/web/src/index.js',
+                     'apps/admin/src/index.js', 'packages/ui/index.js', 'packages/other/index.js'):
+            self.write('repo', name, name)
+        root = os.path.join(self.temp_dir, 'repo')
+        app = os.path.join(root, 'apps', 'web')
+        cone = ['apps/web', 'packages/ui']
+        key = self.cache.key(app, env={}, root=root, cone=cone)
+        self.assertNotEqual(self.cache.key(os.path.join(root, 'apps', 'admin'), env={}, root=root, cone=cone), key)
+
+        # Outside the cone, or outputs of the app itself
+        self.write('repo', 'packages/other/index.js', 'changed')
+        self.write('repo', 'apps/web/build/index.html', '<html>')
+        self.assertEqual(self.cache.key(app, env={}, root=root, cone=cone), key)
+
+        for name in ('package-lock.json', 'packages/ui/index.js', 'apps/web/src/index.js'):
+            self.write('repo', name, 'changed')
+            self.assertNotEqual(self.cache.key(app, env={}, root=root, cone=cone), key, name)
+            key = self.cache.key(app, env={}, root=root, cone=cone)
+
+    def test_store_and_restore(self):
+        """Test build outputs are restored into another checkout"""
+        project = self.make_project('project')
+        self.write('project', 'build/index.html', '<html>')
+        self.write('project', 'build/static/main.js', 'main')
+        key = self.cache.key(project, env={})
+        self.assertFalse(self.cache.restore(key, project))
+        self.assertTrue(self.cache.store(key, project))
+        self.assertFalse(self.cache.store(key, project))
+
+        other = self.make_project('other')
+        self.write('other', 'build/stale.html', 'old')
+        self.assertTrue(self.cache.restore(key, other))
+        with open(os.path.join(other, 'build', 'static', 'main.js')) as f:
+            self.assertEqual(f.read(), 'main')
+        self.assertFalse(os.path.exists(os.path.join(other, 'build', 'stale.html')))
+        # Restored files are copies, a rebuild cannot corrupt the cache
+        self.assertFalse(os.path.samefile(
+            os.path.join(other, 'build', 'index.html'),
+            os.path.join(self.cache.path(key), 'build', 'index.html')
+        ))
+
+    def test_evicts_least_recently_used(self):
+        """Test entries over the size budget are evicted oldest first"""
+        self.cache.max_bytes = 2500
+        keys = []
+        for index in range(3):
+            project = self.make_project(f'project{index}', app=f'render({index})')
+            self.write(f'project{index}', 'dist/app.js', 'x' * 1000)
+            keys.append(self.cache.key(project, env={}))
+            self.cache.store(keys[-1], project)
+            os.utime(self.cache.path(keys[-1]), (1000 + index, 1000 + index))
+            if index == 1:
+                # Using the first entry makes the second the eviction candidate
+                self.cache.restore(keys[0], os.path.join(self.temp_dir, 'project0'))
+
+        self.assertTrue(os.path.isdir(self.cache.path(keys[0])))
+        self.assertFalse(os.path.exists(self.cache.path(keys[1])))
+        self.assertTrue(os.path.isdir(self.cache.path(keys[2])))
+
+class TestActivation(unittest.TestCase):
+    def setUp(self):
+        self.project = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.project)
+
+    def write(self, path, content='<html>'):
+        path = os.path.join(self.project, *path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_single_page_apps_are_static(self):
+        """Test build/ and dist/ outputs with an index.html are served as files"""
+        self.write('package.json', json.dumps({'dependencies': {'react': '^18.0.0'}}))
+        self.assertEqual(detect_activation(self.project), ('pm2', None))
+        self.write('dist/assets/app.js', '')
+        self.assertEqual(detect_activation(self.project), ('pm2', None))
+        self.write('dist/index.html')
+        self.assertEqual(detect_activation(self.project), ('static', os.path.join(self.project, 'dist')))
+
+    def test_server_rendered_apps_use_pm2(self):
+        """Test SSR frameworks run under PM2 unless statically exported"""
+        self.write('package.json', json.dumps({'dependencies': {'next': '14.0.0'}}))
+        self.write('build/index.html')
+        self.assertEqual(detect_activation(self.project), ('pm2', None))
+        self.write('out/index.html')
+        self.assertEqual(detect_activation(self.project), ('static', os.path.join(self.project, 'out')))
+
+    def test_forced_modes(self):
+        """Test activation can be forced either way"""
+        self.write('package.json', json.dumps({'dependencies': {'next': '14.0.0'}}))
+        self.assertEqual(detect_activation(self.project, 'static'), ('static', None))
+        self.write('build/index.html')
+        self.assertEqual(detect_activation(self.project, 'static'),
+                         ('static', os.path.join(self.project, 'build')))
+        self.assertEqual(detect_activation(self.project, 'pm2'), ('pm2', None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import shutil
+import tempfile
+from dynapsys.caddy import remove_static_site, render_static_site, setup_static_site, site_config_path
+from dynapsys.config import config
+
+class TestCaddy(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.caddyfile = os.path.join(self.temp_dir, 'Caddyfile')
+        with open(self.caddyfile, 'w') as f:
+            f.write('example.org {\n\trespond "hi"\n}\n')
+        self.config_patch = patch.dict(config._config, {
+            'CADDYFILE': self.caddyfile,
+            'CADDY_SITES_DIR': os.path.join(self.temp_dir, 'sites'),
+        })
+        self.config_patch.start()
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    @patch('dynapsys.caddy.subprocess.run')
+    def test_setup_static_site(self, mock_run):
+        """Test static sites get a snippet imported by the Caddyfile and a reload"""
+        mock_run.return_value = MagicMock(returncode=0, stderr='')
+        self.assertTrue(setup_static_site('test.com', '/srv/test.com/build'))
+
+        snippet = self.read(site_config_path('test.com'))
+        self.assertIn('root * /srv/test.com/build', snippet)
+        self.assertIn('try_files {path} /index.html', snippet)
+        self.assertIn('precompressed br gzip', snippet)
+        self.assertEqual(snippet, render_static_site('test.com', '/srv/test.com/build'))
+        import_line = f"import {os.path.join(config.caddy_sites_dir, '*.caddy')}"
+        self.assertIn(import_line, self.read(self.caddyfile))
+        commands = [call[0][0] for call in mock_run.call_args_list]
+        self.assertEqual(commands[0][:2], ['caddy', 'validate'])
+        self.assertEqual(commands[1], ['systemctl', 'reload', 'caddy'])
+
+        # Unchanged configuration needs no reload; the import is added once
+        mock_run.reset_mock()
+        self.assertTrue(setup_static_site('test.com', '/srv/test.com/build'))
+        mock_run.assert_not_called()
+        self.assertEqual(self.read(self.caddyfile).count(import_line), 1)
+
+    @patch('dynapsys.caddy.subprocess.run')
+    def test_invalid_config_is_rolled_back(self, mock_run):
+        """Test a snippet Caddy rejects is replaced by the previous one"""
+        mock_run.return_value = MagicMock(returncode=0, stderr='')
+        setup_static_site('test.com', '/srv/old')
+
+        mock_run.return_value = MagicMock(returncode=1, stderr='invalid')
+        self.assertFalse(setup_static_site('test.com', '/srv/new'))
+        self.assertIn('/srv/old', self.read(site_config_path('test.com')))
+
+        self.assertFalse(remove_static_site('test.com'))
+        self.assertTrue(os.path.exists(site_config_path('test.com')))
+
+        mock_run.return_value = MagicMock(returncode=0, stderr='')
+        self.assertTrue(remove_static_site('test.com'))
+        self.assertFalse(os.path.exists(site_config_path('test.com')))
+
+    @patch('dynapsys.caddy.subprocess.run', side_effect=FileNotFoundError('caddy'))
+    def test_missing_caddy(self, mock_run):
+        """Test hosts without Caddy report the failure and keep no snippet"""
+        self.assertFalse(setup_static_site('test.com', '/srv/test.com/build'))
+        self.assertFalse(os.path.exists(site_config_path('test.com')))
+        self.assertTrue(remove_static_site('test.com'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,11 @@
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from dynapsys.cli import cli, serve, dns, clone, config_info, get_config
+from dynapsys.cli import cli, serve, dns, clone, push, rollback, gc, config_info, get_config
+from dynapsys.config import config
+from dynapsys.releases import ReleaseStore
 
 class TestCLI(unittest.TestCase):
     def setUp(self):
@@ -88,6 +92,95 @@ class TestCLI(unittest.TestCase):
         self.assertEqual(result.exit_code, 1)
         self.assertIn('Failed to clone repository', result.output)
 
+        # Test clone strategy options
+        mock_clone_repo.reset_mock()
+        mock_clone_repo.return_value = True
+        result = self.runner.invoke(clone, [
+            'https://github.com/user/repo.git',
+            '/path/to/target',
+            '--mode', 'partial',
+            '--ref', 'main'
+        ])
+        self.assertEqual(result.exit_code, 0)
+        mock_clone_repo.assert_called_once_with(
+            'https://github.com/user/repo.git',
+            '/path/to/target',
+            mode='partial',
+            ref='main'
+        )
+
+    @patch('dynapsys.cli.sync_project')
+    def test_push_command(self, mock_sync):
+        """Test push command"""
+        mock_sync.return_value = {'job_id': 'abc123'}
+        with tempfile.TemporaryDirectory() as project:
+            result = self.runner.invoke(push, [
+                project, 'example.com', 'token123', '--url', 'http://server:8000'
+            ])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn('Deployment queued: abc123', result.output)
+            mock_sync.assert_called_once_with('http://server:8000', project, 'example.com', 'token123')
+
+            mock_sync.side_effect = Exception('connection refused')
+            result = self.runner.invoke(push, [project, 'example.com', 'token123'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('Failed to deploy', result.output)
+
+    @patch('dynapsys.cli.rollback_site')
+    def test_rollback_command(self, mock_rollback):
+        """Test rollback command"""
+        sites_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sites_dir)
+        config_patch = patch.dict(config._config, {'SITES_DIR': sites_dir})
+        config_patch.start()
+        self.addCleanup(config_patch.stop)
+        mock_rollback.return_value = {'domain': 'example.com', 'release': 'r1', 'previous': 'r2'}
+        result = self.runner.invoke(rollback, ['example.com'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Release r1 is live on example.com', result.output)
+        mock_rollback.assert_called_once_with('example.com', None)
+
+        result = self.runner.invoke(rollback, ['example.com', '--release', 'r1'])
+        mock_rollback.assert_called_with('example.com', 'r1')
+
+        mock_rollback.side_effect = ValueError('No release to roll back to')
+        result = self.runner.invoke(rollback, ['example.com'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('No release to roll back to', result.output)
+
+        mock_rollback.side_effect = None
+        mock_rollback.return_value = None
+        result = self.runner.invoke(rollback, ['example.com'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Failed to roll back', result.output)
+
+        # A deployment of the server holds the domain's release lock
+        mock_rollback.reset_mock()
+        with ReleaseStore(sites_dir).lock('example.com'):
+            result = self.runner.invoke(rollback, ['example.com'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('in progress', result.output)
+        mock_rollback.assert_not_called()
+
+        result = self.runner.invoke(rollback, ['../etc'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Invalid domain', result.output)
+
+    @patch('dynapsys.cli.lower_io_priority')
+    @patch('dynapsys.cli.get_retention_collector')
+    def test_gc_command(self, mock_collector, mock_priority):
+        """Test gc command"""
+        mock_collector.return_value.collect.return_value = ['/var/www/example.com_backup_20240101_000000']
+        result = self.runner.invoke(gc, ['--dry-run'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Would remove /var/www/example.com_backup_20240101_000000', result.output)
+        mock_collector.return_value.collect.assert_called_once_with(dry_run=True)
+        mock_priority.assert_called_once_with()
+
+        result = self.runner.invoke(gc)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('1 releases and backups removed', result.output)
+
     def test_config_info_command(self):
         """Test config info command"""
         result = self.runner.invoke(config_info)
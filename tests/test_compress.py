@@ -0,0 +1,71 @@
+import unittest
+import os
+import gzip
+import shutil
+import tempfile
+from dynapsys.compress import available_encodings, brotli, compress_file, precompress_tree
+
+class TestPrecompress(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, data):
+        path = os.path.join(self.root, *path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_sidecars_written_in_parallel(self):
+        """Test compressible assets get sidecars and the savings are reported"""
+        script = b'function render() { return "hello world"; }\n' * 200
+        paths = [self.write(f'static/js/chunk{index}.js', script) for index in range(5)]
+        self.write('static/media/logo.png', b'\x89PNG' + b'x' * 4096)
+        self.write('robots.txt', b'User-agent: *\n')
+
+        stats = precompress_tree(self.root, min_size=1024, workers=2, encodings=['gzip'])
+
+        self.assertEqual(stats['files'], 5)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['bytes'], 5 * len(script))
+        self.assertEqual(stats['gzip']['files'], 5)
+        self.assertEqual(stats['gzip']['saved'], stats['bytes'] - stats['gzip']['bytes'])
+        for path in paths:
+            with gzip.open(path + '.gz') as f:
+                self.assertEqual(f.read(), script)
+            self.assertEqual(os.stat(path + '.gz').st_mtime_ns, os.stat(path).st_mtime_ns)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'static', 'media', 'logo.png.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'robots.txt.gz')))
+
+        # A second pass finds the sidecars current and compresses nothing
+        stats = precompress_tree(self.root, min_size=1024, workers=2, encodings=['gzip'])
+        self.assertEqual(stats['up_to_date'], 5)
+        self.assertEqual(stats['gzip']['files'], 5)
+
+    def test_incompressible_files_skipped(self):
+        """Test sidecars that would not be smaller are not written, stale ones removed"""
+        path = self.write('data.json', os.urandom(4096))
+        self.write('data.json.gz', b'stale')
+        self.assertEqual(compress_file(path, ['gzip']), {})
+        self.assertFalse(os.path.exists(path + '.gz'))
+
+    @unittest.skipUnless(brotli, "brotli is not installed")
+    def test_brotli_sidecars(self):
+        """Test .br sidecars are written when brotli is installed"""
+        self.assertIn('br', available_encodings())
+        path = self.write('index.html', b'<div class="app"></div>' * 200)
+        stats = precompress_tree(self.root, workers=1)
+        self.assertEqual(brotli.decompress(open(path + '.br', 'rb').read()),
+                         b'<div class="app"></div>' * 200)
+        self.assertGreater(stats['br']['saved'], 0)
+
+    def test_brotli_optional(self):
+        """Test gzip is always available"""
+        self.assertIn('gzip', available_encodings())
+        self.assertEqual('br' in available_encodings(), brotli is not None)
+
+if __name__ == '__main__':
+    unittest.main()
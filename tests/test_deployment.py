@@ -5,8 +5,23 @@ import os
 import tempfile
 import shutil
 import base64
+import hashlib
+import io
+import tarfile
+import threading
+import urllib.request
+import urllib.error
 from http.server import HTTPServer
-from dynapsys.deployment import DeploymentHandler, run_server
+from dynapsys.deployment import (
+    DeploymentHandler, DeploymentServer, build_react_project, rollback_site, run_deployment, run_server,
+    setup_pm2
+)
+from dynapsys.client import sync_project
+from dynapsys.config import config
+from dynapsys.jobs import DeploymentJob, JobQueue
+from dynapsys.releases import ReleaseStore
+from dynapsys.scheduler import BuildScheduler
+from dynapsys.sites import SiteStateStore
 
 class TestDeploymentHandler(unittest.TestCase):
     def setUp(self):
@@ -205,5 +220,653 @@ class TestDeploymentHandler(unittest.TestCase):
             mock_temp_dir.return_value.__enter__.return_value = self.test_dir
             self.handler.do_POST()
 
+class TestDeploymentServer(unittest.TestCase):
+    def setUp(self):
+        self.jobs = []
+        self.release = threading.Event()
+
+        def runner(job):
+            self.jobs.append(job)
+            self.release.wait(5)
+            return True
+
+        self.queue = JobQueue(runner, workers=1)
+        self.data_dir = tempfile.mkdtemp()
+        self.config_patch = patch.dict(config._config, {
+            'UPLOADS_DIR': os.path.join(self.data_dir, 'uploads'),
+            'BLOBS_DIR': os.path.join(self.data_dir, 'blobs'),
+            'STATE_DIR': os.path.join(self.data_dir, 'state'),
+        })
+        self.config_patch.start()
+        self.server = DeploymentServer(('127.0.0.1', 0), DeploymentHandler, job_queue=self.queue)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.config_patch.stop()
+        shutil.rmtree(self.data_dir)
+
+    def request(self, method, path, data=None, headers=None):
+        """Send a request and return (status, parsed JSON body)"""
+        body = json.dumps(data).encode() if isinstance(data, dict) else data
+        req = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                     headers=headers or {'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=5) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b'null')
+
+    def test_post_returns_accepted(self):
+        """Test deployments are queued and acknowledged immediately"""
+        status, body = self.request('POST', '/', {
+            'domain': 'test.com',
+            'cf_token': 'token',
+            'source': 'https://github.com/user/repo.git'
+        })
+        self.assertEqual(status, 202)
+        self.assertEqual(body['status'], 'accepted')
+        self.assertTrue(body['job_id'])
+
+    def test_get_deployment_status(self):
+        """Test job lookups by id and by domain"""
+        _, accepted = self.request('POST', '/', {
+            'domain': 'test.com',
+            'cf_token': 'token',
+            'source': 'https://github.com/user/repo.git'
+        })
+
+        status, body = self.request('GET', f"/deployments/{accepted['job_id']}")
+        self.assertEqual(status, 200)
+        self.assertEqual(body['domain'], 'test.com')
+        self.assertIn('log', body)
+        self.assertIn('stages', body)
+
+        status, body = self.request('GET', '/deployments?domain=test.com')
+        self.assertEqual(status, 200)
+        self.assertEqual([job['id'] for job in body['deployments']], [accepted['job_id']])
+
+        status, body = self.request('GET', '/deployments?domain=other.com')
+        self.assertEqual(body['deployments'], [])
+
+        status, _ = self.request('GET', '/deployments/unknown')
+        self.assertEqual(status, 404)
+
+    def test_follow_deployment_log(self):
+        """Test build output is streamed as Server-Sent Events"""
+        _, accepted = self.request('POST', '/', {
+            'domain': 'test.com',
+            'cf_token': 'token',
+            'source': 'https://github.com/user/repo.git'
+        })
+        for _ in range(100):
+            if self.jobs:
+                break
+            threading.Event().wait(0.05)
+        self.jobs[0].append_log('npm: added 12 packages')
+        self.release.set()
+
+        with urllib.request.urlopen(f"{self.base_url}/deployments/{accepted['job_id']}/log",
+                                    timeout=5) as response:
+            self.assertEqual(response.headers['Content-Type'], 'text/event-stream')
+            stream = response.read().decode()
+        self.assertIn('data: npm: added 12 packages', stream)
+        self.assertIn('event: end', stream)
+        self.assertIn('succeeded', stream)
+
+        status, _ = self.request('GET', '/deployments/unknown/log')
+        self.assertEqual(status, 404)
+
+    def test_put_streams_upload(self):
+        """Test raw archive uploads are unpacked while streaming and queued"""
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            info = tarfile.TarInfo('project/package.json')
+            info.size = 2
+            tar.addfile(info, io.BytesIO(b'{}'))
+        archive = buffer.getvalue()
+
+        status, body = self.request('PUT', '/deployments/test.com', archive, headers={
+            'Content-Type': 'application/gzip',
+            'X-CF-Token': 'token'
+        })
+        self.assertEqual(status, 202)
+        self.assertEqual(body['size'], len(archive))
+        self.assertEqual(body['compression'], 'gzip')
+
+        job = self.server.job_queue.index.get(body['job_id'])
+        self.assertTrue(os.path.exists(os.path.join(job.params['source_dir'], 'package.json')))
+
+    def test_put_rejects_invalid_archive(self):
+        """Test bodies that are not archives are refused"""
+        status, body = self.request('PUT', '/deployments/test.com', b'not an archive', headers={
+            'Content-Type': 'application/gzip',
+            'X-CF-Token': 'token'
+        })
+        self.assertEqual(status, 400)
+        self.assertEqual(os.listdir(os.path.join(self.data_dir, 'uploads')), [])
+
+    def test_put_rejects_bad_requests(self):
+        """Test upload validation"""
+        headers = {'Content-Type': 'application/gzip', 'X-CF-Token': 'token'}
+        status, _ = self.request('PUT', '/deployments/not_a_domain', b'x', headers=headers)
+        self.assertEqual(status, 400)
+
+        status, _ = self.request('PUT', '/deployments/test.com', b'x', headers={
+            'Content-Type': 'text/plain', 'X-CF-Token': 'token'
+        })
+        self.assertEqual(status, 415)
+
+        status, _ = self.request('PUT', '/deployments/test.com', b'x', headers={
+            'Content-Type': 'application/gzip'
+        })
+        self.assertEqual(status, 400)
+
+    def test_blob_upload_and_deploy(self):
+        """Test clients can skip uploads the server already has"""
+        data = b'tarball'
+        digest = hashlib.sha256(data).hexdigest()
+        headers = {'Content-Type': 'application/octet-stream'}
+
+        head = urllib.request.Request(f"{self.base_url}/blobs/{digest}", method='HEAD')
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(head, timeout=5)
+        self.assertEqual(ctx.exception.code, 404)
+
+        status, body = self.request('PUT', f'/blobs/{digest}', data, headers=headers)
+        self.assertEqual(status, 201)
+        status, body = self.request('PUT', f'/blobs/{digest}', data, headers=headers)
+        self.assertEqual(status, 200)
+
+        with urllib.request.urlopen(head, timeout=5) as response:
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.headers['Content-Length'], str(len(data)))
+
+        status, body = self.request('POST', '/', {
+            'domain': 'test.com', 'cf_token': 'token', 'blob': digest
+        })
+        self.assertEqual(status, 202)
+
+        status, body = self.request('POST', '/', {
+            'domain': 'test.com', 'cf_token': 'token', 'blob': '0' * 64
+        })
+        self.assertEqual(status, 400)
+
+    def test_blob_upload_digest_mismatch(self):
+        """Test blobs must match the digest in the URL"""
+        status, _ = self.request('PUT', f"/blobs/{'0' * 64}", b'data',
+                                 headers={'Content-Type': 'application/octet-stream'})
+        self.assertEqual(status, 400)
+
+    def test_manifest_sync(self):
+        """Test delta uploads send only content the server is missing"""
+        project = os.path.join(self.data_dir, 'project')
+        os.makedirs(project)
+        with open(os.path.join(project, 'package.json'), 'w') as f:
+            f.write('{}')
+        with open(os.path.join(project, 'empty.txt'), 'w') as f:
+            pass
+
+        with patch.dict(config._config, {'SITES_DIR': os.path.join(self.data_dir, 'sites')}):
+            response = sync_project(self.base_url, project, 'test.com', 'token')
+            self.assertEqual(response['status'], 'accepted')
+            self.assertEqual(len(os.listdir(os.path.join(self.data_dir, 'blobs'))), 3)
+
+            status, body = self.request('POST', '/deployments/test.com/manifest', {
+                'files': self.server.job_queue.index.get(response['job_id']).params['manifest']
+            })
+            self.assertEqual(status, 200)
+            self.assertEqual(body['missing'], [])
+
+        status, body = self.request('POST', '/deployments/test.com/manifest', {
+            'files': [{'path': '../x', 'size': 1, 'sha256': '0' * 64}]
+        })
+        self.assertEqual(status, 400)
+
+    def test_resumable_upload_session(self):
+        """Test chunked uploads are verified and deployed on commit"""
+        data = b'chunked archive data'
+        digest = hashlib.sha256(data).hexdigest()
+        status, session = self.request('POST', '/uploads', {
+            'size': len(data), 'sha256': digest, 'chunk_size': 8
+        })
+        self.assertEqual(status, 201)
+        upload_id = session['upload_id']
+        headers = {'Content-Type': 'application/octet-stream'}
+
+        status, body = self.request('PUT', f'/uploads/{upload_id}/chunks/1', data[8:16], headers=headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(body['missing'], [0, 2])
+        self.assertEqual(body['missing_count'], 2)
+
+        status, body = self.request('POST', f'/uploads/{upload_id}/commit', {
+            'domain': 'test.com', 'cf_token': 'token'
+        })
+        self.assertEqual(status, 409)
+
+        self.request('PUT', f'/uploads/{upload_id}/chunks/0', data[:8], headers=headers)
+        self.request('PUT', f'/uploads/{upload_id}/chunks/2', data[16:], headers=headers)
+        status, body = self.request('GET', f'/uploads/{upload_id}')
+        self.assertEqual(body['missing'], [])
+
+        status, body = self.request('POST', f'/uploads/{upload_id}/commit', {
+            'domain': 'test.com', 'cf_token': 'token'
+        })
+        self.assertEqual(status, 202)
+        self.assertEqual(body['blob'], digest)
+        self.assertTrue(self.server.blob_store.exists(digest))
+
+        status, _ = self.request('GET', f'/uploads/{upload_id}')
+        self.assertEqual(status, 404)
+        # Late chunks and repeated commits find nothing to change
+        status, _ = self.request('PUT', f'/uploads/{upload_id}/chunks/0', data[:8], headers=headers)
+        self.assertEqual(status, 404)
+        status, _ = self.request('POST', f'/uploads/{upload_id}/commit', {})
+        self.assertEqual(status, 404)
+
+    def test_post_live_commit_is_noop(self):
+        """Test requests for the commit already live are not queued"""
+        commit = 'c' * 40
+        self.server.site_state.update('test.com', commit=commit)
+        params = {
+            'domain': 'test.com',
+            'cf_token': 'token',
+            'source': 'https://github.com/user/repo.git',
+            'commit': commit
+        }
+        status, body = self.request('POST', '/', params)
+        self.assertEqual(status, 200)
+        self.assertEqual(body['status'], 'unchanged')
+        self.assertEqual(self.queue.qsize(), 0)
+
+        params['force'] = True
+        status, body = self.request('POST', '/', params)
+        self.assertEqual(status, 202)
+
+    @patch('dynapsys.deployment.rollback_site')
+    def test_rollback(self, mock_rollback):
+        """Test earlier releases are activated on request, the previous one by default"""
+        mock_rollback.return_value = {'domain': 'test.com', 'release': 'r1', 'previous': 'r2'}
+        status, body = self.request('POST', '/deployments/test.com/rollback', b'')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['release'], 'r1')
+        mock_rollback.assert_called_once_with('test.com', None)
+
+        status, _ = self.request('POST', '/deployments/test.com/rollback', {'release': 'r1'})
+        self.assertEqual(status, 200)
+        mock_rollback.assert_called_with('test.com', 'r1')
+
+        mock_rollback.side_effect = ValueError('No release to roll back to')
+        status, body = self.request('POST', '/deployments/test.com/rollback', b'')
+        self.assertEqual(status, 409)
+        self.assertEqual(body['error'], 'No release to roll back to')
+
+        mock_rollback.side_effect = None
+        mock_rollback.return_value = None
+        status, _ = self.request('POST', '/deployments/test.com/rollback', b'')
+        self.assertEqual(status, 500)
+
+        status, _ = self.request('POST', '/deployments/bad_domain!/rollback', b'')
+        self.assertEqual(status, 400)
+
+    def test_post_invalid_source(self):
+        """Test invalid sources are rejected before queueing"""
+        status, body = self.request('POST', '/', {
+            'domain': 'test.com',
+            'cf_token': 'token',
+            'source': 'ftp://example.com/repo'
+        })
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error'], 'Invalid source format')
+
+        status, body = self.request('POST', '/', {
+            'domain': 'test.com',
+            'cf_token': 'token',
+            'source': 'https://github.com/user/repo.git',
+            'clone': 'deep'
+        })
+        self.assertEqual(status, 400)
+        self.assertIn('Invalid clone mode', body['error'])
+
+    def test_post_invalid_domain(self):
+        """Test domains that are not valid names are rejected before anything else"""
+        for domain in ('../../etc', 'bad_domain!', ['test.com'], 42):
+            status, body = self.request('POST', '/', {'domain': domain, 'cf_token': 'token'})
+            self.assertEqual(status, 400)
+            self.assertEqual(body['error'], 'Invalid domain')
+        self.assertEqual(self.queue.qsize(), 0)
+
+class TestRunDeployment(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.config_patch = patch.dict(config._config, {
+            'SITES_DIR': os.path.join(self.data_dir, 'sites'),
+            'STATE_DIR': os.path.join(self.data_dir, 'state'),
+            'CADDY_SITES_DIR': os.path.join(self.data_dir, 'caddy'),
+        })
+        self.config_patch.start()
+        self.state = SiteStateStore(config.state_dir)
+        self.releases = ReleaseStore(config.sites_dir)
+        self.commit = 'a' * 40
+        self.params = {'cf_token': 'token', 'source': 'https://github.com/user/repo.git'}
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.data_dir)
+
+    @staticmethod
+    def clone(url, target_dir, **kwargs):
+        os.makedirs(target_dir)
+        return True
+
+    @patch('dynapsys.deployment.clone_git_repo')
+    @patch('dynapsys.deployment.resolve_commit')
+    def test_live_commit_skips_pipeline(self, mock_resolve, mock_clone):
+        """Test a ref resolving to the live commit finishes without building"""
+        os.makedirs(os.path.join(config.sites_dir, 'test.com'))
+        self.state.update('test.com', commit=self.commit)
+        mock_resolve.return_value = self.commit
+
+        job = DeploymentJob('test.com', dict(self.params, ref='main'))
+        self.assertTrue(run_deployment(job))
+        self.assertTrue(job.result['unchanged'])
+        mock_resolve.assert_called_once_with(self.params['source'], 'main', on_progress=job.set_progress)
+        mock_clone.assert_not_called()
+
+    @patch('dynapsys.deployment.setup_pm2', return_value=True)
+    @patch('dynapsys.deployment.update_cloudflare_dns', return_value=True)
+    @patch('dynapsys.deployment.build_react_project', return_value=True)
+    @patch('dynapsys.deployment.head_commit')
+    @patch('dynapsys.deployment.clone_git_repo')
+    @patch('dynapsys.deployment.resolve_commit')
+    def test_new_commit_is_pinned_and_recorded(self, mock_resolve, mock_clone, mock_head, *mocks):
+        """Test new commits are checked out exactly and recorded once live"""
+        new_commit = 'b' * 40
+        self.state.update('test.com', commit=self.commit)
+        mock_resolve.return_value = new_commit
+        mock_head.return_value = new_commit
+        mock_clone.side_effect = self.clone
+
+        job = DeploymentJob('test.com', dict(self.params))
+        self.assertTrue(run_deployment(job))
+        self.assertEqual(mock_clone.call_args[1]['commit'], new_commit)
+        self.assertEqual(self.state.live_commit('test.com'), new_commit)
+        self.assertEqual(self.releases.current('test.com'), job.result['release'])
+        self.assertEqual(self.state.get('test.com')['release'], job.result['release'])
+
+    @patch('dynapsys.deployment.setup_pm2', return_value=True)
+    @patch('dynapsys.deployment.update_cloudflare_dns', return_value=True)
+    @patch('dynapsys.deployment.build_react_project', return_value=True)
+    @patch('dynapsys.deployment.head_commit', return_value='b' * 40)
+    @patch('dynapsys.deployment.clone_git_repo')
+    @patch('dynapsys.deployment.resolve_commit', return_value='b' * 40)
+    def test_subdir_is_sparse_and_built(self, mock_resolve, mock_clone, mock_head, mock_build,
+                                        mock_dns, mock_pm2):
+        """Test monorepo apps are checked out sparsely and built from their directory"""
+        mock_clone.side_effect = self.clone
+        job = DeploymentJob('test.com', dict(self.params, subdir='apps/web', sparse=['packages/ui']))
+        self.assertTrue(run_deployment(job))
+        self.assertEqual(mock_clone.call_args[1]['sparse_paths'], ['apps/web', 'packages/ui'])
+        project_dir = self.releases.path('test.com', job.result['release'])
+        build_dir = os.path.join(project_dir, 'apps', 'web')
+        mock_build.assert_called_once_with(build_dir, {}, domain='test.com', activation='auto',
+                                           source_root=project_dir,
+                                           cone=['apps/web', 'packages/ui'])
+        # PM2 runs from the current symlink so later releases keep the same path
+        mock_pm2.assert_called_once_with(
+            'test.com', os.path.join(config.sites_dir, 'test.com', 'current', 'apps', 'web')
+        )
+        self.assertEqual(self.state.get('test.com')['releases'][job.result['release']]['build_dir'],
+                         os.path.join('apps', 'web'))
+
+    @patch('dynapsys.deployment.stop_pm2')
+    @patch('dynapsys.deployment.setup_static_site', return_value=True)
+    @patch('dynapsys.deployment.setup_pm2', return_value=True)
+    @patch('dynapsys.deployment.update_cloudflare_dns', return_value=True)
+    @patch('dynapsys.deployment.build_react_project', return_value=True)
+    @patch('dynapsys.deployment.head_commit', return_value='b' * 40)
+    @patch('dynapsys.deployment.clone_git_repo')
+    @patch('dynapsys.deployment.resolve_commit', return_value='b' * 40)
+    def test_static_build_served_without_pm2(self, mock_resolve, mock_clone, mock_head, mock_build,
+                                             mock_dns, mock_pm2, mock_static, mock_stop):
+        """Test single-page apps are served by Caddy and their PM2 process removed"""
+        project_dir = self.releases.current_link('test.com')
+
+        def clone(url, target_dir, **kwargs):
+            os.makedirs(os.path.join(target_dir, 'dist'))
+            with open(os.path.join(target_dir, 'dist', 'index.html'), 'w') as f:
+                f.write('<html>')
+            return True
+        mock_clone.side_effect = clone
+
+        job = DeploymentJob('test.com', dict(self.params))
+        self.assertTrue(run_deployment(job))
+        self.assertEqual(job.result['activation'], 'static')
+        self.assertIn('compress', [stage['name'] for stage in job.stages])
+        self.assertEqual(job.result['compression']['skipped'], 1)
+        self.assertEqual(job.result['dedupe']['stored'], 1)
+        mock_static.assert_called_once_with('test.com', os.path.join(project_dir, 'dist'))
+        mock_stop.assert_called_once_with('test.com')
+        mock_pm2.assert_not_called()
+
+        # Forcing PM2 keeps the Node.js process
+        job = DeploymentJob('test.com', dict(self.params, activation='pm2', force=True))
+        self.assertTrue(run_deployment(job))
+        self.assertEqual(job.result['activation'], 'pm2')
+        mock_pm2.assert_called_once_with('test.com', project_dir)
+        # Trees of server-side apps are written at runtime and keep their own files
+        self.assertNotIn('dedupe', job.result)
+
+    @patch('dynapsys.deployment.build_react_project', return_value=False)
+    @patch('dynapsys.deployment.head_commit', return_value='b' * 40)
+    @patch('dynapsys.deployment.clone_git_repo', return_value=True)
+    @patch('dynapsys.deployment.resolve_commit', return_value='b' * 40)
+    def test_failed_build_forgets_live_commit(self, *mocks):
+        """Test a failed deployment does not leave a stale live commit"""
+        self.state.update('test.com', commit=self.commit)
+        job = DeploymentJob('test.com', dict(self.params))
+        self.assertFalse(run_deployment(job))
+        self.assertIsNone(self.state.live_commit('test.com'))
+
+    @patch('dynapsys.deployment.build_react_project', return_value=False)
+    @patch('dynapsys.deployment.head_commit', return_value='b' * 40)
+    @patch('dynapsys.deployment.clone_git_repo')
+    @patch('dynapsys.deployment.resolve_commit', return_value='b' * 40)
+    def test_failed_build_keeps_live_release(self, mock_resolve, mock_clone, *mocks):
+        """Test a failed build leaves the previous release serving and is removed"""
+        mock_clone.side_effect = self.clone
+        site_dir = os.path.join(config.sites_dir, 'test.com')
+        os.makedirs(site_dir)
+        with open(os.path.join(site_dir, 'index.html'), 'w') as f:
+            f.write('old')
+        self.state.update('test.com', commit=self.commit)
+
+        job = DeploymentJob('test.com', dict(self.params))
+        self.assertFalse(run_deployment(job))
+        job.cleanup()
+        # The plain checkout became the first release and is still live
+        self.assertEqual(self.releases.list('test.com'), [self.releases.current('test.com')])
+        with open(os.path.join(self.releases.current_link('test.com'), 'index.html')) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(self.state.live_commit('test.com'), self.commit)
+
+    @patch('dynapsys.deployment.setup_pm2')
+    @patch('dynapsys.deployment.remove_static_site', return_value=True)
+    @patch('dynapsys.deployment.update_cloudflare_dns', return_value=True)
+    @patch('dynapsys.deployment.build_react_project', return_value=True)
+    @patch('dynapsys.deployment.head_commit', return_value='b' * 40)
+    @patch('dynapsys.deployment.clone_git_repo')
+    @patch('dynapsys.deployment.resolve_commit')
+    def test_rollback(self, mock_resolve, mock_clone, mock_head, mock_build, mock_dns,
+                      mock_remove, mock_pm2):
+        """Test earlier releases go live again without rebuilding"""
+        mock_clone.side_effect = self.clone
+        mock_pm2.return_value = True
+        deployed = []
+        for commit in ('b' * 40, 'c' * 40):
+            mock_resolve.return_value = mock_head.return_value = commit
+            job = DeploymentJob('test.com', dict(self.params))
+            self.assertTrue(run_deployment(job))
+            deployed.append(job.result['release'])
+
+        # A release whose PM2 process cannot start is switched away from
+        mock_pm2.return_value = False
+        job = DeploymentJob('test.com', dict(self.params, force=True))
+        self.assertFalse(run_deployment(job))
+        self.assertEqual(job.error, 'PM2 setup failed')
+        self.assertEqual(self.releases.current('test.com'), deployed[1])
+        job.cleanup()
+
+        mock_pm2.return_value = True
+        mock_build.reset_mock()
+        result = rollback_site('test.com')
+        self.assertEqual(result, {'domain': 'test.com', 'release': deployed[0], 'previous': deployed[1]})
+        self.assertEqual(self.releases.current('test.com'), deployed[0])
+        self.assertEqual(self.state.live_commit('test.com'), 'b' * 40)
+        mock_pm2.assert_called_with('test.com', self.releases.current_link('test.com'))
+        mock_build.assert_not_called()
+
+        # Rolling forward names the release explicitly
+        self.assertEqual(rollback_site('test.com', deployed[1])['release'], deployed[1])
+        self.assertEqual(self.state.live_commit('test.com'), 'c' * 40)
+        with self.assertRaises(ValueError):
+            rollback_site('test.com', deployed[1])
+        with self.assertRaises(ValueError):
+            rollback_site('test.com', 'unknown')
+
+        # The server is restored when the old release cannot be served
+        mock_pm2.return_value = False
+        self.assertIsNone(rollback_site('test.com'))
+        self.assertEqual(self.releases.current('test.com'), deployed[1])
+
+    @patch('dynapsys.deployment.activate_site')
+    @patch('dynapsys.deployment.update_cloudflare_dns', return_value=True)
+    @patch('dynapsys.deployment.build_react_project', return_value=True)
+    @patch('dynapsys.deployment.head_commit', return_value='b' * 40)
+    @patch('dynapsys.deployment.clone_git_repo')
+    @patch('dynapsys.deployment.resolve_commit', return_value='b' * 40)
+    def test_activation_crash_keeps_live_release(self, mock_resolve, mock_clone, mock_head, mock_build,
+                                                 mock_dns, mock_activate):
+        """Test an exception while activating switches back and removes only the new release"""
+        mock_clone.side_effect = self.clone
+        mock_activate.side_effect = FileNotFoundError('pm2')
+        job = DeploymentJob('test.com', dict(self.params))
+        self.assertFalse(run_deployment(job))
+        job.cleanup()
+        # Nothing was live before, so nothing is live now
+        self.assertFalse(os.path.lexists(self.releases.current_link('test.com')))
+        self.assertEqual(self.releases.list('test.com'), [])
+
+        mock_activate.side_effect = None
+        mock_activate.return_value = None
+        job = DeploymentJob('test.com', dict(self.params))
+        self.assertTrue(run_deployment(job))
+        live = job.result['release']
+
+        mock_activate.side_effect = FileNotFoundError('pm2')
+        job = DeploymentJob('test.com', dict(self.params, force=True))
+        self.assertFalse(run_deployment(job))
+        self.assertEqual(job.error, 'Activation failed')
+        job.cleanup()
+        self.assertEqual(self.releases.current('test.com'), live)
+        self.assertEqual(self.releases.list('test.com'), [live])
+
+    @patch('dynapsys.deployment.subprocess.run', side_effect=FileNotFoundError('pm2'))
+    def test_setup_pm2_without_pm2(self, mock_run):
+        """Test a missing pm2 binary is reported as a failed setup"""
+        self.assertFalse(setup_pm2('test.com', self.data_dir))
+
+class TestBuildReactProject(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.config_patch = patch.dict(config._config, {
+            'DEPENDENCY_CACHE_DIR': os.path.join(self.data_dir, 'deps'),
+            'BUILD_CACHE_DIR': os.path.join(self.data_dir, 'builds'),
+            'NPM_CACHE_DIR': os.path.join(self.data_dir, 'npm'),
+        })
+        self.config_patch.start()
+        self.node_patch = patch('dynapsys.build.node_version', return_value='v20.0.0')
+        self.node_patch.start()
+        self.scheduler = BuildScheduler(os.path.join(self.data_dir, 'build-memory.json'),
+                                        default_estimate=0, reserve=0, max_load=100.0)
+        self.scheduler_patch = patch('dynapsys.deployment.get_build_scheduler',
+                                     return_value=self.scheduler)
+        self.scheduler_patch.start()
+
+    def tearDown(self):
+        self.scheduler_patch.stop()
+        self.node_patch.stop()
+        self.config_patch.stop()
+        shutil.rmtree(self.data_dir)
+
+    def make_project(self, name):
+        project = os.path.join(self.data_dir, name)
+        os.makedirs(os.path.join(project, 'src'))
+        for path, content in (('package.json', '{"name": "app"}'),
+                              ('package-lock.json', '{"lockfileVersion": 3}'),
+                              (os.path.join('src', 'index.js'), 'render()')):
+            with open(os.path.join(project, path), 'w') as f:
+                f.write(content)
+        return project
+
+    @staticmethod
+    def fake_npm(command, cwd=None, **kwargs):
+        if command[1] in ('ci', 'install'):
+            os.makedirs(os.path.join(cwd, 'node_modules', 'react'))
+        else:
+            os.makedirs(os.path.join(cwd, 'build'))
+            with open(os.path.join(cwd, 'build', 'index.html'), 'w') as f:
+                f.write('<html>')
+        return 0, []
+
+    @patch('dynapsys.build.stream_command')
+    @patch('dynapsys.deployment.stream_command')
+    def test_identical_inputs_skip_build(self, mock_build, mock_install):
+        """Test a second build of identical inputs is restored from the cache"""
+        mock_build.side_effect = self.fake_npm
+        mock_install.side_effect = self.fake_npm
+
+        stats = {}
+        self.assertTrue(build_react_project(self.make_project('first'), stats))
+        self.assertEqual(stats['build_cache'], 'miss')
+
+        stats = {}
+        second = self.make_project('second')
+        self.assertTrue(build_react_project(second, stats))
+        self.assertEqual(stats['build_cache'], 'hit')
+        # Served statically, so node_modules is not needed
+        self.assertEqual(stats['dependency_cache'], 'skipped')
+        self.assertEqual(mock_build.call_count, 1)
+        self.assertEqual(mock_install.call_count, 1)
+        self.assertTrue(os.path.isfile(os.path.join(second, 'build', 'index.html')))
+        self.assertFalse(os.path.exists(os.path.join(second, 'node_modules')))
+
+        stats = {}
+        third = self.make_project('third')
+        self.assertTrue(build_react_project(third, stats, activation='pm2'))
+        self.assertEqual(stats['build_cache'], 'hit')
+        self.assertEqual(stats['dependency_cache'], 'hit')
+        self.assertEqual(mock_build.call_count, 1)
+        self.assertTrue(os.path.isdir(os.path.join(third, 'node_modules', 'react')))
+
+    @patch('dynapsys.build.stream_command')
+    @patch('dynapsys.deployment.stream_command')
+    def test_no_build_cache_without_lockfile(self, mock_build, mock_install):
+        """Test projects without a lockfile are built every time"""
+        mock_build.side_effect = self.fake_npm
+        mock_install.side_effect = self.fake_npm
+
+        for name in ('first', 'second'):
+            project = self.make_project(name)
+            os.unlink(os.path.join(project, 'package-lock.json'))
+            stats = {}
+            self.assertTrue(build_react_project(project, stats))
+            self.assertEqual(stats['build_cache'], 'disabled')
+        self.assertEqual(mock_build.call_count, 2)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import tempfile
+from dynapsys.filestore import FileStore
+
+class TestFileStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = FileStore(os.path.join(self.temp_dir, 'sites', '.objects'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_tree(self, name, files):
+        root = os.path.join(self.temp_dir, 'sites', name)
+        for path, content in files.items():
+            full_path = os.path.join(root, *path.split('/'))
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'w') as f:
+                f.write(content)
+        return root
+
+    def test_identical_files_share_inode(self):
+        """Test identical files of different trees become links to one object"""
+        first = self.make_tree('r1', {'index.html': 'same', 'app.js': 'v1', 'empty': ''})
+        second = self.make_tree('r2', {'index.html': 'same', 'app.js': 'v2', 'static/copy.html': 'same'})
+
+        stats = self.store.add_tree(first)
+        self.assertEqual(stats, {'files': 2, 'linked': 0, 'stored': 2, 'bytes_saved': 0})
+        stats = self.store.add_tree(second)
+        self.assertEqual(stats, {'files': 3, 'linked': 2, 'stored': 1, 'bytes_saved': 8})
+
+        self.assertTrue(os.path.samefile(os.path.join(first, 'index.html'), os.path.join(second, 'index.html')))
+        self.assertTrue(os.path.samefile(os.path.join(first, 'index.html'),
+                                       os.path.join(second, 'static', 'copy.html')))
+        self.assertFalse(os.path.samefile(os.path.join(first, 'app.js'), os.path.join(second, 'app.js')))
+        with open(os.path.join(second, 'app.js')) as f:
+            self.assertEqual(f.read(), 'v2')
+        # Adding a tree again changes nothing
+        self.assertEqual(self.store.add_tree(second)['linked'], 0)
+
+    def test_modes_and_excludes(self):
+        """Test permissions are kept and runtime-written directories skipped"""
+        first = self.make_tree('r1', {'run.sh': 'echo', 'node_modules/a.js': 'x'})
+        second = self.make_tree('r2', {'run.sh': 'echo', 'node_modules/a.js': 'x'})
+        os.chmod(os.path.join(first, 'run.sh'), 0o755)
+        os.chmod(os.path.join(second, 'run.sh'), 0o644)
+
+        self.store.add_tree(first)
+        self.assertEqual(self.store.add_tree(second)['linked'], 0)
+        # Stored files are read-only
+        self.assertEqual(os.stat(os.path.join(first, 'run.sh')).st_mode & 0o777, 0o555)
+        self.assertEqual(os.stat(os.path.join(second, 'run.sh')).st_mode & 0o777, 0o444)
+        self.assertEqual(os.stat(os.path.join(second, 'node_modules', 'a.js')).st_nlink, 1)
+
+    def test_changed_object_not_linked(self):
+        """Test an object whose content no longer matches its digest is replaced"""
+        first = self.make_tree('r1', {'data.json': 'aaaa'})
+        self.store.add_tree(first)
+        path = os.path.join(first, 'data.json')
+        os.chmod(path, 0o644)
+        with open(path, 'w') as f:
+            f.write('bbbb')
+        os.chmod(path, 0o444)
+
+        second = self.make_tree('r2', {'data.json': 'aaaa'})
+        self.assertEqual(self.store.add_tree(second), {'files': 1, 'linked': 0, 'stored': 1, 'bytes_saved': 0})
+        with open(os.path.join(second, 'data.json')) as f:
+            self.assertEqual(f.read(), 'aaaa')
+        self.assertFalse(os.path.samefile(path, os.path.join(second, 'data.json')))
+
+    def test_collect_unreferenced_objects(self):
+        """Test objects are removed once no tree links to them"""
+        first = self.make_tree('r1', {'index.html': 'same', 'app.js': 'v1'})
+        second = self.make_tree('r2', {'index.html': 'same', 'app.js': 'v2'})
+        self.store.add_tree(first)
+        self.store.add_tree(second)
+        self.assertEqual(self.store.collect(), {'objects': 0, 'bytes': 0})
+
+        shutil.rmtree(first)
+        self.assertEqual(self.store.collect(), {'objects': 1, 'bytes': 2})
+        with open(os.path.join(second, 'index.html')) as f:
+            self.assertEqual(f.read(), 'same')
+        shutil.rmtree(second)
+        self.assertEqual(self.store.collect()['objects'], 2)
@@ -4,11 +4,18 @@ import os
 import tempfile
 import shutil
 import subprocess
-from dynapsys.git import clone_git_repo, is_valid_git_url, check_git_installation
+from dynapsys.config import config
+from dynapsys.git import (
+    GitProgress, build_clone_command, check_git_installation, clone_git_repo, clone_options, is_valid_git_url,
+    head_commit, mirror_path, normalize_git_url, resolve_commit
+)
 
 class TestGitOperations(unittest.TestCase):
     def setUp(self):
         self.test_dir = tempfile.mkdtemp()
+        self.mirrors_dir = tempfile.mkdtemp()
+        self.config_patch = patch.dict(config._config, {'GIT_MIRRORS_DIR': self.mirrors_dir})
+        self.config_patch.start()
         self.valid_urls = [
             'https://github.com/user/repo.git',
             'https://github.com/user/repo',
@@ -31,7 +38,28 @@ class TestGitOperations(unittest.TestCase):
         ]
 
     def tearDown(self):
+        self.config_patch.stop()
         shutil.rmtree(self.test_dir)
+        shutil.rmtree(self.mirrors_dir)
+
+    def git(self, *args, cwd=None):
+        """Run git with a fixed identity"""
+        subprocess.run(['git', '-c', 'user.name=t', '-c', 'user.email=t@t'] + list(args),
+                       cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def commit_file(self, repo, name, content):
+        """Commit a file to a test repository"""
+        with open(os.path.join(repo, name), 'w') as f:
+            f.write(content)
+        self.git('add', name, cwd=repo)
+        self.git('commit', '-q', '-m', f'update {name}', cwd=repo)
+
+    def make_origin(self):
+        """Create a repository to clone from"""
+        origin = os.path.join(self.test_dir, 'origin')
+        os.makedirs(origin)
+        self.git('init', '-q', '-b', 'main', cwd=origin)
+        return origin
 
     def test_valid_git_urls(self):
         """Test validation of valid Git URLs"""
@@ -174,6 +202,168 @@ class TestGitOperations(unittest.TestCase):
                 "Parent directories should be created"
             )
 
+    def test_build_clone_command(self):
+        """Test command lines of the clone strategies"""
+        url = 'https://github.com/user/repo.git'
+        self.assertEqual(build_clone_command(url, '/t'), ['git', 'clone', '--progress', '--', url, '/t'])
+        self.assertEqual(
+            build_clone_command(url, '/t', mode='shallow', depth=5),
+            ['git', 'clone', '--progress', '--depth', '5', '--', url, '/t']
+        )
+        self.assertEqual(
+            build_clone_command(url, '/t', mode='partial', ref='release/1.0'),
+            ['git', 'clone', '--progress', '--filter=blob:none', '--single-branch', '--branch', 'release/1.0', '--', url, '/t']
+        )
+        with self.assertRaises(ValueError):
+            build_clone_command(url, '/t', mode='bogus')
+
+    def test_clone_options(self):
+        """Test validation of clone options from deploy requests"""
+        self.assertEqual(clone_options({'source': 'x'}), {})
+        self.assertEqual(
+            clone_options({'clone': 'shallow', 'ref': 'v1.2.0', 'depth': 3}),
+            {'mode': 'shallow', 'ref': 'v1.2.0', 'depth': 3}
+        )
+        self.assertEqual(clone_options({'commit': 'a' * 40}), {'commit': 'a' * 40})
+        self.assertEqual(
+            clone_options({'subdir': 'apps/web/', 'sparse': ['packages/ui'], 'submodules': 1}),
+            {'sparse_paths': ['apps/web', 'packages/ui'], 'submodules': True}
+        )
+        for params in ({'clone': 'deep'}, {'commit': 'abc1234'}, {'subdir': '../etc'},
+                       {'subdir': '/abs'}, {'subdir': 'apps', 'sparse': ['a/../b']}, {'sparse': ['lib']}, {'ref': '--upload-pack=evil'}, {'ref': 'a..b'},
+                       {'depth': 0}, {'depth': '1'}, {'depth': True}):
+            with self.assertRaises(ValueError):
+                clone_options(params)
+
+    def test_shallow_clone_of_branch(self):
+        """Test a shallow single-branch clone of a real repository"""
+        origin = self.make_origin()
+        for i in range(3):
+            self.commit_file(origin, 'file.txt', str(i))
+        self.git('checkout', '-q', '-b', 'feature', cwd=origin)
+        self.commit_file(origin, 'feature.txt', 'feature')
+
+        target = os.path.join(self.test_dir, 'clone')
+        self.assertTrue(clone_git_repo(f'file://{origin}', target, mode='shallow', ref='feature'))
+        self.assertTrue(os.path.exists(os.path.join(target, 'feature.txt')))
+        count = subprocess.check_output(['git', 'rev-list', '--count', 'HEAD'], cwd=target)
+        self.assertEqual(count.strip(), b'1')
+
+    def test_progress_parsing(self):
+        """Test git --progress lines become structured metrics"""
+        updates = []
+        progress = GitProgress(updates.append)
+        progress.feed('remote: Counting objects:  50% (5/10)')
+        progress.feed('Cloning into bare repository...')
+        progress.feed('Receiving objects:  45% (450/1000), 1.50 MiB | 512.00 KiB/s')
+        progress.feed('Resolving deltas: 100% (20/20), done.')
+
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(updates[0]['phase'], 'counting_objects')
+        self.assertEqual(updates[1], {
+            'phase': 'receiving_objects', 'percent': 45, 'objects': 450,
+            'total_objects': 1000, 'bytes': 1572864, 'bytes_per_second': 524288,
+        })
+        self.assertEqual(updates[2]['phase'], 'resolving_deltas')
+        self.assertEqual(updates[2]['percent'], 100)
+        self.assertEqual(updates[2]['bytes'], 1572864)
+
+    def test_normalize_git_url(self):
+        """Test equivalent repository URLs share a cache key"""
+        for url in ('https://github.com/User/repo.git', 'https://GitHub.com/User/repo/',
+                    'git@github.com:User/repo.git', 'http://github.com/User/repo'):
+            self.assertEqual(normalize_git_url(url), 'github.com/User/repo')
+        self.assertEqual(mirror_path('https://github.com/User/repo.git'),
+                         mirror_path('git@github.com:User/repo'))
+        self.assertNotEqual(mirror_path('https://github.com/User/repo'),
+                            mirror_path('https://gitlab.com/User/repo'))
+
+    def test_clone_through_mirror(self):
+        """Test repeat clones fetch into the mirror and check out from it"""
+        origin = self.make_origin()
+        self.commit_file(origin, 'file.txt', 'v1')
+        url = f'file://{origin}'
+
+        first = os.path.join(self.test_dir, 'first')
+        self.assertTrue(clone_git_repo(url, first, mode='full'))
+        self.assertTrue(os.path.isdir(mirror_path(url)))
+
+        self.commit_file(origin, 'file.txt', 'v2')
+        second = os.path.join(self.test_dir, 'second')
+        updates = []
+        self.assertTrue(clone_git_repo(url, second, mode='shallow', on_progress=updates.append))
+        self.assertTrue(updates)
+        self.assertEqual(updates[-1]['percent'], 100)
+        with open(os.path.join(second, 'file.txt')) as f:
+            self.assertEqual(f.read(), 'v2')
+        remote = subprocess.check_output(['git', 'remote', 'get-url', 'origin'], cwd=second)
+        self.assertEqual(remote.decode().strip(), url)
+
+    def test_resolve_and_pin_commit(self):
+        """Test refs resolve to commits and checkouts can be pinned to one"""
+        origin = self.make_origin()
+        self.commit_file(origin, 'app.js', 'v1')
+        first = head_commit(origin)
+        self.git('tag', '-a', '-m', 'release', 'v1', cwd=origin)
+        self.commit_file(origin, 'app.js', 'v2')
+        second = head_commit(origin)
+        url = f'file://{origin}'
+
+        self.assertEqual(resolve_commit(url), second)
+        self.assertEqual(resolve_commit(url, 'v1'), first)
+        self.assertEqual(resolve_commit(url, 'v1', use_mirror=False), first)
+        self.assertEqual(resolve_commit(url, use_mirror=False), second)
+        self.assertIsNone(resolve_commit(url, 'missing'))
+
+        target = os.path.join(self.test_dir, 'site')
+        self.assertTrue(clone_git_repo(url, target, mode='shallow', commit=first))
+        self.assertEqual(head_commit(target), first)
+        self.assertTrue(clone_git_repo(url, target, commit=second))
+        self.assertEqual(head_commit(target), second)
+        self.assertTrue(clone_git_repo(url, target, commit=first, use_mirror=False))
+        self.assertEqual(head_commit(target), first)
+
+    def test_sparse_checkout(self):
+        """Test only the app and shared packages of a monorepo are checked out"""
+        origin = self.make_origin()
+        for path in ('apps/web', 'apps/api', 'packages/ui'):
+            os.makedirs(os.path.join(origin, path))
+            self.commit_file(origin, os.path.join(path, 'index.js'), path)
+        self.commit_file(origin, 'package.json', '{}')
+        url = f'file://{origin}'
+        target = os.path.join(self.test_dir, 'site')
+
+        sparse = ['apps/web', 'packages/ui']
+        self.assertTrue(clone_git_repo(url, target, mode='partial', sparse_paths=sparse))
+        self.assertTrue(os.path.exists(os.path.join(target, 'apps', 'web', 'index.js')))
+        self.assertTrue(os.path.exists(os.path.join(target, 'packages', 'ui', 'index.js')))
+        self.assertTrue(os.path.exists(os.path.join(target, 'package.json')))
+        self.assertFalse(os.path.exists(os.path.join(target, 'apps', 'api')))
+
+        # Updating without a subdir brings back the whole tree
+        self.assertTrue(clone_git_repo(url, target, mode='partial'))
+        self.assertTrue(os.path.exists(os.path.join(target, 'apps', 'api', 'index.js')))
+
+    def test_submodules(self):
+        """Test submodules are checked out when requested"""
+        library = os.path.join(self.test_dir, 'library')
+        os.makedirs(library)
+        self.git('init', '-q', '-b', 'main', cwd=library)
+        self.commit_file(library, 'lib.js', 'lib')
+        origin = self.make_origin()
+        # Local submodule URLs are refused by default since git 2.38.1
+        environ = {'GIT_CONFIG_COUNT': '1', 'GIT_CONFIG_KEY_0': 'protocol.file.allow',
+                   'GIT_CONFIG_VALUE_0': 'always'}
+        with patch.dict(os.environ, environ):
+            self.git('submodule', 'add', '-q', f'file://{library}', 'vendor/library', cwd=origin)
+            self.git('commit', '-q', '-m', 'add submodule', cwd=origin)
+
+            target = os.path.join(self.test_dir, 'site')
+            self.assertTrue(clone_git_repo(f'file://{origin}', target, submodules=False))
+            self.assertFalse(os.path.exists(os.path.join(target, 'vendor', 'library', 'lib.js')))
+            self.assertTrue(clone_git_repo(f'file://{origin}', target, submodules=True))
+            self.assertTrue(os.path.exists(os.path.join(target, 'vendor', 'library', 'lib.js')))
+
     @patch('subprocess.Popen')
     def test_clone_git_repo_subprocess_exception(self, mock_popen):
         """Test handling of subprocess exceptions"""
@@ -0,0 +1,210 @@
+import unittest
+import logging
+import shutil
+import tempfile
+import threading
+from dynapsys.jobs import (
+    DeploymentJob, JobIndex, JobQueue, SUCCEEDED, FAILED, QUEUED, SUPERSEDED
+)
+
+class TestJobQueue(unittest.TestCase):
+    def test_job_defaults(self):
+        """Test new job state"""
+        job = DeploymentJob('test.com', {'source': 'x'})
+        self.assertEqual(job.status, QUEUED)
+        self.assertFalse(job.finished)
+        data = job.to_dict()
+        self.assertEqual(data['domain'], 'test.com')
+        self.assertEqual(data['id'], job.id)
+        self.assertNotIn('progress', data)
+
+        job.set_stage('source')
+        job.set_progress({'phase': 'receiving_objects', 'percent': 40})
+        progress = job.to_dict()['progress']
+        self.assertEqual(progress['percent'], 40)
+        self.assertEqual(progress['stage'], 'source')
+
+    def test_successful_job(self):
+        """Test job executed by a worker"""
+        queue = JobQueue(lambda job: True, workers=1)
+        job = DeploymentJob('test.com', {'source': 'data:...', 'cf_token': 'secret', 'ref': 'main'})
+        self.assertTrue(queue.submit(job))
+        queue.join()
+        self.assertEqual(job.status, SUCCEEDED)
+        self.assertIsNotNone(job.finished_at)
+        # Finished jobs in the history keep neither archives nor tokens
+        self.assertEqual(job.params, {'ref': 'main'})
+
+    def test_failed_and_crashing_jobs(self):
+        """Test failures and exceptions are recorded on the job"""
+        def runner(job):
+            if job.domain == 'crash.com':
+                raise RuntimeError('boom')
+            return job.fail('Build failed')
+
+        queue = JobQueue(runner, workers=2)
+        failed = DeploymentJob('fail.com', {})
+        crashed = DeploymentJob('crash.com', {})
+        queue.submit(failed)
+        queue.submit(crashed)
+        queue.join()
+        self.assertEqual(failed.status, FAILED)
+        self.assertEqual(failed.error, 'Build failed')
+        self.assertEqual(crashed.status, FAILED)
+        self.assertEqual(crashed.error, 'boom')
+
+    def test_queue_full(self):
+        """Test submissions are rejected when the queue is full"""
+        release = threading.Event()
+        started = threading.Event()
+
+        def runner(job):
+            started.set()
+            release.wait(5)
+            return True
+
+        queue = JobQueue(runner, workers=1, max_queued=1)
+        self.assertTrue(queue.submit(DeploymentJob('a.com', {})))
+        started.wait(5)
+        self.assertTrue(queue.submit(DeploymentJob('b.com', {})))
+        self.assertFalse(queue.submit(DeploymentJob('c.com', {})))
+        release.set()
+        queue.join()
+
+    def test_stages_and_log_tail(self):
+        """Test stage timings and log lines are recorded per job"""
+        def runner(job):
+            job.set_stage('build')
+            logging.warning('building things')
+            job.set_stage('dns')
+            return True
+
+        queue = JobQueue(runner, workers=1)
+        job = DeploymentJob('test.com', {}, log_lines=50)
+        queue.submit(job)
+        queue.join()
+
+        self.assertEqual([stage['name'] for stage in job.stages], ['build', 'dns'])
+        self.assertTrue(all(stage['finished_at'] for stage in job.stages))
+        self.assertTrue(any('building things' in line for line in job.log))
+        data = job.to_dict(log_lines=1)
+        self.assertEqual(len(data['log']), 1)
+        self.assertNotIn('log', job.to_dict())
+
+    def test_log_file_and_followers(self):
+        """Test job output is written to a log file and can be followed"""
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+
+        def runner(job):
+            logging.warning('npm: added 12 packages')
+            return True
+
+        queue = JobQueue(runner, workers=1, log_dir=log_dir)
+        job = DeploymentJob('test.com', {})
+        queue.submit(job)
+        queue.join()
+
+        self.assertTrue(job.log_closed)
+        self.assertEqual(job.to_dict()['log_file'], job.log_path)
+        with open(job.log_path) as f:
+            self.assertIn('npm: added 12 packages', f.read())
+
+        lines, cursor = job.read_log(0, timeout=1)
+        self.assertEqual(cursor, job.log_seq)
+        self.assertTrue(any('added 12 packages' in line for line in lines))
+        self.assertEqual(job.read_log(cursor, timeout=1), ([], cursor))
+
+    def test_read_log_waits_for_lines(self):
+        """Test followers are woken up by new lines and skip evicted ones"""
+        job = DeploymentJob('test.com', {}, log_lines=2)
+        timer = threading.Timer(0.05, job.append_log, args=('late line',))
+        timer.start()
+        self.assertEqual(job.read_log(0, timeout=5), (['late line'], 1))
+
+        for i in range(3):
+            job.append_log(f'line {i}')
+        self.assertEqual(job.read_log(1, timeout=1), (['line 1', 'line 2'], 4))
+
+        job.close_log()
+        self.assertEqual(job.read_log(4), ([], 4))
+
+    def test_same_domain_requests_coalesce(self):
+        """Test queued requests for a busy domain collapse into the latest one"""
+        release = threading.Event()
+        started = threading.Event()
+        ran = []
+
+        def runner(job):
+            ran.append(job)
+            started.set()
+            release.wait(5)
+            return True
+
+        queue = JobQueue(runner, workers=2)
+        first = DeploymentJob('a.com', {})
+        queue.submit(first)
+        started.wait(5)
+
+        followups = [DeploymentJob('a.com', {}) for _ in range(3)]
+        for job in followups:
+            self.assertTrue(queue.submit(job))
+        self.assertEqual(queue.qsize(), 1)
+
+        release.set()
+        queue.join()
+
+        self.assertEqual(ran, [first, followups[-1]])
+        self.assertEqual(followups[0].status, SUPERSEDED)
+        self.assertEqual(followups[0].superseded_by, followups[1].id)
+        self.assertEqual(followups[1].status, SUPERSEDED)
+        self.assertEqual(followups[-1].status, SUCCEEDED)
+
+    def test_domains_never_build_concurrently(self):
+        """Test a domain is built by at most one worker at a time"""
+        active = {}
+        overlaps = []
+        lock = threading.Lock()
+
+        def runner(job):
+            with lock:
+                if active.get(job.domain):
+                    overlaps.append(job.domain)
+                active[job.domain] = True
+            threading.Event().wait(0.01)
+            with lock:
+                active[job.domain] = False
+            return True
+
+        queue = JobQueue(runner, workers=4)
+        for i in range(20):
+            queue.submit(DeploymentJob(f'site{i % 2}.com', {}))
+        queue.join()
+        self.assertEqual(overlaps, [])
+
+class TestJobIndex(unittest.TestCase):
+    def test_ring_buffer_eviction(self):
+        """Test the oldest jobs are dropped once the index is full"""
+        index = JobIndex(max_jobs=3)
+        jobs = [DeploymentJob(f'site{i}.com', {}) for i in range(5)]
+        for job in jobs:
+            index.add(job)
+
+        self.assertEqual(len(index), 3)
+        self.assertIsNone(index.get(jobs[0].id))
+        self.assertIs(index.get(jobs[4].id), jobs[4])
+
+    def test_find_by_domain(self):
+        """Test lookups by domain return newest jobs first"""
+        index = JobIndex()
+        first = DeploymentJob('a.com', {})
+        other = DeploymentJob('b.com', {})
+        second = DeploymentJob('a.com', {})
+        for job in (first, other, second):
+            index.add(job)
+
+        self.assertEqual(index.find(domain='a.com'), [second, first])
+        self.assertEqual(index.find(limit=1), [second])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import io
+import os
+import json
+import hashlib
+import tempfile
+import shutil
+from dynapsys.blobs import BlobStore
+from dynapsys.manifest import (
+    MANIFEST_FILE,
+    build_manifest,
+    validate_manifest,
+    missing_files,
+    assemble_tree
+)
+from dynapsys.uploads import UploadError
+
+def write(root, path, data):
+    full_path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'wb') as f:
+        f.write(data)
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.project = os.path.join(self.temp_dir, 'project')
+        self.previous = os.path.join(self.temp_dir, 'previous')
+        self.store = BlobStore(os.path.join(self.temp_dir, 'blobs'))
+        write(self.project, 'package.json', b'{}')
+        write(self.project, 'src/app.js', b'new app')
+        write(self.project, 'node_modules/dep/index.js', b'ignored')
+        write(self.previous, 'package.json', b'{}')
+        write(self.previous, 'src/app.js', b'old app')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_build_manifest(self):
+        """Test manifests list regular files with their hashes"""
+        entries = build_manifest(self.project)
+        self.assertEqual([entry['path'] for entry in entries], ['package.json', 'src/app.js'])
+        self.assertEqual(entries[1]['sha256'], hashlib.sha256(b'new app').hexdigest())
+        self.assertEqual(entries[1]['size'], 7)
+
+    def test_validate_manifest(self):
+        """Test unsafe or malformed manifests are rejected"""
+        digest = '0' * 64
+        validate_manifest([{'path': 'a/b.js', 'size': 1, 'sha256': digest}])
+        for entries in (
+            'not a list',
+            [{'path': '../escape', 'size': 1, 'sha256': digest}],
+            [{'path': '/abs', 'size': 1, 'sha256': digest}],
+            [{'path': 'a', 'size': 1, 'sha256': 'bad'}],
+            [{'path': 'a', 'size': -1, 'sha256': digest}],
+            [{'path': 'a', 'size': 1, 'sha256': digest}, {'path': 'a', 'size': 1, 'sha256': digest}],
+        ):
+            with self.assertRaises(UploadError):
+                validate_manifest(entries)
+
+    def test_missing_files_and_assembly(self):
+        """Test only changed files are requested and the tree is rebuilt"""
+        entries = build_manifest(self.project)
+        self.assertEqual(missing_files(entries, self.previous, self.store), ['src/app.js'])
+
+        data = b'new app'
+        self.store.put_stream(io.BytesIO(data), len(data))
+        self.assertEqual(missing_files(entries, self.previous, self.store), [])
+
+        target = os.path.join(self.temp_dir, 'assembled')
+        stats = assemble_tree(entries, self.previous, self.store, target)
+        self.assertEqual(stats, {'reused': 1, 'uploaded': 1})
+        with open(os.path.join(target, 'src', 'app.js'), 'rb') as f:
+            self.assertEqual(f.read(), b'new app')
+
+        # The written manifest is reused as index for the next sync
+        with open(os.path.join(target, MANIFEST_FILE)) as f:
+            self.assertEqual(json.load(f), entries)
+        self.assertEqual(missing_files(entries, target, BlobStore(self.temp_dir + '/empty')), [])
+
+    def test_assembly_with_missing_content(self):
+        """Test assembly fails when content was never uploaded"""
+        entries = build_manifest(self.project)
+        with self.assertRaises(UploadError):
+            assemble_tree(entries, self.previous, self.store, os.path.join(self.temp_dir, 'out'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import os
+import shutil
+import tempfile
+from dynapsys.releases import ReleaseStore
+
+class TestReleaseStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = ReleaseStore(os.path.join(self.temp_dir, 'sites'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_release(self, release_id, content=''):
+        path = self.store.path('test.com', release_id)
+        os.makedirs(path)
+        with open(os.path.join(path, 'index.html'), 'w') as f:
+            f.write(content or release_id)
+        return path
+
+    def test_unknown_domain(self):
+        """Test domains never deployed have no releases"""
+        self.assertEqual(self.store.list('test.com'), [])
+        self.assertIsNone(self.store.current('test.com'))
+        self.assertIsNone(self.store.current_path('test.com'))
+        self.assertIsNone(self.store.previous('test.com'))
+        self.assertIsNone(self.store.live_dir('test.com'))
+
+    def test_new_ids_sort_by_creation(self):
+        """Test release ids are unique and ordered by time"""
+        first, second = ReleaseStore.new_id(), ReleaseStore.new_id()
+        self.assertNotEqual(first, second)
+        self.assertLessEqual(first[:15], second[:15])
+
+    def test_activate_switches_symlink(self):
+        """Test the current symlink points at the activated release"""
+        self.make_release('r1')
+        self.make_release('r2')
+        self.assertIsNone(self.store.activate('test.com', 'r1'))
+        self.assertEqual(self.store.activate('test.com', 'r2'), 'r1')
+
+        link = self.store.current_link('test.com')
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(os.readlink(link), os.path.join('releases', 'r2'))
+        with open(os.path.join(link, 'index.html')) as f:
+            self.assertEqual(f.read(), 'r2')
+        self.assertEqual(self.store.current('test.com'), 'r2')
+        self.assertEqual(self.store.previous('test.com'), 'r1')
+        self.assertEqual(self.store.live_dir('test.com'), self.store.path('test.com', 'r2'))
+        # No temporary links are left behind
+        self.assertEqual(sorted(os.listdir(self.store.site_dir('test.com'))), ['current', 'releases'])
+
+        with self.assertRaises(ValueError):
+            self.store.activate('test.com', 'r3')
+        self.assertEqual(self.store.current('test.com'), 'r2')
+
+    def test_lock_excludes_other_holders(self):
+        """Test the release lock of a domain is exclusive across open files"""
+        with self.store.lock('test.com'):
+            self.assertIsNone(self.store.lock('test.com', blocking=False))
+            other = self.store.lock('other.com', blocking=False)
+            self.assertIsNotNone(other)
+            other.close()
+        with self.store.lock('test.com', blocking=False) as lock:
+            self.assertIsNotNone(lock)
+        # Lock files never make a site look like a plain checkout
+        self.assertIsNone(self.store.live_dir('test.com'))
+
+    def test_previous_of_oldest_release(self):
+        """Test there is nothing to roll back to from the oldest release"""
+        self.make_release('r1')
+        self.make_release('r2')
+        self.store.activate('test.com', 'r1')
+        self.assertIsNone(self.store.previous('test.com'))
+        self.assertEqual(self.store.list('test.com'), ['r1', 'r2'])
+
+    def test_migrate_plain_checkout(self):
+        """Test sites deployed before releases become their first release"""
+        site_dir = self.store.site_dir('test.com')
+        os.makedirs(site_dir)
+        with open(os.path.join(site_dir, 'package.json'), 'w') as f:
+            f.write('{}')
+        self.assertEqual(self.store.live_dir('test.com'), site_dir)
+
+        release_id = self.store.migrate('test.com')
+        self.assertEqual(self.store.list('test.com'), [release_id])
+        self.assertEqual(self.store.current('test.com'), release_id)
+        self.assertTrue(os.path.exists(os.path.join(self.store.current_link('test.com'), 'package.json')))
+        self.assertIsNone(self.store.migrate('test.com'))
@@ -0,0 +1,160 @@
+import unittest
+import io
+import os
+import time
+import shutil
+import tempfile
+import threading
+from dynapsys.blobs import BlobStore
+from dynapsys.releases import ReleaseStore
+from dynapsys.retention import RetentionCollector, RetentionPolicy
+from dynapsys.sites import SiteStateStore
+
+DAY = 86400
+
+class TestRetentionPolicy(unittest.TestCase):
+    def setUp(self):
+        now = time.time()
+        # Newest first: a (today) ... e (four days old)
+        self.entries = [(name, now - index * DAY) for index, name in enumerate('abcde')]
+
+    def test_keep_count(self):
+        """Test only the newest entries are kept"""
+        self.assertEqual(RetentionPolicy(keep=2).select(reversed(self.entries)), ['c', 'd', 'e'])
+        self.assertEqual(RetentionPolicy().select(self.entries), [])
+
+    def test_max_age(self):
+        """Test expired entries are deleted but the newest one survives"""
+        self.assertEqual(RetentionPolicy(max_age=2.5 * DAY).select(self.entries), ['d', 'e'])
+        old = [(name, created - 30 * DAY) for name, created in self.entries]
+        self.assertEqual(RetentionPolicy(max_age=DAY).select(old), ['b', 'c', 'd', 'e'])
+
+    def test_size_budget(self):
+        """Test the oldest entries go once the group exceeds its budget"""
+        sizes = {'a': 40, 'b': 40, 'c': 10, 'd': 10, 'e': 10}
+        policy = RetentionPolicy(max_bytes=95)
+        self.assertEqual(policy.select(self.entries, size_of=sizes.get), ['d', 'e'])
+
+    def test_protected_entries_count_but_survive(self):
+        """Test the live release is never deleted and counts against the limits"""
+        policy = RetentionPolicy(keep=2)
+        self.assertEqual(policy.select(self.entries, protected=['d']), ['c', 'e'])
+
+
+class TestRetentionCollector(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.releases = ReleaseStore(os.path.join(self.temp_dir, 'sites'))
+        self.state = SiteStateStore(os.path.join(self.temp_dir, 'state'))
+        self.www_dir = os.path.join(self.temp_dir, 'www')
+        self.caddy_dir = os.path.join(self.temp_dir, 'caddy')
+        self.locks = {}
+        self.collector = RetentionCollector(
+            self.releases.sites_dir, [self.www_dir, self.caddy_dir], RetentionPolicy(keep=2),
+            site_state=self.state, domain_lock=lambda domain: self.locks.setdefault(domain, threading.Lock())
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_releases(self, *release_ids):
+        for release_id in release_ids:
+            os.makedirs(self.releases.path('test.com', release_id))
+        self.state.update('test.com', releases={release_id: {} for release_id in release_ids})
+
+    def test_old_releases_removed(self):
+        """Test releases beyond the policy are deleted, never the live one"""
+        ids = ['20240101-000000-000001', '20240102-000000-000001',
+               '20240103-000000-000001', '20240104-000000-000001']
+        self.make_releases(*ids)
+        self.releases.activate('test.com', ids[0])
+
+        self.assertEqual(self.collector.collect(dry_run=True), [self.releases.path('test.com', ids[1])])
+        self.assertEqual(self.releases.list('test.com'), ids)
+
+        # The two newest releases and the live one are kept
+        self.collector.collect()
+        kept = [ids[0], ids[2], ids[3]]
+        self.assertEqual(self.releases.list('test.com'), kept)
+        self.assertEqual(sorted(self.state.get('test.com')['releases']), kept)
+        self.assertEqual(sorted(os.listdir(self.releases.releases_dir('test.com'))), kept)
+
+    def test_domain_being_deployed_is_skipped(self):
+        """Test releases are left alone while the domain's deployment lock is held"""
+        ids = ['20240101-000000-000001', '20240102-000000-000001', '20240103-000000-000001']
+        self.make_releases(*ids)
+        with self.locks.setdefault('test.com', threading.Lock()):
+            self.assertEqual(self.collector.collect(), [])
+        # Deployments and rollbacks of other processes hold the release lock
+        with self.releases.lock('test.com'):
+            self.assertEqual(self.collector.collect(), [])
+        self.assertEqual(len(self.collector.collect()), 1)
+
+    def test_backups_grouped_by_origin(self):
+        """Test app and Caddyfile backups are pruned per app, other files untouched"""
+        os.makedirs(os.path.join(self.www_dir, 'example.com'))
+        for stamp in ('20240101_000000', '20240102_000000', '20240103_000000'):
+            os.makedirs(os.path.join(self.www_dir, f'example.com_backup_{stamp}'))
+            os.makedirs(os.path.join(self.www_dir, f'other.com_backup_{stamp}'))
+        os.makedirs(os.path.join(self.www_dir, 'other.com_backup_20240104_000000'))
+        os.makedirs(self.caddy_dir)
+        for name in ('Caddyfile', 'Caddyfile.backup_20240101_000000', 'Caddyfile.backup_20240102_000000',
+                     'Caddyfile.backup_20240103_000000'):
+            with open(os.path.join(self.caddy_dir, name), 'w') as f:
+                f.write(name)
+        # Left over by an interrupted pass
+        os.makedirs(os.path.join(self.www_dir, '.trash-old.com_backup_20230101_000000'))
+
+        self.assertEqual(len(self.collector.collect()), 4)
+        self.assertEqual(sorted(os.listdir(self.www_dir)), [
+            'example.com', 'example.com_backup_20240102_000000', 'example.com_backup_20240103_000000',
+            'other.com_backup_20240103_000000', 'other.com_backup_20240104_000000'
+        ])
+        self.assertEqual(sorted(os.listdir(self.caddy_dir)), [
+            'Caddyfile', 'Caddyfile.backup_20240102_000000', 'Caddyfile.backup_20240103_000000'
+        ])
+
+    def test_job_logs_pruned_per_domain(self):
+        """Test job logs are pruned per domain by the same policy"""
+        logs_dir = os.path.join(self.temp_dir, 'logs')
+        os.makedirs(logs_dir)
+        names = []
+        for index in range(3):
+            for domain in ('test.com', 'other-site.com'):
+                name = f'{domain}-{index:032x}.log'
+                path = os.path.join(logs_dir, name)
+                with open(path, 'w') as f:
+                    f.write('line')
+                os.utime(path, (1000 + index, 1000 + index))
+                names.append(name)
+        with open(os.path.join(logs_dir, 'notes.txt'), 'w') as f:
+            f.write('kept')
+        self.collector.job_logs_dir = logs_dir
+
+        self.assertEqual(len(self.collector.collect()), 2)
+        self.assertEqual(sorted(os.listdir(logs_dir)), sorted(['notes.txt'] + names[2:]))
+
+    def test_unused_blobs_removed(self):
+        """Test blobs past their maximum age are removed by a pass"""
+        store = BlobStore(os.path.join(self.temp_dir, 'blobs'))
+        digest = store.put_stream(io.BytesIO(b'archive'), 7)
+        os.utime(store.path(digest), (1000, 1000))
+        self.collector.blob_store = store
+        self.assertEqual(self.collector.collect(), [])
+
+        self.collector.blob_max_age = 3600
+        self.assertEqual(self.collector.collect(), [store.path(digest)])
+        self.assertFalse(store.exists(digest))
+
+    def test_background_pass_on_trigger(self):
+        """Test the background thread runs a pass when triggered"""
+        self.collector.interval = 60
+        self.make_releases('20240101-000000-000001', '20240102-000000-000001')
+        self.collector.start()
+        os.makedirs(self.releases.path('test.com', '20240103-000000-000001'))
+        self.collector.trigger()
+        deadline = time.time() + 5
+        while len(self.releases.list('test.com')) > 2 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.releases.list('test.com'),
+                         ['20240102-000000-000001', '20240103-000000-000001'])
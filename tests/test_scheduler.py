@@ -0,0 +1,102 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from dynapsys.scheduler import MEMORY_HEADROOM, BuildScheduler
+
+GIB = 1024 ** 3
+
+class FakeMemory:
+    def __init__(self, available):
+        self.available = available
+
+class TestBuildScheduler(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.history_path = os.path.join(self.temp_dir, 'build-memory.json')
+        self.scheduler = BuildScheduler(self.history_path, default_estimate=GIB,
+                                        reserve=0, max_load=1.0, poll_interval=0.05)
+        self.memory_patch = patch('dynapsys.scheduler.psutil.virtual_memory',
+                                  return_value=FakeMemory(int(2.5 * GIB)))
+        self.load_patch = patch('dynapsys.scheduler.os.getloadavg', return_value=(0.1, 0.1, 0.1))
+        self.memory_patch.start()
+        self.load_patch.start()
+
+    def tearDown(self):
+        self.load_patch.stop()
+        self.memory_patch.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def test_estimate_learned_from_peaks(self):
+        """Test estimates come from recorded peaks with headroom"""
+        self.assertEqual(self.scheduler.estimate('test.com'), GIB)
+        self.scheduler.record('test.com', 400 * 1024 ** 2)
+        self.scheduler.record('test.com', 200 * 1024 ** 2)
+        self.assertEqual(self.scheduler.estimate('test.com'), int(400 * 1024 ** 2 * MEMORY_HEADROOM))
+
+        with open(self.history_path) as f:
+            self.assertEqual(len(json.load(f)['test.com']), 2)
+        reloaded = BuildScheduler(self.history_path, GIB, 0, 1.0)
+        self.assertEqual(reloaded.estimate('test.com'), self.scheduler.estimate('test.com'))
+
+        for _ in range(10):
+            self.scheduler.record('test.com', 100)
+        self.assertEqual(self.scheduler.estimate('test.com'), int(100 * MEMORY_HEADROOM))
+
+    def test_record_unwritable_history(self):
+        """Test a history path that cannot be written only loses persistence"""
+        blocker = os.path.join(self.temp_dir, 'blocker')
+        open(blocker, 'w').close()
+        scheduler = BuildScheduler(os.path.join(blocker, 'build-memory.json'), GIB, 0, 1.0)
+        scheduler.record('test.com', 400 * 1024 ** 2)
+        self.assertEqual(scheduler.estimate('test.com'), int(400 * 1024 ** 2 * MEMORY_HEADROOM))
+
+    def test_waits_for_memory(self):
+        """Test builds that do not fit wait until a running build finishes"""
+        admitted = []
+
+        def build(domain):
+            with self.scheduler.admit(domain):
+                admitted.append(domain)
+
+        with self.scheduler.admit('one.com'), self.scheduler.admit('two.com'):
+            # 2.5 GiB free, 2 GiB promised to running builds: a third does not fit
+            thread = threading.Thread(target=build, args=('three.com',))
+            thread.start()
+            time.sleep(0.2)
+            self.assertEqual(admitted, [])
+        thread.join(5)
+        self.assertEqual(admitted, ['three.com'])
+
+    def test_waits_for_load(self):
+        """Test builds wait while the host is overloaded"""
+        with self.scheduler.admit('one.com'):
+            with patch('dynapsys.scheduler.os.getloadavg', return_value=(1000.0, 0, 0)):
+                self.assertFalse(self.scheduler._fits(GIB)[0])
+            self.assertTrue(self.scheduler._fits(GIB)[0])
+
+    def test_first_build_always_admitted(self):
+        """Test an idle host admits a build whatever its estimate"""
+        self.scheduler.default_estimate = 100 * GIB
+        with self.scheduler.admit('big.com') as slot:
+            self.assertEqual(slot.estimate, 100 * GIB)
+
+    def test_peak_rss_recorded(self):
+        """Test the peak RSS of the tracked process tree is learned"""
+        script = 'import time; data = bytearray(64 * 1024 * 1024); time.sleep(0.5)'
+        with self.scheduler.admit('test.com') as slot:
+            process = subprocess.Popen([sys.executable, '-c', script])
+            slot.track(process)
+            process.wait()
+        self.assertGreater(slot.peak_rss, 64 * 1024 ** 2)
+        self.assertEqual(slot.rss, 0)
+        self.assertEqual(self.scheduler.estimate('test.com'), int(slot.peak_rss * MEMORY_HEADROOM))
+
+if __name__ == '__main__':
+    unittest.main()
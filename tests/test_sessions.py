@@ -0,0 +1,132 @@
+import unittest
+import io
+import os
+import hashlib
+import tempfile
+import shutil
+import time
+from dynapsys.blobs import BlobStore
+from dynapsys.sessions import MAX_REPORTED_MISSING, MAX_SESSION_CHUNKS, SessionClosedError, UploadSessionStore
+from dynapsys.uploads import UploadError
+
+class TestUploadSessions(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.sessions = UploadSessionStore(os.path.join(self.temp_dir, 'sessions'))
+        self.blobs = BlobStore(os.path.join(self.temp_dir, 'blobs'))
+        self.data = b'0123456789abcdefghij'
+        self.digest = hashlib.sha256(self.data).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, session, index):
+        chunk = self.data[index * session.chunk_size:(index + 1) * session.chunk_size]
+        self.sessions.write_chunk(session, index, io.BytesIO(chunk), len(chunk))
+
+    def test_chunks_out_of_order_and_retried(self):
+        """Test chunks can arrive in any order and be resent"""
+        session = self.sessions.create(len(self.data), self.digest, chunk_size=8)
+        self.assertEqual(session.chunks, 3)
+        self.assertEqual(session.chunk_length(2), 4)
+
+        self.write(session, 2)
+        self.write(session, 0)
+        self.write(session, 0)
+        self.assertEqual(session.missing, [1])
+        with self.assertRaises(UploadError):
+            self.sessions.commit(session, self.blobs)
+
+        self.write(session, 1)
+        self.assertEqual(self.sessions.commit(session, self.blobs), self.digest)
+        with open(self.blobs.path(self.digest), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertIsNone(self.sessions.get(session.id))
+
+    def test_session_survives_restart(self):
+        """Test session state is reloaded from disk"""
+        session = self.sessions.create(len(self.data), self.digest, chunk_size=8)
+        self.write(session, 1)
+
+        reloaded = UploadSessionStore(self.sessions.root).get(session.id)
+        self.assertEqual(reloaded.received, {1})
+        self.assertEqual(reloaded.chunk_size, 8)
+
+    def test_invalid_chunks(self):
+        """Test chunk index and length validation"""
+        session = self.sessions.create(len(self.data), self.digest, chunk_size=8)
+        with self.assertRaises(UploadError):
+            self.sessions.write_chunk(session, 3, io.BytesIO(b'x'), 1)
+        with self.assertRaises(UploadError):
+            self.sessions.write_chunk(session, 0, io.BytesIO(b'short'), 5)
+
+    def test_digest_mismatch_discards_session(self):
+        """Test corrupted uploads are rejected at commit"""
+        session = self.sessions.create(len(self.data), '0' * 64, chunk_size=32)
+        self.write(session, 0)
+        with self.assertRaises(UploadError):
+            self.sessions.commit(session, self.blobs)
+        self.assertIsNone(self.sessions.get(session.id))
+        self.assertFalse(os.path.exists(self.sessions.spool_path(session.id)))
+
+    def test_late_chunks_and_repeated_commits(self):
+        """Test a committed session refuses further chunks and commits"""
+        session = self.sessions.create(len(self.data), self.digest, chunk_size=8)
+        for index in range(3):
+            self.write(session, index)
+
+        # A commit waits for chunks still being written
+        session.writers += 1
+        with self.assertRaises(UploadError):
+            self.sessions.commit(session, self.blobs)
+        session.writers -= 1
+
+        self.assertEqual(self.sessions.commit(session, self.blobs), self.digest)
+        with self.assertRaises(SessionClosedError):
+            self.write(session, 0)
+        with self.assertRaises(SessionClosedError):
+            self.sessions.commit(session, self.blobs)
+        self.assertFalse(os.path.exists(self.sessions._state_path(session.id)))
+
+    def test_expired_spool_file(self):
+        """Test chunks of a session expired meanwhile are refused"""
+        session = self.sessions.create(len(self.data), self.digest, chunk_size=8)
+        os.unlink(self.sessions.spool_path(session.id))
+        with self.assertRaises(SessionClosedError):
+            self.write(session, 0)
+        self.assertEqual(session.writers, 0)
+
+    def test_invalid_session_parameters(self):
+        """Test session creation validation"""
+        with self.assertRaises(UploadError):
+            self.sessions.create(0, self.digest)
+        with self.assertRaises(UploadError):
+            self.sessions.create(10, 'bad')
+        self.assertIsNone(self.sessions.get('../etc'))
+
+    def test_session_limits(self):
+        """Test oversized uploads and huge chunk counts are refused before anything is allocated"""
+        sessions = UploadSessionStore(os.path.join(self.temp_dir, 'limited'), max_bytes=1024)
+        with self.assertRaises(UploadError):
+            sessions.create(1025, self.digest)
+        with self.assertRaises(UploadError):
+            self.sessions.create(10 ** 9, self.digest, chunk_size=1)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'limited')))
+
+        session = self.sessions.create(MAX_SESSION_CHUNKS, self.digest, chunk_size=1)
+        self.sessions.write_chunk(session, 0, io.BytesIO(b'x'), 1)
+        self.assertEqual(session.missing, list(range(1, MAX_REPORTED_MISSING + 1)))
+        self.assertEqual(session.missing_count, MAX_SESSION_CHUNKS - 1)
+
+    def test_expire(self):
+        """Test stale sessions are removed"""
+        session = self.sessions.create(len(self.data), self.digest)
+        old = time.time() - 2 * self.sessions.ttl
+        for path in os.listdir(self.sessions.root):
+            os.utime(os.path.join(self.sessions.root, path), (old, old))
+        self.sessions.expire()
+        self.assertIsNone(self.sessions.get(session.id))
+        self.assertEqual(os.listdir(self.sessions.root), [])
+
+if __name__ == '__main__':
+    unittest.main()
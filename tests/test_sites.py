@@ -0,0 +1,45 @@
+import unittest
+import os
+import shutil
+import tempfile
+from dynapsys.sites import SiteStateStore
+
+class TestSiteState(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = SiteStateStore(os.path.join(self.temp_dir, 'state'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_unknown_domain(self):
+        """Test domains never deployed have empty state"""
+        self.assertEqual(self.store.get('test.com'), {})
+        self.assertIsNone(self.store.live_commit('test.com'))
+        self.assertFalse(self.store.is_live('test.com', None))
+
+    def test_update_merges_fields(self):
+        """Test state is merged and persisted across instances"""
+        commit = 'a' * 40
+        self.store.update('test.com', commit=commit, job_id='1')
+        self.store.update('test.com', job_id='2')
+
+        state = SiteStateStore(self.store.root).get('test.com')
+        self.assertEqual(state['commit'], commit)
+        self.assertEqual(state['job_id'], '2')
+        self.assertTrue(self.store.is_live('test.com', commit))
+        self.assertFalse(self.store.is_live('other.com', commit))
+
+        self.store.update('test.com', commit=None)
+        self.assertFalse(self.store.is_live('test.com', commit))
+        self.assertEqual(os.listdir(self.store.root), ['test.com.json'])
+
+    def test_corrupt_state_is_ignored(self):
+        """Test unreadable state files count as unknown"""
+        os.makedirs(self.store.root)
+        with open(os.path.join(self.store.root, 'test.com.json'), 'w') as f:
+            f.write('{not json')
+        self.assertEqual(self.store.get('test.com'), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import unittest
+import io
+import os
+import tarfile
+import tempfile
+import shutil
+from dynapsys.uploads import (
+    UploadError,
+    DecompressingReader,
+    LimitedReader,
+    copy_stream,
+    detect_compression,
+    receive_upload,
+    extract_archive,
+    extract_stream,
+    zstandard
+)
+
+def make_tarball(path, files, mode='w:gz'):
+    """Create a tarball from a {name: bytes} mapping"""
+    with tarfile.open(path, mode) as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+def tar_bytes(files, mode='w'):
+    """Return an uncompressed tarball of a {name: bytes} mapping"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+class ChunkRecorder(io.BytesIO):
+    """BytesIO remembering the size of every read"""
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+class TestUploads(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_copy_stream_chunks(self):
+        """Test bodies are copied in bounded chunks"""
+        source = ChunkRecorder(b'x' * 1000)
+        target = io.BytesIO()
+        self.assertEqual(copy_stream(source, target, 1000, chunk_size=300), 1000)
+        self.assertEqual(target.getvalue(), b'x' * 1000)
+        self.assertTrue(all(size <= 300 for size in source.reads))
+
+    def test_copy_stream_truncated(self):
+        """Test short bodies are reported"""
+        with self.assertRaises(UploadError):
+            copy_stream(io.BytesIO(b'abc'), io.BytesIO(), 10)
+
+    def test_receive_upload(self):
+        """Test uploads are spooled to the uploads directory"""
+        path = receive_upload(io.BytesIO(b'data'), 4, self.temp_dir, chunk_size=2)
+        self.assertTrue(path.startswith(self.temp_dir))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+
+    def test_receive_upload_truncated_removes_spool(self):
+        """Test failed uploads leave nothing behind"""
+        with self.assertRaises(UploadError):
+            receive_upload(io.BytesIO(b'da'), 4, self.temp_dir)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_extract_archive_hoists_project_directory(self):
+        """Test a single wrapping directory is flattened into the site root"""
+        archive = os.path.join(self.temp_dir, 'site.tar.gz')
+        make_tarball(archive, {
+            'project/package.json': b'{}',
+            'project/src/index.js': b'console.log(1)'
+        })
+        target = os.path.join(self.temp_dir, 'site')
+        extract_archive(archive, target)
+        self.assertTrue(os.path.exists(os.path.join(target, 'package.json')))
+        self.assertTrue(os.path.exists(os.path.join(target, 'src', 'index.js')))
+
+    def test_extract_archive_rejects_traversal(self):
+        """Test members escaping the target directory are rejected"""
+        archive = os.path.join(self.temp_dir, 'evil.tar.gz')
+        make_tarball(archive, {'../evil.txt': b'x'})
+        with self.assertRaises(UploadError):
+            extract_archive(archive, os.path.join(self.temp_dir, 'site'))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'evil.txt')))
+
+    def test_detect_compression(self):
+        """Test archive formats are recognized by magic bytes"""
+        self.assertEqual(detect_compression(b'\x1f\x8b\x08'), 'gzip')
+        self.assertEqual(detect_compression(b'\xfd7zXZ\x00\x00'), 'xz')
+        self.assertEqual(detect_compression(b'\x28\xb5\x2f\xfd'), 'zstd')
+        self.assertEqual(detect_compression(tar_bytes({'a': b'1'})[:512]), 'tar')
+        with self.assertRaises(UploadError):
+            detect_compression(b'PK\x03\x04')
+
+    def test_extract_stream_formats(self):
+        """Test gzip, xz and plain tar streams are unpacked in one pass"""
+        for mode, expected in (('w:gz', 'gzip'), ('w:xz', 'xz'), ('w', 'tar')):
+            archive = os.path.join(self.temp_dir, f'site-{expected}.tar')
+            make_tarball(archive, {'package.json': b'{}', 'src/app.js': b'app'}, mode)
+            target = os.path.join(self.temp_dir, expected)
+            with open(archive, 'rb') as f:
+                body = LimitedReader(f, os.path.getsize(archive))
+                self.assertEqual(extract_stream(body, target, chunk_size=100), expected)
+                body.drain()
+            with open(os.path.join(target, 'src', 'app.js'), 'rb') as f:
+                self.assertEqual(f.read(), b'app')
+
+    @unittest.skipIf(zstandard is None, 'zstandard not installed')
+    def test_extract_stream_zstd(self):
+        """Test zstd streams are unpacked"""
+        data = zstandard.ZstdCompressor().compress(tar_bytes({'package.json': b'{}'}))
+        target = os.path.join(self.temp_dir, 'zstd')
+        self.assertEqual(extract_stream(io.BytesIO(data), target), 'zstd')
+        self.assertTrue(os.path.exists(os.path.join(target, 'package.json')))
+
+    def test_extract_stream_rejects_escaping_symlink(self):
+        """Test symlinks pointing outside the target are rejected"""
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            info = tarfile.TarInfo('link')
+            info.type = tarfile.SYMTYPE
+            info.linkname = '../../etc/passwd'
+            tar.addfile(info)
+        buffer.seek(0)
+        with self.assertRaises(UploadError):
+            extract_stream(buffer, os.path.join(self.temp_dir, 'site'))
+
+    def test_extract_stream_corrupt_archive(self):
+        """Test corrupt archives raise UploadError"""
+        data = b'\x1f\x8b' + b'garbage' * 100
+        with self.assertRaises(UploadError):
+            extract_stream(io.BytesIO(data), os.path.join(self.temp_dir, 'site'))
+    def test_decompression_steps_are_bounded(self):
+        """Test a highly compressed chunk is expanded one bounded step at a time"""
+        files = {'zeros': b'\0' * (1024 * 1024)}
+        data = tar_bytes(files)
+        archives = {'gzip': tar_bytes(files, 'w:gz'), 'xz': tar_bytes(files, 'w:xz')}
+        if zstandard is not None:
+            archives['zstd'] = zstandard.ZstdCompressor().compress(data)
+        for compression, archive in archives.items():
+            reader = DecompressingReader(io.BytesIO(archive), compression, chunk_size=4096)
+            steps = []
+            while True:
+                output = reader._step()
+                if not output:
+                    break
+                steps.append(len(output))
+            self.assertLessEqual(max(steps), 4096, compression)
+            self.assertEqual(sum(steps), len(data), compression)
+
+    def test_extract_stream_size_limit(self):
+        """Test archives expanding beyond the limit raise UploadError"""
+        files = {'package.json': b'{}', 'zeros': b'\0' * (1024 * 1024)}
+        for mode in ('w:gz', 'w:xz', 'w'):
+            archive = io.BytesIO(tar_bytes(files, mode))
+            with self.assertRaises(UploadError):
+                extract_stream(archive, os.path.join(self.temp_dir, mode), max_bytes=64 * 1024)
+        target = os.path.join(self.temp_dir, 'fits')
+        extract_stream(io.BytesIO(tar_bytes(files, 'w:gz')), target, max_bytes=4 * 1024 * 1024)
+        self.assertEqual(os.path.getsize(os.path.join(target, 'zeros')), 1024 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
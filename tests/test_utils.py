@@ -1,5 +1,6 @@
 import unittest
 import os
+import sys
 import json
 import tempfile
 import logging
@@ -8,6 +9,7 @@ from unittest.mock import patch, MagicMock
 from dynapsys.utils import (
     ensure_directory,
     run_command,
+    stream_command,
     load_json_file,
     save_json_file,
     is_port_in_use,
@@ -154,10 +156,42 @@ class TestUtils(unittest.TestCase):
             '-invalid.com',
             'invalid-.com',
             'invalid..com',
+            'example.com\n',
+            '../example.com',
+            None,
+            42,
         ]
         for domain in invalid_domains:
             self.assertFalse(is_valid_domain(domain))
 
+    def test_stream_command(self):
+        """Test command output is returned line by line with stderr merged"""
+        script = "import sys; print('one'); print('two', file=sys.stderr); sys.exit(3)"
+        returncode, tail = stream_command([sys.executable, '-c', script], tail_lines=5)
+        self.assertEqual(returncode, 3)
+        self.assertEqual(tail, ['one', 'two'])
+
+        returncode, tail = stream_command(['nonexistent-command-xyz'])
+        self.assertEqual(returncode, -1)
+
+        started = []
+        stream_command([sys.executable, '-c', 'pass'], on_start=started.append)
+        self.assertEqual(started[0].returncode, 0)
+
+    def test_stream_command_reads_both_pipes(self):
+        """Test a chatty stderr cannot stall a command and progress is not logged"""
+        script = (
+            "import sys\n"
+            "for i in range(5000): sys.stderr.write('noise %d\\n' % i)\n"
+            "sys.stderr.write('Receiving: 1%\\rReceiving: 50%\\rReceiving: 100%, done.\\n')\n"
+            "print('finished')\n"
+        )
+        seen = []
+        returncode, tail = stream_command([sys.executable, '-c', script], tail_lines=2, on_line=seen.append)
+        self.assertEqual(returncode, 0)
+        self.assertIn('Receiving: 50%', seen)
+        self.assertEqual(sorted(tail), ['Receiving: 100%, done.', 'finished'])
+
     def test_setup_logging(self):
         """Test logging setup"""
         log_file = os.path.join(self.temp_dir, 'logs', 'test.log')